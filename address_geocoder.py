@@ -3,17 +3,175 @@ import aiohttp
 import sqlite3
 import json
 import os
+import random
+import time
 import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
+import geocode_cache
+from pipeline_metrics import record_rows
+from setup_database import collapse_geolocation_duplicates
 
 load_dotenv()
 APPLE_MAPS_API_TOKEN = os.getenv("APPLE_MAPS_API_TOKEN")
+APPLE_MAPS_BASE_URL = os.getenv("APPLE_MAPS_BASE_URL", "https://maps-api.apple.com")
+
+# Worker pool tuning
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GEOCODER_MAX_CONCURRENCY", "80"))
+MIN_CONCURRENT_REQUESTS = 4
+TARGET_LATENCY_SECONDS = 1.0
+MAX_ERROR_RATE = 0.05
+REQUEST_TIMEOUT_SECONDS = 4
+
+# Access token handling
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+TOKEN_DEFAULT_LIFETIME_SECONDS = 1800
+MAX_TOKEN_ATTEMPTS = 3
+TOKEN_RETRY_DELAY_SECONDS = 0.5
+MAX_AUTH_RETRIES = 2
+
+# Client-side rate limiting and retries
+REQUESTS_PER_SECOND = float(os.getenv("GEOCODER_REQUESTS_PER_SECOND", "50"))
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 30
+MAX_RETRY_AFTER_SECONDS = 120
+
+# Streaming persistence of results
+WRITE_BATCH_SIZE = 500
+COMMIT_INTERVAL_SECONDS = float(os.getenv("GEOCODER_COMMIT_INTERVAL_SECONDS", "5"))
+
+class RateLimiter:
+    """
+    Token bucket shared by every worker, refilled at `rate` requests per second.
+    A pause (from a 429 Retry-After) stops all workers and empties the bucket,
+    so the pool resumes at the steady rate instead of bursting back into the quota.
+    """
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Holds every request back for the given number of seconds."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.updated = self.paused_until
+        self.tokens = 0
+
+    async def acquire(self):
+        """Waits until a request may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header given in seconds or as an HTTP date.
+    Returns the delay in seconds, capped at MAX_RETRY_AFTER_SECONDS, or None when absent or invalid.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+def backoff_delay(failures):
+    """Exponential backoff with full jitter for the given number of failed attempts."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (failures - 1)))
+
+def new_stats():
+    """Counters shared by the workers of one geocoding run."""
+    return {'cached': 0, 'requests': 0, 'retries': 0, 'throttled': 0, 'failed': 0, 'attempts': Counter()}
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight and adapts the limit to observed latency and errors.
+    Outcomes are judged per window of `limit` requests: the limit is cut by a quarter when more than
+    max_error_rate of the window failed, lowered by one when the smoothed latency is over target
+    and raised by one otherwise. Isolated errors therefore do not collapse the pool.
+    """
+    def __init__(self, initial, minimum=MIN_CONCURRENT_REQUESTS, maximum=MAX_CONCURRENT_REQUESTS, target_latency=TARGET_LATENCY_SECONDS, max_error_rate=MAX_ERROR_RATE):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.latency = None
+        self.in_flight = 0
+        self._outcomes = 0
+        self._errors = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency, ok):
+        """Feed one request outcome back into the limit."""
+        self._outcomes += 1
+        if ok:
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        else:
+            self._errors += 1
+        if self._outcomes < self.limit:
+            return
+        if self._errors > self.max_error_rate * self._outcomes:
+            self.limit = max(self.minimum, int(self.limit * 0.75))
+        elif self.latency is not None and self.latency > self.target_latency:
+            self.limit = max(self.minimum, self.limit - 1)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        self._outcomes = 0
+        self._errors = 0
+
+def create_session(trace_configs=None, max_workers=MAX_CONCURRENT_REQUESTS):
+    """
+    Creates the single HTTP session shared by the token request and every geocoding worker.
+    Connections are kept alive and DNS answers cached so workers reuse sockets instead of reconnecting.
+    The connector holds a connection for each of max_workers (the most the adaptive limit can
+    reach) plus one for the token request, so it never caps the worker pool on its own.
+    trace_configs are passed to aiohttp, e.g. to time requests in a load test.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=max_workers + 1,
+        limit_per_host=max_workers + 1,
+        ttl_dns_cache=300,
+        keepalive_timeout=30
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
 
 async def get_access_token(session):
     """
     Retrieves a new access token from the authentication endpoint.
+    Returns the token and its lifetime in seconds, or (None, None) on failure.
     """
-    url = "https://maps-api.apple.com/v1/token"
+    url = f"{APPLE_MAPS_BASE_URL}/v1/token"
     headers = {
         'Authorization': f'Bearer {APPLE_MAPS_API_TOKEN}'
     }
@@ -21,114 +179,387 @@ async def get_access_token(session):
         async with session.post(url, headers=headers) as response:
             if response.status == 200:
                 data = await response.json()
-                return data['accessToken']
+                return data['accessToken'], data.get('expiresInSeconds', TOKEN_DEFAULT_LIFETIME_SECONDS)
             else:
                 print(f"Error obtaining access token: HTTP {response.status}")
-                return None
+                return None, None
     except Exception as e:
         print(f"Error obtaining access token: {e}")
-        return None
+        return None, None
 
-async def geocode_address(session, address_hash, address, city, state_code, zip_code, api_token):
+class TokenManager:
+    """
+    Holds the access token shared by every geocoding worker.
+    The token is refreshed shortly before it expires, and refreshes are single-flight: workers that
+    hit a 401 at the same time wait on one refresh instead of each requesting a new token.
+    """
+    def __init__(self, session, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS, max_attempts=MAX_TOKEN_ATTEMPTS, retry_delay=TOKEN_RETRY_DELAY_SECONDS):
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.token = None
+        self.refresh_at = 0
+        self.refresh_count = 0
+        self.exhausted = False
+        self._lock = asyncio.Lock()
+
+    def _expiring(self):
+        return time.monotonic() >= self.refresh_at
+
+    async def get(self):
+        """Returns a valid token, refreshing it first if it is missing or about to expire."""
+        if self.token is None or self._expiring():
+            return await self.refresh(self.token)
+        return self.token
+
+    async def refresh(self, stale_token):
+        """
+        Replaces stale_token with a new token and returns it, or None after max_attempts failures.
+        If another worker already replaced stale_token, its token is returned without a new request.
+        Once the attempts are exhausted every later call returns None without contacting the endpoint.
+        """
+        async with self._lock:
+            if self.exhausted:
+                return None
+            if self.token is not None and self.token != stale_token and not self._expiring():
+                return self.token
+            for attempt in range(self.max_attempts):
+                token, lifetime = await get_access_token(self.session)
+                if token:
+                    self.token = token
+                    # Short-lived tokens are refreshed at half their lifetime at the latest
+                    self.refresh_at = time.monotonic() + lifetime - min(self.refresh_margin, lifetime / 2)
+                    self.refresh_count += 1
+                    return token
+                if attempt + 1 < self.max_attempts:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            print(f"Giving up on the access token after {self.max_attempts} attempts.")
+            self.token = None
+            self.exhausted = True
+            return None
+
+async def geocode_address(session, address_hash, address, city, state_code, zip_code, tokens, cache=None, limiter=None, rate_limiter=None, stats=None):
     """
     Sends a geocode request to the Apple Maps API for a given address.
+    The access token comes from the shared TokenManager; a 401 triggers at most MAX_AUTH_RETRIES refreshes.
+    Timeouts, connection errors, 5xx and 429 answers are retried up to MAX_ATTEMPTS times with jittered
+    exponential backoff, or after the Retry-After delay of a 429. Other errors are permanent.
+    Successful answers and "no results" answers are written to the geocode cache when one is given.
+    The request outcome and latency are reported to the limiter, requests are paced by the rate limiter
+    and attempt counts are added to stats when those are given.
     """
     full_address = f"{address}, {city}, {state_code}, {zip_code}"
     encoded_address = urllib.parse.quote(full_address)
-    url = f"https://maps-api.apple.com/v1/geocode?q={encoded_address}"
-    headers = {
-        'Authorization': f'Bearer {api_token}'
-    }
-    try:
-        async with session.get(url, headers=headers, timeout=4) as response:
-            if response.status == 401:
-                print(f"Token expired for address {full_address}, refreshing token.")
-                new_token = await get_access_token(session)
-                if new_token:
-                    return await geocode_address(session, address_hash, address, city, state_code, zip_code, new_token)
+    url = f"{APPLE_MAPS_BASE_URL}/v1/geocode?q={encoded_address}"
+    attempts = 0
+    failures = 0
+    auth_refreshes = 0
+    result = None
+    while True:
+        api_token = await tokens.get()
+        if api_token is None:
+            print(f"No access token available for address {full_address}.")
+            break
+        headers = {
+            'Authorization': f'Bearer {api_token}'
+        }
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        attempts += 1
+        retry_after = None
+        started = time.monotonic()
+        try:
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)) as response:
+                if response.status == 401:
+                    if auth_refreshes >= MAX_AUTH_RETRIES:
+                        print(f"Still unauthorized after {MAX_AUTH_RETRIES} token refreshes for address {full_address}.")
+                        break
+                    print(f"Token expired for address {full_address}, refreshing token.")
+                    auth_refreshes += 1
+                    await tokens.refresh(api_token)
+                    continue
+                retryable = response.status == 429 or response.status >= 500
+                if limiter is not None:
+                    limiter.record(time.monotonic() - started, not retryable)
+                if response.status == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if stats is not None:
+                        stats['throttled'] += 1
+                if response.status != 200:
+                    print(f"Error fetching data for address {full_address}: HTTP {response.status}")
+                    if not retryable:
+                        break
                 else:
-                    print(f"Error refreshing token for address {full_address}.")
-                    return None
-            if response.status != 200:
-                print(f"Error fetching data for address {full_address}: HTTP {response.status}")
-                return None
-            data = await response.json()
-            if 'error' in data or len(data.get('results', [])) == 0:
-                print(f"Error geocoding address {full_address}: {data}")
-                return None
-            latitude = data['results'][0]['coordinate']['latitude']
-            longitude = data['results'][0]['coordinate']['longitude']
-            return {
-                'address_hash': address_hash,
-                'latitude': latitude,
-                'longitude': longitude
-            }
-    except asyncio.TimeoutError:
-        print(f"Request timed out for address {full_address}")
-    except Exception as e:
-        print(f"Request failed for address {full_address}: {e}")
-    return None
+                    data = await response.json()
+                    if 'error' in data:
+                        print(f"Error geocoding address {full_address}: {data}")
+                        break
+                    address_key = geocode_cache.canonical_address(address, city, state_code, zip_code)
+                    if len(data.get('results', [])) == 0:
+                        print(f"No results for address {full_address}")
+                        if cache is not None:
+                            geocode_cache.store_not_found(cache, address_key, attempts=attempts)
+                        break
+                    latitude = data['results'][0]['coordinate']['latitude']
+                    longitude = data['results'][0]['coordinate']['longitude']
+                    if cache is not None:
+                        geocode_cache.store(cache, address_key, latitude, longitude, attempts=attempts)
+                    result = {
+                        'address_hash': address_hash,
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'attempts': attempts
+                    }
+                    break
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            print(f"Request failed for address {full_address}: {e!r}")
+            if limiter is not None:
+                limiter.record(time.monotonic() - started, False)
+        except Exception as e:
+            print(f"Request failed for address {full_address}: {e}")
+            break
+        failures += 1
+        if failures >= MAX_ATTEMPTS:
+            print(f"Giving up on address {full_address} after {attempts} attempts.")
+            break
+        if stats is not None:
+            stats['retries'] += 1
+        if retry_after is not None:
+            if rate_limiter is not None:
+                rate_limiter.pause(retry_after)
+            await asyncio.sleep(retry_after)
+        else:
+            await asyncio.sleep(backoff_delay(failures))
+    if stats is not None:
+        stats['requests'] += attempts
+        stats['attempts'][attempts] += 1
+        if result is None:
+            stats['failed'] += 1
+    return result
 
-def load_addresses_from_db(db_path):
+# The distinct addresses that still need an API geocode, in priority order: first the ones without
+# coordinates, streamed in address_hash order off idx_addresses_hash through an indexed anti-join,
+# then the ZIP centroids shared by the most entities. Only the ZIP-precision rows (read through
+# idx_address_geolocation_precision) are counted and sorted, so upgrades to rooftop accuracy land
+# where they matter most without sorting the whole pending set.
+PENDING_ADDRESSES_QUERIES = [
+    """
+    SELECT a.address_hash, a.address, a.city, s.state_code, a.zip_code
+    FROM addresses a
+    JOIN states s ON a.state_id = s.state_id
+    LEFT JOIN address_geolocation g ON g.address_hash = a.address_hash
+    WHERE g.address_hash IS NULL
+    GROUP BY a.address_hash
+    """,
+    """
+    SELECT a.address_hash, a.address, a.city, s.state_code, a.zip_code
+    FROM address_geolocation g
+    JOIN addresses a ON a.address_hash = g.address_hash
+    JOIN states s ON a.state_id = s.state_id
+    WHERE g."precision" = 'zip'
+    GROUP BY g.address_hash
+    ORDER BY COUNT(*) DESC, g.address_hash
+    """,
+]
+
+def prepare_geolocation_table(db_path):
+    """
+    Prepares a database for incremental geocoding.
+    Switches it to WAL so the pending-work cursor and the result writer can run side by side,
+    adds the precision column to tables created before it existed, collapses address_geolocation
+    to one row per address_hash and creates the indexes the pending-work query and the upsert
+    rely on (setup_database recreates addresses without them).
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(address_geolocation)")]
+    if "precision" not in columns:
+        conn.execute("""ALTER TABLE address_geolocation ADD COLUMN "precision" TEXT NOT NULL DEFAULT 'rooftop'""")
+    collapse_geolocation_duplicates(conn)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_address_geolocation_hash ON address_geolocation (address_hash)")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_address_geolocation_precision ON address_geolocation ("precision", address_hash)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_addresses_hash ON addresses (address_hash)")
+    conn.commit()
+    conn.close()
+
+def iter_pending_addresses(db_path, batch_size=1000):
     """
-    Loads addresses from the SQLite database that are not already in the address_geolocation table.
+    Streams the distinct addresses that still need an API geocode, in priority order.
+    Rows are fetched batch_size at a time so memory does not grow with the address count.
     Normalizes zip codes to ensure they have 5 digits by padding with leading zeros.
     """
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    try:
+        for query in PENDING_ADDRESSES_QUERIES:
+            cursor = conn.execute(query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {
+                        'address_hash': row[0],
+                        'address': row[1],
+                        'city': row[2],
+                        'state_code': row[3],
+                        'zip_code': str(row[4]).zfill(5)
+                    }
+    finally:
+        conn.close()
 
-    query = """
-        SELECT a.address_hash, a.address, a.city, s.State_code, a.zip_code
-        FROM addresses a
-        JOIN states s ON a.state_id = s.state_id
-        WHERE a.address_hash NOT IN (SELECT address_hash FROM address_geolocation);
+def load_addresses_from_db(db_path):
     """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
+    Loads the distinct addresses that still need an API geocode, in priority order.
+    """
+    return list(iter_pending_addresses(db_path))
 
-    addresses = [
-        {
-            'address_hash': row[0],
-            'address': row[1],
-            'city': row[2],
-            'state_code': row[3],
-            'zip_code': str(row[4]).zfill(5)
-        }
-        for row in rows
-    ]
-    return addresses
+def check_cache(cache, address):
+    """
+    Looks an address up in the geocode cache.
+    Returns (True, result) for a cached answer, where result is None for a cached "no results",
+    and (False, None) when the API has to be asked.
+    """
+    address_key = geocode_cache.canonical_address(address['address'], address['city'], address['state_code'], address['zip_code'])
+    cached = geocode_cache.lookup(cache, address_key)
+    if cached is None:
+        return False, None
+    if cached['status'] != geocode_cache.STATUS_OK:
+        return True, None
+    return True, {
+        'address_hash': address['address_hash'],
+        'latitude': cached['latitude'],
+        'longitude': cached['longitude']
+    }
+
+INSERT_GEOLOCATION_QUERY = """
+    INSERT INTO address_geolocation (address_hash, latitude, longitude, "precision")
+    VALUES (?, ?, ?, 'rooftop')
+    ON CONFLICT (address_hash) DO UPDATE SET
+        latitude = excluded.latitude, longitude = excluded.longitude, "precision" = excluded."precision"
+"""
+
+def insert_results(conn, results):
+    """
+    Inserts a batch of geocoding results and commits it.
+    """
+    conn.executemany(INSERT_GEOLOCATION_QUERY, [(r['address_hash'], r['latitude'], r['longitude']) for r in results])
+    conn.commit()
 
 def save_results_to_db(results, db_path):
     """
     Saves the geocoding results to the address_geolocation table in the SQLite database.
     """
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    insert_results(conn, results)
+    conn.close()
+    print(f"Saved {len(results)} geocoding results to the database.")
 
-    insert_query = """
-        INSERT INTO address_geolocation (address_hash, latitude, longitude)
-        VALUES (?, ?, ?)
+async def write_results(results_queue, db_path, cache=None, batch_size=WRITE_BATCH_SIZE, commit_interval=COMMIT_INTERVAL_SECONDS):
+    """
+    Consumes geocoding results from the queue until it receives None and commits them to
+    address_geolocation over one long-lived connection.
+    A checkpoint is written every batch_size results or every commit_interval seconds, whichever
+    comes first, and also commits the geocode cache. Inserts run in a writer thread so disk writes
+    overlap with the network requests. Whatever is pending is committed if the task is cancelled.
+    Returns the number of results saved.
     """
-    cursor.executemany(insert_query, [(r['address_hash'], r['latitude'], r['longitude']) for r in results])
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    pending = []
+    saved = 0
+    last_commit = time.monotonic()
 
-    conn.commit()
-    conn.close()
-    print(f"Saved {len(results)} geocoding results to the database.")
+    def write_batch(batch):
+        nonlocal saved
+        insert_results(conn, batch)
+        saved += len(batch)
+
+    try:
+        while True:
+            timeout = max(0.0, commit_interval - (time.monotonic() - last_commit))
+            try:
+                result = await asyncio.wait_for(results_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                result = False
+            if result is None:
+                break
+            if result:
+                pending.append(result)
+            if len(pending) >= batch_size or time.monotonic() - last_commit >= commit_interval:
+                batch, pending = pending, []
+                await loop.run_in_executor(executor, write_batch, batch)
+                if cache is not None:
+                    cache.commit()
+                last_commit = time.monotonic()
+    finally:
+        # Let a batch already in the writer thread finish before the final checkpoint
+        executor.shutdown(wait=True)
+        if pending:
+            write_batch(pending)
+        if cache is not None:
+            cache.commit()
+        conn.close()
+        print(f"Saved {saved} geocoding results to the database.")
+    return saved
 
-async def process_addresses(addresses, api_token):
+async def process_addresses(addresses, tokens, cache=None, session=None, max_workers=MAX_CONCURRENT_REQUESTS, requests_per_second=REQUESTS_PER_SECOND, stats=None, results_queue=None):
     """
-    Processes a list of addresses and performs geocoding in parallel using chunks.
+    Geocodes addresses (any iterable, consumed lazily) with a continuous pool of workers fed from a bounded queue.
+    Addresses answered by the geocode cache never reach the API.
+    Each worker picks up the next address as soon as its request finishes, so one slow answer
+    never holds back the others. The number of requests in flight adapts to latency and errors.
+    Requests go over the given session, or the token manager's session when none is given,
+    and are paced to requests_per_second by a shared token bucket.
+    With a results_queue, results are handed to it as they arrive (for write_results) and the
+    returned list stays empty; otherwise they are collected and returned.
     """
-    MAX_CONCURRENT_REQUESTS = 80
     results = []
-    async with aiohttp.ClientSession() as session:
-        for i in range(0, len(addresses), MAX_CONCURRENT_REQUESTS):
-            chunk = addresses[i:i + MAX_CONCURRENT_REQUESTS]
-            chunk_results = await asyncio.gather(
-                *(geocode_address(session, address['address_hash'], address['address'], address['city'], address['state_code'], address['zip_code'], api_token) for address in chunk)
-            )
-            results.extend(filter(None, chunk_results))
+    stats = new_stats() if stats is None else stats
+    rate_limiter = RateLimiter(requests_per_second)
+    queue = asyncio.Queue(maxsize=max_workers * 2)
+    limiter = AdaptiveConcurrency(initial=max_workers // 2, minimum=min(MIN_CONCURRENT_REQUESTS, max_workers), maximum=max_workers)
+
+    async def producer():
+        for address in addresses:
+            await queue.put(address)
+        for _ in range(max_workers):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            address = await queue.get()
+            if address is None:
+                return
+            cached, result = check_cache(cache, address) if cache is not None else (False, None)
+            if cached:
+                stats['cached'] += 1
+            else:
+                async with limiter:
+                    result = await geocode_address(session, address['address_hash'], address['address'], address['city'], address['state_code'], address['zip_code'], tokens, cache, limiter, rate_limiter, stats)
+            if result:
+                if results_queue is not None:
+                    await results_queue.put(result)
+                else:
+                    results.append(result)
+
+    if session is None:
+        session = tokens.session
+    connection_limit = getattr(session.connector, "limit", 0) if session is not None else 0
+    if connection_limit and connection_limit < max_workers:
+        print(f"The session allows {connection_limit} connections, fewer than the {max_workers} workers; create it with create_session(max_workers={max_workers}).")
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(max_workers)))
+    finally:
+        # Without a writer nothing else commits the cache rows stored by the workers
+        if cache is not None:
+            cache.commit()
+    processed = sum(stats['attempts'].values())
+    record_rows(processed)
+    print(f"Geocoded {processed - stats['failed']} of {processed} addresses (final concurrency limit {limiter.limit}).")
+    print(f"Cache hits: {stats['cached']}, requests: {stats['requests']}, retries: {stats['retries']}, throttled: {stats['throttled']}, failed: {stats['failed']}, "
+          f"attempts per address: {dict(sorted(stats['attempts'].items()))}")
     return results
 
 async def main():
@@ -136,22 +567,26 @@ async def main():
     Main function to orchestrate loading data, performing geocoding, and saving results.
     """
     db_path = 'facilities.db'
+    prepare_geolocation_table(db_path)
 
-    # Load addresses that need geocoding
-    addresses = load_addresses_from_db(db_path)
-
-    if not addresses:
-        print("No addresses found that need geocoding.")
-        return
-
-    # Get access token and perform geocoding
-    async with aiohttp.ClientSession() as session:
-        access_token = await get_access_token(session)
-        if access_token:
-            results = await process_addresses(addresses, access_token)
-            save_results_to_db(results, db_path)
-        else:
-            print("Failed to obtain access token.")
+    # Stream the addresses that need geocoding; the cache is consulted before any HTTP request
+    # and the access token is only requested once an address misses the cache
+    addresses = iter_pending_addresses(db_path)
+    cache = geocode_cache.open_cache()
+    results_queue = asyncio.Queue(maxsize=WRITE_BATCH_SIZE * 2)
+    writer = asyncio.create_task(write_results(results_queue, db_path, cache))
+    try:
+        async with create_session() as session:
+            tokens = TokenManager(session)
+            await process_addresses(addresses, tokens, cache, session, results_queue=results_queue)
+        await results_queue.put(None)
+        await writer
+    finally:
+        if not writer.done():
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+        addresses.close()
+        cache.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+USPS-style normalization of addresses before they are keyed, so "123 Main St Suite 4" and
+"123 MAIN STREET STE 4" get one address_hash.
+"""
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from dtype_policy import KEY, STRING
+from stable_keys import address_strings, legacy_keys, stable_key, stable_keys
+
+# USPS Publication 28, appendix C1: the common street suffixes
+STREET_SUFFIXES = {
+    "ALLEY": "ALY", "ANNEX": "ANX", "ARCADE": "ARC", "AVENUE": "AVE", "AV": "AVE", "AVEN": "AVE", "AVNUE": "AVE",
+    "BAYOU": "BYU", "BEACH": "BCH", "BEND": "BND", "BLUFF": "BLF", "BOTTOM": "BTM", "BOULEVARD": "BLVD", "BOULV": "BLVD",
+    "BRANCH": "BR", "BRIDGE": "BRG", "BROOK": "BRK", "BYPASS": "BYP", "CAMP": "CP", "CANYON": "CYN", "CAPE": "CPE",
+    "CAUSEWAY": "CSWY", "CENTER": "CTR", "CENTRE": "CTR", "CIRCLE": "CIR", "CIRCL": "CIR", "CLIFF": "CLF", "CLUB": "CLB",
+    "COMMON": "CMN", "CORNER": "COR", "COURSE": "CRSE", "COURT": "CT", "COVE": "CV", "CREEK": "CRK", "CRESCENT": "CRES",
+    "CROSSING": "XING", "DALE": "DL", "DAM": "DM", "DIVIDE": "DV", "DRIVE": "DR", "DRIV": "DR", "DRV": "DR",
+    "ESTATE": "EST", "ESTATES": "ESTS", "EXPRESSWAY": "EXPY", "EXPRESS": "EXPY", "EXTENSION": "EXT", "FALLS": "FLS",
+    "FERRY": "FRY", "FIELD": "FLD", "FIELDS": "FLDS", "FLAT": "FLT", "FORD": "FRD", "FOREST": "FRST", "FORGE": "FRG",
+    "FORK": "FRK", "FREEWAY": "FWY", "GARDEN": "GDN", "GARDENS": "GDNS", "GATEWAY": "GTWY", "GLEN": "GLN", "GREEN": "GRN",
+    "GROVE": "GRV", "HARBOR": "HBR", "HAVEN": "HVN", "HEIGHTS": "HTS", "HIGHWAY": "HWY", "HIGHWY": "HWY", "HILL": "HL",
+    "HILLS": "HLS", "HOLLOW": "HOLW", "ISLAND": "IS", "JUNCTION": "JCT", "KNOLL": "KNL", "LAKE": "LK", "LAKES": "LKS",
+    "LANDING": "LNDG", "LANE": "LN", "LIGHT": "LGT", "LOOP": "LOOP", "MANOR": "MNR", "MEADOW": "MDW", "MEADOWS": "MDWS",
+    "MILL": "ML", "MISSION": "MSN", "MOTORWAY": "MTWY", "MOUNT": "MT", "MOUNTAIN": "MTN", "ORCHARD": "ORCH", "OVAL": "OVAL",
+    "PARKWAY": "PKWY", "PARKWY": "PKWY", "PKY": "PKWY", "PASSAGE": "PSGE", "PIKE": "PIKE", "PINES": "PNES", "PLACE": "PL",
+    "PLAIN": "PLN", "PLAINS": "PLNS", "PLAZA": "PLZ", "POINT": "PT", "PORT": "PRT", "PRAIRIE": "PR", "RANCH": "RNCH",
+    "RAPIDS": "RPDS", "RIDGE": "RDG", "RIVER": "RIV", "ROAD": "RD", "ROUTE": "RTE", "SHORE": "SHR", "SKYWAY": "SKWY",
+    "SPRING": "SPG", "SPRINGS": "SPGS", "SQUARE": "SQ", "STATION": "STA", "STREAM": "STRM", "STREET": "ST", "STR": "ST",
+    "SUMMIT": "SMT", "TERRACE": "TER", "TRACE": "TRCE", "TRAIL": "TRL", "TURNPIKE": "TPKE", "TUNNEL": "TUNL",
+    "UNION": "UN", "VALLEY": "VLY", "VIADUCT": "VIA", "VIEW": "VW", "VILLAGE": "VLG", "VILLE": "VL", "VISTA": "VIS",
+    "WALK": "WALK", "WELL": "WL", "WELLS": "WLS",
+}
+# USPS Publication 28, appendix C2: secondary unit designators
+UNIT_DESIGNATORS = {
+    "APARTMENT": "APT", "BASEMENT": "BSMT", "BUILDING": "BLDG", "DEPARTMENT": "DEPT", "FLOOR": "FL", "FRONT": "FRNT",
+    "HANGAR": "HNGR", "LOBBY": "LBBY", "LOWER": "LOWR", "OFFICE": "OFC", "PENTHOUSE": "PH", "ROOM": "RM", "SPACE": "SPC",
+    "SUITE": "STE", "SUIT": "STE", "UPPER": "UPPR",
+}
+DIRECTIONALS = {
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "NORTHEAST": "NE", "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW",
+}
+CITY_WORDS = {"SAINT": "ST", "SAINTE": "STE", "FORT": "FT", "MOUNT": "MT"}
+
+STREET_WORDS = {**STREET_SUFFIXES, **UNIT_DESIGNATORS, **DIRECTIONALS}
+
+# Anything but letters, digits, "#" and spaces becomes a space; "#" stands alone
+PUNCTUATION = re.compile(r"[^A-Z0-9# ]+")
+UNIT_SIGN = re.compile(r"\s*#\s*")
+WHITESPACE = re.compile(r"\s+")
+STREET_WORD = re.compile(r"\b(?:" + "|".join(sorted(STREET_WORDS, key=len, reverse=True)) + r")\b")
+CITY_WORD = re.compile(r"\b(?:" + "|".join(CITY_WORDS) + r")\b")
+NOT_DIGIT = re.compile(r"[^0-9]")
+
+# Distinct strings remembered by the one-at-a-time helpers
+MEMO_SIZE = 2**16
+
+
+def clean_text(text):
+    """Upper case without punctuation or repeated whitespace; None and NaN become ""."""
+    if text is None or text is pd.NA or (isinstance(text, float) and np.isnan(text)):
+        return ""
+    text = PUNCTUATION.sub(" ", str(text).upper())
+    text = UNIT_SIGN.sub(" # ", text)
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def street_text(text):
+    return STREET_WORD.sub(lambda match: STREET_WORDS[match.group(0)], clean_text(text))
+
+
+def city_text(text):
+    return CITY_WORD.sub(lambda match: CITY_WORDS[match.group(0)], clean_text(text))
+
+
+def zip5_text(text):
+    """The first five digits of a ZIP or ZIP+4, zero padded ("2134" was read from a number)."""
+    if text is None or text is pd.NA or (isinstance(text, float) and np.isnan(text)):
+        return ""
+    text = str(text).split("-")[0]
+    if text.endswith(".0"):
+        text = text[:-2]
+    digits = NOT_DIGIT.sub("", text)
+    return digits[:5].zfill(5) if digits else ""
+
+
+def normalize_column(values, normalize):
+    """Applies normalize to every distinct value of a column once; returns strings aligned to values."""
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    normalized = np.array([normalize(value) for value in uniques] + [normalize(None)], dtype=object)
+    # Missing values (code -1) pick the normalized None at the end
+    return pd.Series(normalized[codes], index=values.index, dtype=STRING)
+
+
+def normalize_streets(values):
+    return normalize_column(values, street_text)
+
+
+def normalize_cities(values):
+    return normalize_column(values, city_text)
+
+
+def normalize_zip5(values):
+    return normalize_column(values, zip5_text)
+
+
+def address_keys(address, city, state, zip_code):
+    """The normalized "ADDRESS|CITY|STATE|ZIP5" key of every row."""
+    state = normalize_column(state, clean_text)
+    return normalize_streets(address) + "|" + normalize_cities(city) + "|" + state + "|" + normalize_zip5(zip_code)
+
+
+def key_hash(key):
+    """The address_hash of a normalized key."""
+    return stable_key(key)
+
+
+def key_hashes(keys):
+    """address_hash of every normalized key (Int64), hashing each distinct key once."""
+    codes, uniques = pd.factorize(keys)
+    hashes = stable_keys(uniques).to_numpy()
+    return pd.Series(hashes[codes], index=keys.index, dtype=KEY)
+
+
+def address_hashes(address, city, state, zip_code):
+    """address_hash of every row (Int64)."""
+    return key_hashes(address_keys(address, city, state, zip_code))
+
+
+def legacy_address_hashes(address, city, state, zip_code, keys=None):
+    """
+    The 9-digit address_hash of every row under both earlier schemes: md5 of the normalized key
+    (given as keys when already at hand), and md5 of the address as written (before normalization).
+    """
+    if keys is None:
+        keys = address_keys(address, city, state, zip_code)
+    normalized = legacy_keys(keys)
+    written = legacy_keys(address_strings(address, city, state, zip_code, missing_zip=None))
+    return normalized, written
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def address_key(address, city, state, zip_code):
+    """address_keys for one address (the row-by-row callers)."""
+    return f"{street_text(address)}|{city_text(city)}|{clean_text(state)}|{zip5_text(zip_code)}"
+
+
+def address_hash(address, city, state, zip_code):
+    return key_hash(address_key(address, city, state, zip_code))
@@ -0,0 +1,99 @@
+"""
+How many distinct address_hash values the USPS-style normalization (address_normalization.py)
+saves over the raw "address|city|state|zip5" key it replaced.
+
+The staged addresses.csv keeps the raw street, city and ZIP next to the new hash, so both keys can
+be counted from one build. Without --addresses the CMS and NPPES importers run on synthetic data
+(see synthetic_data.py) in a scratch folder first.
+
+    python benchmarks/address_hash_report.py --addresses datasets/output/addresses.csv
+    python benchmarks/address_hash_report.py --scale 10
+
+Reported: distinct keys before and after, the addresses that CMS and NPPES rows share (what
+check_unique_address_hash finds), and the normalization throughput.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from address_normalization import address_hashes
+from pipeline_scale_benchmark import ROOT, SUPPORT_FILES, run_pipeline
+from synthetic_data import write_datasets
+
+STAGES = ["facilities_importer", "filter_nppes_data", "nppes_importer"]
+ADDRESSES_FILE = os.path.join("datasets", "output", "addresses.csv")
+
+
+def raw_keys(addresses):
+    """The key address_hash was taken from before normalization."""
+    zip5 = addresses["zip_code"].fillna("").astype(str).str[:5]
+    return (addresses["address"].fillna("") + "|" + addresses["city"].fillna("") + "|"
+            + addresses["state_id"].astype(str) + "|" + zip5)
+
+
+def shared_locations(addresses, keys):
+    """Distinct keys that both a CMS row (ccn) and an NPPES row (npi) point at."""
+    cms = set(keys[addresses["ccn"].notna()])
+    nppes = set(keys[addresses["npi"].notna()])
+    return len(cms & nppes)
+
+
+def report(addresses):
+    start_time = time.perf_counter()
+    hashes = address_hashes(addresses["address"], addresses["city"], addresses["state_id"], addresses["zip_code"])
+    seconds = time.perf_counter() - start_time
+    before = raw_keys(addresses)
+    return {
+        "rows": len(addresses),
+        "distinct before": before.nunique(),
+        "distinct after": hashes.nunique(),
+        "shared before": shared_locations(addresses, before),
+        "shared after": shared_locations(addresses, hashes),
+        "rows/s": round(len(addresses) / seconds) if seconds else None,
+    }
+
+
+def synthetic_addresses(scale, seed):
+    """Runs the importers on synthetic data and returns the staged addresses."""
+    workdir = tempfile.mkdtemp(prefix=f"address_hash_{scale:g}x_")
+    try:
+        for path in SUPPORT_FILES:
+            shutil.copy(os.path.join(ROOT, path), os.path.join(workdir, os.path.basename(path)))
+        write_datasets(os.path.join(workdir, "datasets"), scale, seed)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_pipeline, workdir, STAGES, 1).result()
+        if not result["ok"]:
+            raise RuntimeError(f"the importers failed in {workdir}")
+        return pd.read_csv(os.path.join(workdir, ADDRESSES_FILE), dtype=str)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the address hashes saved by address normalization.")
+    parser.add_argument("--addresses", default=None, help="A staged addresses.csv (default: build one from synthetic data)")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.addresses:
+        addresses = pd.read_csv(args.addresses, dtype=str)
+    else:
+        addresses = synthetic_addresses(args.scale, args.seed)
+    result = report(addresses)
+    for name, value in result.items():
+        print(f"{name:>16}: {value}")
+    saved = result["distinct before"] - result["distinct after"]
+    print(f"{saved} fewer hashes ({saved / result['distinct before']:.1%}) to store and geocode")
+
+
+if __name__ == "__main__":
+    main()
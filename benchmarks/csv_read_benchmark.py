@@ -0,0 +1,112 @@
+"""
+Read time of every CSV the pipeline loaders read: pd.read_csv (how read_typed_csv read them
+before) against pyarrow's multithreaded reader (dtype_policy.read_typed_csv).
+
+Both readers produce the same frame: the script checks it before timing. Without --folder the
+importers run on synthetic data (see synthetic_data.py) in a scratch folder first, so the staged
+entities and addresses exist too.
+
+    python benchmarks/csv_read_benchmark.py --scale 10
+    python benchmarks/csv_read_benchmark.py --folder path/with/datasets
+
+Arrow parses on pyarrow.cpu_count() threads; the speedup grows with the cores available.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from dtype_policy import apply_dtypes, csv_dtypes, read_typed_csv
+from facilities_importer import files as CMS_FILES
+from nppes_importer import CMS_MATCH_COLUMNS
+from pipeline_scale_benchmark import ROOT, SUPPORT_FILES, run_pipeline
+from synthetic_data import write_datasets
+
+STAGES = ["facilities_importer", "filter_nppes_data", "nppes_importer"]
+# (file under the folder, columns read) of every loader read
+READS = [(os.path.join("datasets", file), None) for file in CMS_FILES] + [
+    (os.path.join("datasets", "filtered", "nppes_filtered_data.csv"), None),
+    (os.path.join("datasets", "output", "entities.csv"), None),
+    (os.path.join("datasets", "output", "entities.csv"), CMS_MATCH_COLUMNS),
+    (os.path.join("datasets", "output", "addresses.csv"), None),
+    (os.path.join("datasets", "output", "addresses.csv"), ["ccn", "address_hash"]),
+    (os.path.join("datasets", "output", "states.csv"), None),
+]
+
+
+def pandas_read(path, usecols=None):
+    return apply_dtypes(pd.read_csv(path, dtype=csv_dtypes(), usecols=usecols, low_memory=False))
+
+
+def best_time(function, path, usecols, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(path, usecols=usecols)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def benchmark(folder, repeat):
+    results = []
+    for file, usecols in READS:
+        path = os.path.join(folder, file)
+        if not os.path.exists(path):
+            continue
+        frame = read_typed_csv(path, usecols=usecols)
+        pd.testing.assert_frame_equal(frame, pandas_read(path, usecols)[frame.columns], check_categorical=False)
+        pandas_seconds = best_time(pandas_read, path, usecols, repeat)
+        arrow_seconds = best_time(read_typed_csv, path, usecols, repeat)
+        results.append({
+            "file": os.path.basename(file) + (f" ({len(usecols)} columns)" if usecols else ""),
+            "rows": len(frame),
+            "MB": round(os.path.getsize(path) / 2**20, 1),
+            "pandas s": round(pandas_seconds, 4),
+            "arrow s": round(arrow_seconds, 4),
+            "speedup": round(pandas_seconds / arrow_seconds, 2),
+        })
+    return pd.DataFrame(results)
+
+
+def synthetic_folder(scale, seed):
+    """Runs the importers on synthetic data in a scratch folder and returns it."""
+    workdir = tempfile.mkdtemp(prefix=f"csv_read_{scale:g}x_")
+    for path in SUPPORT_FILES:
+        shutil.copy(os.path.join(ROOT, path), os.path.join(workdir, os.path.basename(path)))
+    write_datasets(os.path.join(workdir, "datasets"), scale, seed)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        result = executor.submit(run_pipeline, workdir, STAGES, 1).result()
+    if not result["ok"]:
+        raise RuntimeError(f"the importers failed in {workdir}")
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the pipeline CSV reads with pandas and with Arrow.")
+    parser.add_argument("--folder", default=None, help="A folder holding datasets/ (default: build one from synthetic data)")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Reads per file; the fastest counts")
+    args = parser.parse_args()
+
+    folder = args.folder or synthetic_folder(args.scale, args.seed)
+    try:
+        print(f"Arrow threads: {pa.cpu_count()}")
+        results = benchmark(folder, args.repeat)
+        print(results.to_string(index=False))
+        print(f"Total: pandas {results['pandas s'].sum():.3f} s, arrow {results['arrow s'].sum():.3f} s")
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Load-test harness for address_geocoder.process_addresses.
+
+Drives the geocoder against the local mock server (started in-process, or an already running one
+given with --base-url) and reports requests/sec, p50/p95/p99 request latency, retries and failures.
+
+    python benchmarks/geocoder_load_test.py --addresses 20000 --quota-rps 400 --rps 380
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import aiohttp
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import address_geocoder
+from mock_geocoding_server import STATS, add_server_arguments, app_from_arguments, start_server
+
+
+def make_addresses(count):
+    """Synthetic distinct addresses; the mock server does not look at their content."""
+    return (
+        {
+            'address_hash': i,
+            'address': f"{i} Benchmark Ave",
+            'city': "Springfield",
+            'state_code': "IL",
+            'zip_code': "62704"
+        }
+        for i in range(count)
+    )
+
+
+def request_timer(latencies):
+    """aiohttp trace config appending the duration of every geocode request to latencies."""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.started = time.monotonic()
+
+    async def on_request_end(session, context, params):
+        if params.url.path.endswith("/geocode"):
+            latencies.append(time.monotonic() - context.started)
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+async def run_load_test(args):
+    runner = None
+    server_stats = None
+    base_url = args.base_url
+    if base_url is None:
+        app = app_from_arguments(args)
+        server_stats = app[STATS]
+        runner, base_url = await start_server(app)
+
+    address_geocoder.APPLE_MAPS_BASE_URL = base_url
+    latencies = []
+    stats = address_geocoder.new_stats()
+    try:
+        async with address_geocoder.create_session(trace_configs=[request_timer(latencies)], max_workers=args.workers) as session:
+            tokens = address_geocoder.TokenManager(session)
+            started = time.monotonic()
+            await address_geocoder.process_addresses(
+                make_addresses(args.addresses), tokens, session=session,
+                max_workers=args.workers, requests_per_second=args.rps, stats=stats
+            )
+            elapsed = time.monotonic() - started
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    latency = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    report = {
+        "addresses": args.addresses,
+        "elapsed_seconds": round(elapsed, 2),
+        "addresses_per_second": round(args.addresses / elapsed, 1),
+        "requests_per_second": round(stats['requests'] / elapsed, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latency, 50)), 1),
+            "p95": round(float(np.percentile(latency, 95)), 1),
+            "p99": round(float(np.percentile(latency, 99)), 1)
+        },
+        "requests": stats['requests'],
+        "retries": stats['retries'],
+        "throttled": stats['throttled'],
+        "failed": stats['failed'],
+        "attempts_per_address": {str(k): v for k, v in sorted(stats['attempts'].items())},
+        "token_refreshes": tokens.refresh_count
+    }
+    if server_stats is not None:
+        report["server"] = {"tokens_issued": server_stats["tokens_issued"], "status": {str(k): v for k, v in server_stats["status"].items()}}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the geocoder against the local mock server.")
+    parser.add_argument("--addresses", type=int, default=5000, help="Number of addresses to geocode")
+    parser.add_argument("--workers", type=int, default=address_geocoder.MAX_CONCURRENT_REQUESTS, help="Worker pool size")
+    parser.add_argument("--rps", type=float, default=address_geocoder.REQUESTS_PER_SECOND, help="Client-side rate limit")
+    parser.add_argument("--base-url", default=None, help="Use an already running server instead of starting one")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Throughput of key generation: the md5 % 10**9 ids the importers computed row by row against the
+63-bit stable keys computed a column at a time (stable_keys.py).
+
+Sources look like the NPPES entity keys ("<NPI>|<taxonomy field>"), all distinct. For each size
+the script prints keys per second of every path, and the collisions found among the keys next to
+the number the birthday bound expects (n^2 / 2 * space).
+
+    python benchmarks/key_generation_benchmark.py
+    python benchmarks/key_generation_benchmark.py --sizes 100000 3000000
+"""
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from stable_keys import KEY_BITS, LEGACY_MODULUS, legacy_key, stable_key, stable_keys
+
+SIZES = [100_000, 1_000_000]
+TAXONOMY_SLOTS = 15
+# Scalar stable keys are slow enough that a sample tells their rate
+SCALAR_SAMPLE = 100_000
+
+
+def entity_sources(count):
+    return pd.Series([f"{1000000000 + row // TAXONOMY_SLOTS}|Healthcare Provider Taxonomy Code_{row % TAXONOMY_SLOTS + 1}" for row in range(count)])
+
+
+def timed(function, sources):
+    start_time = time.perf_counter()
+    keys = function(sources)
+    return keys, time.perf_counter() - start_time
+
+
+def benchmark(count):
+    sources = entity_sources(count)
+    legacy, legacy_seconds = timed(lambda values: [legacy_key(value) for value in values], sources)
+    stable, stable_seconds = timed(stable_keys, sources)
+    sample = sources[:SCALAR_SAMPLE]
+    _, scalar_seconds = timed(lambda values: [stable_key(value) for value in values], sample)
+    return {
+        "keys": count,
+        "md5 per row (keys/s)": round(count / legacy_seconds),
+        "stable_keys (keys/s)": round(count / stable_seconds),
+        "stable_key per row (keys/s)": round(len(sample) / scalar_seconds),
+        "speedup": round(legacy_seconds / stable_seconds, 1),
+        "md5 collisions": count - len(set(legacy)),
+        "expected": round(count**2 / (2 * LEGACY_MODULUS), 1),
+        "stable collisions": count - stable.nunique(),
+        "expected ": f"{count**2 / (2 * 2**KEY_BITS):.1e}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark md5 ids against stable keys.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+    print(pd.DataFrame([benchmark(count) for count in args.sizes]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
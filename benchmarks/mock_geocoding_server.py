@@ -0,0 +1,177 @@
+"""
+Local stand-in for the Apple Maps /v1/token and /v1/geocode endpoints.
+
+Point the geocoder at it with APPLE_MAPS_BASE_URL=http://127.0.0.1:<port>. Latency, error rate,
+"no results" rate, token lifetime and the server-side quota are configurable so throughput changes
+can be measured without spending real API quota.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from aiohttp import web
+
+# The app's answer counters (see create_app)
+STATS = web.AppKey("stats", dict)
+
+
+def parse_latency(spec, rng=random):
+    """
+    Builds a latency sampler (seconds) drawing from rng, from a spec string:
+    - fixed:0.05
+    - uniform:0.01:0.2
+    - lognormal:<median>:<sigma>
+    - exp:<mean>
+    """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: rng.lognormvariate(0, sigma) * median
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def create_app(latency="fixed:0.02", error_rate=0.0, not_found_rate=0.0, token_ttl=1800, quota_rps=None, retry_after=1, seed=None,
+               token_latency=0.0, token_status=200, slow_marker=None, slow_latency=1.0, expire_every=None, fail_first=None):
+    """
+    Creates the mock server application.
+
+    - latency: distribution spec for geocode answers (see parse_latency).
+    - error_rate: share of geocode requests answered with a 503.
+    - not_found_rate: share of geocode requests answered with an empty result list.
+    - token_ttl: token lifetime in seconds; expired or unknown tokens get a 401.
+    - quota_rps: server-side quota; requests above it get a 429 with Retry-After.
+    Scripted failures, for tests of the geocoder's recovery paths:
+    - token_latency, token_status: delay and status of token answers (non-200 issues no token).
+    - slow_marker: geocode queries containing it answer after slow_latency seconds.
+    - expire_every: every token is revoked after that many successful geocodes, so every request
+      in flight gets a 401.
+    - fail_first: the first request for each query is answered with this status (with Retry-After
+      when it is a 429).
+    The app's STATS entry counts tokens issued and answers by status, and lists how long each
+    failed-first query waited before its successful retry (retry_waits).
+    """
+    rng = random.Random(seed)
+    sample_latency = parse_latency(latency, rng)
+    tokens = {}
+    stats = {"tokens_issued": 0, "geocode_requests": 0, "status": {}, "retry_waits": []}
+    quota = {"tokens": quota_rps or 0, "updated": time.monotonic()}
+    failed_at = {}
+    served = 0
+
+    def count(status):
+        stats["status"][status] = stats["status"].get(status, 0) + 1
+
+    def within_quota():
+        if not quota_rps:
+            return True
+        now = time.monotonic()
+        quota["tokens"] = min(quota_rps, quota["tokens"] + (now - quota["updated"]) * quota_rps)
+        quota["updated"] = now
+        if quota["tokens"] >= 1:
+            quota["tokens"] -= 1
+            return True
+        return False
+
+    async def token(request):
+        stats["tokens_issued"] += 1
+        if token_latency:
+            await asyncio.sleep(token_latency)
+        if token_status != 200:
+            return web.json_response({"error": {"message": "Unavailable"}}, status=token_status)
+        access_token = uuid.uuid4().hex
+        tokens[access_token] = time.monotonic() + token_ttl
+        return web.json_response({"accessToken": access_token, "expiresInSeconds": token_ttl})
+
+    async def geocode(request):
+        nonlocal served
+        stats["geocode_requests"] += 1
+        access_token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if tokens.get(access_token, 0) < time.monotonic():
+            count(401)
+            return web.json_response({"error": {"message": "Not Authorized"}}, status=401)
+        if not within_quota():
+            count(429)
+            return web.json_response({"error": {"message": "Too Many Requests"}}, status=429, headers={"Retry-After": str(retry_after)})
+        query = request.query.get("q", "")
+        if fail_first and query not in failed_at:
+            failed_at[query] = time.monotonic()
+            count(fail_first)
+            headers = {"Retry-After": str(retry_after)} if fail_first == 429 else {}
+            return web.json_response({"error": {"message": "Try Again"}}, status=fail_first, headers=headers)
+        await asyncio.sleep(slow_latency if slow_marker and slow_marker in query else sample_latency())
+        if rng.random() < error_rate:
+            count(503)
+            return web.json_response({"error": {"message": "Service Unavailable"}}, status=503)
+        count(200)
+        served += 1
+        if query in failed_at:
+            stats["retry_waits"].append(time.monotonic() - failed_at[query])
+        if expire_every and served % expire_every == 0:
+            tokens.clear()
+        if rng.random() < not_found_rate:
+            return web.json_response({"results": []})
+        return web.json_response({"results": [{"coordinate": {
+            "latitude": rng.uniform(25.0, 49.0),
+            "longitude": rng.uniform(-124.0, -67.0)
+        }}]})
+
+    app = web.Application()
+    app[STATS] = stats
+    app.router.add_post("/v1/token", token)
+    app.router.add_get("/v1/token", token)
+    app.router.add_get("/v1/geocode", geocode)
+    return app
+
+
+async def start_server(app, host="127.0.0.1", port=0):
+    """Starts the app in the running loop and returns the runner and its base URL."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+def add_server_arguments(parser):
+    """Adds the mock server options to an argument parser."""
+    parser.add_argument("--latency", default="lognormal:0.08:0.5", help="Latency distribution, e.g. fixed:0.05, uniform:0.01:0.2, lognormal:0.08:0.5, exp:0.1")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="Share of geocode requests answered with a 503")
+    parser.add_argument("--not-found-rate", type=float, default=0.02, help="Share of geocode requests with no results")
+    parser.add_argument("--token-ttl", type=float, default=1800, help="Token lifetime in seconds")
+    parser.add_argument("--quota-rps", type=float, default=None, help="Server-side quota in requests per second (429 above it)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for repeatable runs")
+
+
+def app_from_arguments(args):
+    return create_app(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        not_found_rate=args.not_found_rate,
+        token_ttl=args.token_ttl,
+        quota_rps=args.quota_rps,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Apple Maps token and geocode endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(app_from_arguments(args), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Throughput benchmark for the batch nearest-facility engine (nearest_facility.py).
+
+Answers nearest-of-each-subtype and count-within-radius for --queries points scattered around
+real ZIP5 centroids, against the facilities of an existing database (--db) or a synthetic
+national set (--synthetic N, placed the same way). A sample is checked against brute force and
+timed as the per-point loop the engine replaces.
+
+    python benchmarks/nearest_facility_benchmark.py --db facilities.db --queries 1000000
+    python benchmarks/nearest_facility_benchmark.py --synthetic 300000 --queries 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_search import haversine_miles
+from nearest_facility import GRID_CELL_DEGREES, build_subtype_grids, load_facility_points, nearest_by_subtype
+from radius_query_benchmark import SUBTYPES, load_centroids
+
+
+def scatter_around_zips(count, seed):
+    """Points jittered around randomly chosen ZIP centroids, so density follows population."""
+    rng = np.random.default_rng(seed)
+    centroids = load_centroids()
+    picks = rng.integers(0, len(centroids), count)
+    latitudes = centroids["latitude"].to_numpy()[picks] + rng.normal(0, 0.02, count)
+    longitudes = centroids["longitude"].to_numpy()[picks] + rng.normal(0, 0.02, count)
+    return latitudes, longitudes
+
+
+def synthetic_points(facilities, seed=0):
+    latitudes, longitudes = scatter_around_zips(facilities, seed)
+    kinds = np.random.default_rng(seed + 1).integers(0, len(SUBTYPES), facilities)
+    return pd.DataFrame({
+        "entity_id": np.arange(1, facilities + 1),
+        "subtype": np.array([subtype for _, subtype in SUBTYPES])[kinds],
+        "latitude": latitudes,
+        "longitude": longitudes
+    })
+
+
+def brute_force(points, latitude, longitude, miles):
+    """The per-point loop: every facility of every subtype measured from one query point."""
+    answers = {}
+    for subtype, group in points.groupby("subtype"):
+        distances = haversine_miles(latitude, longitude, group["latitude"].to_numpy(), group["longitude"].to_numpy())
+        answers[subtype] = (float(distances.min()), int((distances <= miles).sum()))
+    return answers
+
+
+def run_benchmark(points, queries, miles, cell_degrees, sample):
+    latitudes, longitudes = scatter_around_zips(queries, seed=7)
+
+    started = time.perf_counter()
+    grids = build_subtype_grids(points, cell_degrees)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = nearest_by_subtype(grids, latitudes, longitudes, miles)
+    query_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    mismatches = 0
+    for index in range(sample):
+        expected = brute_force(points, latitudes[index], longitudes[index], miles)
+        rows = result[result["query_index"] == index].set_index("subtype")
+        for subtype, (distance, count) in expected.items():
+            mismatches += abs(rows.at[subtype, "distance_miles"] - distance) > 0.001 or rows.at[subtype, "count_within"] != count
+    brute_force_seconds = (time.perf_counter() - started) / sample
+
+    return {
+        "facility_locations": len(points),
+        "subtypes": len(grids),
+        "query_points": queries,
+        "radius_miles": miles,
+        "cell_degrees": cell_degrees,
+        "build_seconds": round(build_seconds, 2),
+        "query_seconds": round(query_seconds, 2),
+        "query_points_per_second": round(queries / query_seconds),
+        "brute_force_points_per_second": round(1 / brute_force_seconds, 1),
+        "brute_force_sample": sample,
+        "brute_force_mismatches": int(mismatches)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch nearest-facility and radius-count queries.")
+    parser.add_argument("--db", default=None, help="Existing facilities database")
+    parser.add_argument("--synthetic", type=int, default=None, help="Use this many synthetic facilities instead of a database")
+    parser.add_argument("--queries", type=int, default=1_000_000, help="Number of query points")
+    parser.add_argument("--miles", type=float, default=10, help="Radius for the counts")
+    parser.add_argument("--cell-degrees", type=float, default=GRID_CELL_DEGREES, help="Grid cell size")
+    parser.add_argument("--sample", type=int, default=200, help="Query points checked against brute force")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        points = synthetic_points(args.synthetic)
+    elif args.db:
+        points = load_facility_points(args.db)
+    else:
+        parser.error("give --db or --synthetic")
+
+    report = run_benchmark(points, args.queries, args.miles, args.cell_degrees, args.sample)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Scale benchmark of the import pipeline on synthetic data (see synthetic_data.py).
+
+Every scale gets a scratch folder with freshly generated CMS and NPPES files. The pipeline stages
+run there in a new process, so one scale's memory peak does not carry over to the next. Per-stage
+timings, rows and peak memory are taken from the run report and saved to
+benchmarks/results/pipeline_scale_<timestamp>.json.
+
+The results are then compared with the baseline. A stage counts as a regression when it is
+slower, or uses more memory, than the baseline by more than the tolerance (small absolute
+differences are ignored as noise); any regression makes the run exit with status 1. The scaling
+exponent between consecutive scales shows which stages grow faster than their input (1 is linear,
+2 quadratic).
+
+    python benchmarks/pipeline_scale_benchmark.py                        # 1x, 10x and 100x
+    python benchmarks/pipeline_scale_benchmark.py --scales 1 10 --save-baseline
+    python benchmarks/pipeline_scale_benchmark.py --scales 1 10 --stages facilities_importer nppes_importer
+
+The geocoding API stage is left out: it needs an API token and measures the remote service.
+Stages run one at a time by default, so their CPU and memory figures are their own.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from execute_chain import STAGES, run_chain
+from synthetic_data import write_datasets
+from zip_centroid_geocoder import ZIP_CENTROIDS_FILE
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCALES = [1, 10, 100]
+BASELINE_FILE = os.path.join(ROOT, "benchmarks", "pipeline_scale_baseline.json")
+RESULTS_FOLDER = os.path.join(ROOT, "benchmarks", "results")
+# Stages that call remote services are not benchmarked
+SKIPPED_STAGES = ["address_geocoder"]
+# Files the stages read from the working directory besides the datasets
+SUPPORT_FILES = ["NPPES_dictionary.csv", "schema.sql", ZIP_CENTROIDS_FILE]
+# Allowed slowdown or memory growth over the baseline before it counts as a regression
+TOLERANCE = 0.25
+# Differences below these are timer and allocator noise
+MIN_REGRESSION_SECONDS = 0.5
+MIN_REGRESSION_MB = 50
+
+
+def run_pipeline(workdir, stage_names, jobs):
+    """Runs the named stages in workdir (in a worker process) and returns the run report."""
+    os.chdir(workdir)
+    stages = [stage for stage in STAGES if stage["name"] in stage_names]
+    report_file = os.path.join(workdir, "report.json")
+    ok = run_chain(stages, state_path="chain_state.json", max_parallel=jobs, force=stage_names, report_path=report_file)
+    with open(report_file) as f:
+        report = json.load(f)
+    report["ok"] = ok
+    return report
+
+
+def stage_metrics(report):
+    """The figures compared between runs, per stage of a run report."""
+    keys = ("status", "wall_seconds", "cpu_seconds", "rows", "rows_per_second", "peak_rss_mb")
+    return {stage["name"]: {key: stage.get(key) for key in keys} for stage in report["stages"]}
+
+
+def benchmark_scale(scale, seed, stage_names, jobs, keep=False):
+    """Generates the data for one scale, runs the pipeline on it and returns its results."""
+    workdir = tempfile.mkdtemp(prefix=f"pipeline_scale_{scale:g}x_")
+    try:
+        for path in SUPPORT_FILES:
+            shutil.copy(os.path.join(ROOT, path), os.path.join(workdir, os.path.basename(path)))
+        start_time = time.perf_counter()
+        rows = write_datasets(os.path.join(workdir, "datasets"), scale, seed)
+        generate_seconds = time.perf_counter() - start_time
+        print(f"[{scale:g}x] synthetic data written in {generate_seconds:.2f} seconds to {workdir}")
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            report = executor.submit(run_pipeline, workdir, stage_names, jobs).result()
+    finally:
+        if keep:
+            print(f"[{scale:g}x] kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "generate_seconds": round(generate_seconds, 3),
+        "input_rows": {os.path.relpath(path, os.path.join(workdir, "datasets")): count for path, count in rows.items()},
+        "ok": report["ok"],
+        "wall_seconds": report["wall_seconds"],
+        "stages": stage_metrics(report),
+        "report": report
+    }
+
+
+def machine():
+    return {
+        "node": platform.node(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE):
+    """Returns a description of every stage that got slower, bigger or started failing."""
+    regressions = []
+    for scale, current in results["scales"].items():
+        previous = baseline.get("scales", {}).get(scale)
+        if previous is None:
+            continue
+        for name, stage in current["stages"].items():
+            before = previous["stages"].get(name)
+            if before is None:
+                continue
+            if stage["status"] != "ok" and before["status"] == "ok":
+                regressions.append(f"{scale}x {name}: {stage['status']} (ok in the baseline)")
+                continue
+            seconds, base_seconds = stage["wall_seconds"], before["wall_seconds"]
+            if seconds > base_seconds * (1 + tolerance) and seconds - base_seconds > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{scale}x {name}: {seconds:.2f}s vs {base_seconds:.2f}s in the baseline")
+            memory, base_memory = stage.get("peak_rss_mb"), before.get("peak_rss_mb")
+            if memory and base_memory and memory > base_memory * (1 + tolerance) and memory - base_memory > MIN_REGRESSION_MB:
+                regressions.append(f"{scale}x {name}: peak {memory:.0f} MB vs {base_memory:.0f} MB in the baseline")
+    return regressions
+
+
+def scaling_exponent(seconds, base_seconds, scale, base_scale):
+    """k in time ~ scale^k between two scales (None when either time is too small to tell)."""
+    if not seconds or not base_seconds or seconds < 0.05 or base_seconds < 0.05:
+        return None
+    return math.log(seconds / base_seconds) / math.log(scale / base_scale)
+
+
+def summary(results, baseline):
+    """One row per scale and stage: time, throughput, memory, change from the baseline and scaling."""
+    rows = []
+    scales = sorted(results["scales"], key=float)
+    for position, scale in enumerate(scales):
+        for name, stage in results["scales"][scale]["stages"].items():
+            before = baseline.get("scales", {}).get(scale, {}).get("stages", {}).get(name) if baseline else None
+            smaller = results["scales"][scales[position - 1]]["stages"].get(name) if position else None
+            exponent = smaller and scaling_exponent(stage["wall_seconds"], smaller["wall_seconds"], float(scale), float(scales[position - 1]))
+            rows.append({
+                "scale": f"{scale}x",
+                "stage": name,
+                "status": stage["status"],
+                "seconds": stage["wall_seconds"],
+                "rows/s": stage["rows_per_second"],
+                "peak MB": stage["peak_rss_mb"],
+                "vs baseline": f"{stage['wall_seconds'] / before['wall_seconds'] - 1:+.0%}" if before and before["wall_seconds"] else "",
+                "scaling": f"{exponent:.2f}" if exponent is not None else ""
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data at several scales.")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=None, help="Stages to run (default: all but the geocoding API stage)")
+    parser.add_argument("--jobs", type=int, default=1, help="Stages run at the same time")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument("--output", default=None, help="Path of the results JSON")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch folders with the generated data and outputs")
+    args = parser.parse_args()
+
+    stage_names = args.stages or [stage["name"] for stage in STAGES if stage["name"] not in SKIPPED_STAGES]
+    unknown = set(stage_names) - {stage["name"] for stage in STAGES}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    started_at = datetime.now()
+    results = {"created_at": started_at.isoformat(timespec="seconds"), "seed": args.seed, "machine": machine(), "scales": {}}
+    for scale in args.scales:
+        label = f"{scale:g}"
+        results["scales"][label] = benchmark_scale(scale, args.seed, stage_names, args.jobs, args.keep)
+        print(f"[{label}x] pipeline {'finished' if results['scales'][label]['ok'] else 'failed'} in {results['scales'][label]['wall_seconds']:.2f} seconds")
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"pipeline_scale_{started_at:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine", {}).get("node") != results["machine"]["node"]:
+            print("Warning: the baseline was recorded on another machine; timings may not be comparable.")
+    print(summary(results, baseline).to_string(index=False))
+
+    if args.save_baseline:
+        shutil.copy(output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
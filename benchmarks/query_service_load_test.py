@@ -0,0 +1,262 @@
+"""
+Load test of query_service with concurrent clients.
+
+Starts the service in its own process on a database (--db, or one built by the pipeline from
+synthetic data with --scale), then keeps --clients connections busy for --duration seconds with a
+mix of the service's lookups. Keys are drawn from the database with Zipf-like popularity (--zipf 0
+for uniform), so repeated lookups hit the result cache about as often as they would in use.
+
+Reports requests/sec and p50/p95/p99 latency overall and per lookup, plus the server's cache hit
+rate, and exits with status 1 when the p99 latency misses its target or any request fails.
+
+    python benchmarks/query_service_load_test.py --scale 3 --clients 32 --duration 20
+    python benchmarks/query_service_load_test.py --db facilities.db --cache-size 0
+
+With --shards the database is split into per-state shards (setup_database.create_shards) and the
+service answers through shard_router, so the two runs compare the single database with the shards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlencode
+import aiohttp
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from pipeline_scale_benchmark import SKIPPED_STAGES, SUPPORT_FILES, run_pipeline
+from execute_chain import STAGES
+from setup_database import create_shards
+from synthetic_data import write_datasets
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# p99 latency targets in milliseconds, overall and per lookup
+P99_TARGET_MS = 50
+P99_TARGETS_MS = {"npi": 25, "ccn": 25, "type_state": 100, "type_zip": 50, "address": 25}
+# Share of each lookup in the request mix
+REQUEST_MIX = {"npi": 0.3, "ccn": 0.2, "type_state": 0.2, "type_zip": 0.15, "address": 0.15}
+
+
+def build_database(scale, seed=0):
+    """Runs the pipeline (without the geocoders) on synthetic data; returns the scratch folder and database path."""
+    workdir = tempfile.mkdtemp(prefix=f"query_service_{scale:g}x_")
+    for path in SUPPORT_FILES:
+        shutil.copy(os.path.join(ROOT, path), os.path.join(workdir, os.path.basename(path)))
+    write_datasets(os.path.join(workdir, "datasets"), scale, seed)
+    stage_names = [stage["name"] for stage in STAGES if stage["name"] not in SKIPPED_STAGES + ["zip_centroid_geocoder"]]
+    cwd = os.getcwd()
+    try:
+        report = run_pipeline(workdir, stage_names, 1)
+    finally:
+        os.chdir(cwd)
+    if not report["ok"]:
+        raise RuntimeError(f"The pipeline failed in {workdir}")
+    return workdir, os.path.join(workdir, "facilities.db")
+
+
+def zipf_choice(rng, values, count, exponent):
+    """count draws from values, the i-th most popular with weight 1/i^exponent."""
+    weights = 1 / np.arange(1, len(values) + 1) ** exponent
+    picks = rng.choice(len(values), size=count, p=weights / weights.sum())
+    return [values[pick] for pick in picks]
+
+
+def request_paths(db_path, count, exponent=1.0, seed=0):
+    """Request paths for the load test, mixed as in REQUEST_MIX, with the lookup each one makes."""
+    conn = sqlite3.connect(db_path)
+    keys = {
+        "npi": [row[0] for row in conn.execute("SELECT DISTINCT npi FROM entities WHERE npi IS NOT NULL")],
+        "ccn": [row[0] for row in conn.execute("SELECT DISTINCT ccn FROM entities WHERE ccn IS NOT NULL")],
+        "type_state": conn.execute("""
+            SELECT DISTINCT e.type, s.state_code FROM entities e
+            JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi JOIN states s ON s.state_id = a.state_id""").fetchall(),
+        "type_zip": conn.execute("""
+            SELECT DISTINCT e.type, a.zip_code FROM entities e
+            JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi WHERE a.zip_code IS NOT NULL""").fetchall(),
+        "address": [row[0] for row in conn.execute("SELECT DISTINCT address_hash FROM addresses")]
+    }
+    conn.close()
+    rng = np.random.default_rng(seed)
+    for values in keys.values():
+        rng.shuffle(values)
+    kinds = rng.choice(list(REQUEST_MIX), size=count, p=list(REQUEST_MIX.values()))
+    draws = {kind: iter(zipf_choice(rng, values, int((kinds == kind).sum()), exponent)) for kind, values in keys.items() if values}
+    paths = []
+    for kind in kinds:
+        if kind not in draws:
+            continue
+        key = next(draws[kind])
+        if kind == "npi":
+            paths.append((kind, f"/entities/npi/{quote(key)}"))
+        elif kind == "ccn":
+            paths.append((kind, f"/entities/ccn/{quote(key)}"))
+        elif kind == "type_state":
+            paths.append((kind, "/entities?" + urlencode({"type": key[0], "state": key[1]})))
+        elif kind == "type_zip":
+            paths.append((kind, "/entities?" + urlencode({"type": key[0], "zip": key[1]})))
+        else:
+            paths.append((kind, f"/addresses/{key}/entities"))
+    return paths
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(session, base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The query service exited while starting.")
+        try:
+            async with session.get(f"{base_url}/stats") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientConnectionError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("The query service did not start in time.")
+
+
+async def run_clients(session, base_url, paths, clients, duration, warmup):
+    """Closed-loop clients cycling through paths; latencies are kept after the warm-up."""
+    latencies = {kind: [] for kind in REQUEST_MIX}
+    errors = []
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    position = 0
+
+    async def client():
+        nonlocal position
+        while time.monotonic() < stop_at:
+            kind, path = paths[position % len(paths)]
+            position += 1
+            sent = time.monotonic()
+            try:
+                async with session.get(base_url + path) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError as error:
+                status = repr(error)
+            if sent >= measure_from:
+                if status in (200, 404):
+                    latencies[kind].append(time.monotonic() - sent)
+                else:
+                    errors.append(status)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors
+
+
+def percentiles(latencies):
+    count = len(latencies)
+    latencies = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": count,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2)
+    }
+
+
+async def run_load_test(db_path, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable, os.path.join(ROOT, "query_service.py"), "--db", db_path, "--port", str(port),
+        "--pool-size", str(args.pool_size), "--cache-size", str(args.cache_size)
+    ]
+    if args.shards:
+        shard_folder = os.path.join(os.path.dirname(db_path), "shards")
+        create_shards(db_path, shard_folder, os.path.join(ROOT, "schema.sql"))
+        command += ["--shards", shard_folder]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    paths = request_paths(db_path, args.requests, args.zipf, args.seed)
+    try:
+        connector = aiohttp.TCPConnector(limit=args.clients)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_until_up(session, base_url, process)
+            latencies, errors = await run_clients(session, base_url, paths, args.clients, args.duration, args.warmup)
+            async with session.get(f"{base_url}/stats") as response:
+                server = await response.json()
+    finally:
+        process.terminate()
+        process.wait()
+
+    everything = [latency for values in latencies.values() for latency in values]
+    lookups = server["cache_hits"] + server["cache_misses"]
+    report = {
+        "db": db_path,
+        "shards": server.get("shards"),
+        "clients": args.clients,
+        "duration_seconds": args.duration,
+        "requests_per_second": round(len(everything) / args.duration, 1),
+        "errors": len(errors),
+        "latency": percentiles(everything),
+        "lookups": {kind: percentiles(values) for kind, values in latencies.items()},
+        "cache_hit_rate": round(server["cache_hits"] / lookups, 3) if lookups else None,
+        "server": server
+    }
+    missed = []
+    if report["latency"]["p99_ms"] > P99_TARGET_MS:
+        missed.append(f"overall p99 {report['latency']['p99_ms']} ms > {P99_TARGET_MS} ms")
+    for kind, target in P99_TARGETS_MS.items():
+        if report["lookups"][kind]["requests"] and report["lookups"][kind]["p99_ms"] > target:
+            missed.append(f"{kind} p99 {report['lookups'][kind]['p99_ms']} ms > {target} ms")
+    if errors:
+        missed.append(f"{len(errors)} failed requests (first: {errors[0]})")
+    report["missed_targets"] = missed
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the facility query service with concurrent clients.")
+    parser.add_argument("--db", default=None, help="Existing facilities database")
+    parser.add_argument("--scale", type=float, default=1, help="Build the database from synthetic data at this scale (without --db)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=15, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds before measuring")
+    parser.add_argument("--requests", type=int, default=50000, help="Distinct request paths to cycle through")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Popularity skew of the keys (0 = uniform)")
+    parser.add_argument("--pool-size", type=int, default=8, help="Service connection pool size")
+    parser.add_argument("--cache-size", type=int, default=10000, help="Service result cache size (0 disables it)")
+    parser.add_argument("--shards", action="store_true", help="Serve per-state shards of the database through shard_router")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        started = time.perf_counter()
+        workdir, db_path = build_database(args.scale, args.seed)
+        print(f"Built the {args.scale:g}x database in {time.perf_counter() - started:.1f}s")
+    try:
+        report = asyncio.run(run_load_test(os.path.abspath(db_path), args))
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for missed in report["missed_targets"]:
+        print(f"MISSED {missed}")
+    if report["missed_targets"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
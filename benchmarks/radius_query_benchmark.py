@@ -0,0 +1,151 @@
+"""
+Latency benchmark for facility_search.find_facilities_within at 1, 10 and 50 miles.
+
+Runs against an existing facilities.db (--db), or builds a synthetic national database with
+--synthetic N: N facilities scattered around real ZIP5 centroids, so density follows population
+the way the CMS and NPPES data does.
+
+    python benchmarks/radius_query_benchmark.py --db facilities.db --queries 500
+    python benchmarks/radius_query_benchmark.py --synthetic 1000000 --queries 500
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_search import find_facilities_within, haversine_miles
+from zip_centroid_geocoder import ZIP_CENTROIDS_FILE
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SUBTYPES = [
+    ("Hospital", "General Acute Care Hospital"),
+    ("Clinic", "Dialysis Clinic"),
+    ("Agency", "Home Health Agency (All)"),
+    ("Agency", "Community Based Hospice Care Agency"),
+    ("Nursing & Assisted Living", "Skilled Nursing Facility"),
+]
+
+
+def load_centroids():
+    return pd.read_csv(os.path.join(ROOT, ZIP_CENTROIDS_FILE), dtype={"zip_code": str})
+
+
+def build_synthetic_db(db_path, facilities, seed=0):
+    """Creates a facilities database with the given number of geocoded synthetic entities."""
+    rng = np.random.default_rng(seed)
+    centroids = load_centroids()
+    picks = rng.integers(0, len(centroids), facilities)
+    latitudes = centroids["latitude"].to_numpy()[picks] + rng.normal(0, 0.02, facilities)
+    longitudes = centroids["longitude"].to_numpy()[picks] + rng.normal(0, 0.02, facilities)
+    kinds = rng.integers(0, len(SUBTYPES), facilities)
+
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        schema = f.read()
+    conn.executescript(schema)
+    # setup_database loads entities with to_sql, which recreates the table without the schema's
+    # NOT NULL/UNIQUE constraints; mirror that so CMS rows can leave npi empty
+    conn.executescript("""
+        DROP TABLE entities;
+        CREATE TABLE entities (entity_id INTEGER, name TEXT, ccn TEXT, npi TEXT, type TEXT, subtype TEXT, nucc_code TEXT);
+    """)
+    ids = np.arange(1, facilities + 1)
+    conn.executemany(
+        "INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (?, ?, ?, ?, ?, ?)",
+        ((int(i), f"Facility {i}", f"C{i}", None, SUBTYPES[k][0], SUBTYPES[k][1]) for i, k in zip(ids, kinds))
+    )
+    conn.executemany(
+        "INSERT INTO addresses (ccn, address, city, zip_code, address_hash) VALUES (?, ?, 'City', ?, ?)",
+        ((f"C{i}", f"{i} Main St", centroids["zip_code"].iat[p], int(i)) for i, p in zip(ids, picks))
+    )
+    conn.executemany(
+        "INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (?, ?, ?)",
+        zip(ids.tolist(), latitudes.tolist(), longitudes.tolist())
+    )
+    conn.commit()
+    conn.executescript(schema)
+    conn.close()
+
+
+def query_points(count, seed=1):
+    """Query points at random ZIP centroids, so they land where facilities are."""
+    centroids = load_centroids()
+    picks = np.random.default_rng(seed).integers(0, len(centroids), count)
+    return list(zip(centroids["latitude"].to_numpy()[picks], centroids["longitude"].to_numpy()[picks]))
+
+
+def full_scan(conn, latitude, longitude, miles):
+    """The query this benchmark replaces: every point loaded and filtered in Python."""
+    rows = conn.execute("SELECT address_hash, latitude, longitude FROM address_geolocation").fetchall()
+    coordinates = np.array([(row[1], row[2]) for row in rows])
+    distances = haversine_miles(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+    return int((distances <= miles).sum())
+
+
+def summarize(latencies, counts):
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "mean_results": round(float(np.mean(counts)), 1)
+    }
+
+
+def run_benchmark(db_path, queries, radii, subtype=None, baseline_queries=5):
+    conn = sqlite3.connect(db_path)
+    points = query_points(queries)
+    report = {"db": db_path, "geolocations": conn.execute("SELECT COUNT(*) FROM address_geolocation").fetchone()[0], "radius_miles": {}}
+    for miles in radii:
+        latencies, counts = [], []
+        for latitude, longitude in points:
+            started = time.perf_counter()
+            results = find_facilities_within(conn, latitude, longitude, miles, subtype=subtype)
+            latencies.append(time.perf_counter() - started)
+            counts.append(len(results))
+        report["radius_miles"][str(miles)] = summarize(latencies, counts)
+
+    latencies = []
+    for latitude, longitude in points[:baseline_queries]:
+        started = time.perf_counter()
+        full_scan(conn, latitude, longitude, max(radii))
+        latencies.append(time.perf_counter() - started)
+    report["full_scan_baseline"] = summarize(latencies, [0])
+    conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark radius queries over the R*Tree spatial index.")
+    parser.add_argument("--db", default=None, help="Existing facilities database")
+    parser.add_argument("--synthetic", type=int, default=None, help="Build a synthetic database with this many facilities")
+    parser.add_argument("--queries", type=int, default=200, help="Query points per radius")
+    parser.add_argument("--radii", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--subtype", default=None, help="Restrict queries to one subtype")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    db_path = args.db
+    if args.synthetic:
+        db_path = os.path.join(tempfile.mkdtemp(), "facilities_benchmark.db")
+        started = time.perf_counter()
+        build_synthetic_db(db_path, args.synthetic)
+        print(f"Built synthetic database with {args.synthetic} facilities in {time.perf_counter() - started:.1f}s")
+    if db_path is None:
+        parser.error("give --db or --synthetic")
+
+    report = run_benchmark(db_path, args.queries, args.radii, args.subtype)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Latency benchmark of facility_search.search_facilities (FTS5) against the LIKE '%...%' scan it
+replaces.
+
+Queries are made from random entities the way people type them: the first letters of a few name
+words plus the city ("st mary reh springfield"). Every query is also checked to find the entity it
+was made from.
+
+    python benchmarks/text_search_benchmark.py --db facilities.db --queries 500
+    python benchmarks/text_search_benchmark.py --scale 10
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_search import SEARCH_WORD, search_facilities
+from query_service_load_test import build_database
+from radius_query_benchmark import summarize
+
+# The query this benchmark replaces: every word somewhere in the name, address or city
+LIKE_QUERY = """
+    SELECT e.entity_id, e.name, a.address, a.city
+    FROM entities e
+    JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi
+    WHERE {conditions}
+    LIMIT :limit
+"""
+
+
+def sample_queries(conn, count, seed=0):
+    """(text, entity_id) pairs: up to three name words cut to 3-6 letters, then the city."""
+    rng = np.random.default_rng(seed)
+    rows = conn.execute("""
+        SELECT e.entity_id, e.name, a.city FROM entities e
+        JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi
+        WHERE e.name IS NOT NULL AND a.city IS NOT NULL
+        ORDER BY random() LIMIT :count
+    """, {"count": count}).fetchall()
+    queries = []
+    for entity_id, name, city in rows:
+        words = SEARCH_WORD.findall(name.lower())[:3]
+        words = [word[:int(rng.integers(3, 7))] for word in words]
+        queries.append((" ".join(words + [city.lower()]), entity_id))
+    return queries
+
+
+def like_search(conn, text, limit=20):
+    words = SEARCH_WORD.findall(text.lower())
+    conditions = " AND ".join(f"(e.name || ' ' || a.address || ' ' || a.city) LIKE :w{i}" for i in range(len(words)))
+    params = {f"w{i}": f"%{word}%" for i, word in enumerate(words)}
+    params["limit"] = limit
+    return conn.execute(LIKE_QUERY.format(conditions=conditions), params).fetchall()
+
+
+def run_benchmark(db_path, queries, limit=20, like_queries=20):
+    conn = sqlite3.connect(db_path)
+    report = {
+        "db": db_path,
+        "entities": conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0],
+        "indexed_rows": conn.execute("SELECT COUNT(*) FROM entity_search").fetchone()[0]
+    }
+    sample = sample_queries(conn, queries)
+
+    latencies, counts, found = [], [], 0
+    for text, entity_id in sample:
+        started = time.perf_counter()
+        results = search_facilities(conn, text, limit=limit)
+        latencies.append(time.perf_counter() - started)
+        counts.append(len(results))
+        # A common name may rank the entity beyond the limit; the full result set must still hold it
+        found += any(row["entity_id"] == entity_id for row in search_facilities(conn, text, limit=10**9))
+    report["fts"] = summarize(latencies, counts)
+    report["fts"]["found_source_entity"] = round(found / len(sample), 3)
+
+    latencies, counts = [], []
+    for text, _ in sample[:like_queries]:
+        started = time.perf_counter()
+        counts.append(len(like_search(conn, text, limit)))
+        latencies.append(time.perf_counter() - started)
+    report["like_scan_baseline"] = summarize(latencies, counts)
+    conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full-text facility search against a LIKE scan.")
+    parser.add_argument("--db", default=None, help="Existing facilities database")
+    parser.add_argument("--scale", type=float, default=1, help="Build the database from synthetic data at this scale (without --db)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--like-queries", type=int, default=20, help="Queries timed with the LIKE scan")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        started = time.perf_counter()
+        workdir, db_path = build_database(args.scale)
+        print(f"Built the {args.scale:g}x database in {time.perf_counter() - started:.1f}s")
+    try:
+        report = run_benchmark(db_path, args.queries, like_queries=args.like_queries)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Change feed of the staged entities and addresses between builds, for the search indexes and
+caches that sync from our data and would otherwise reload everything after each build.
+
+Every row of datasets/output/entities.csv and addresses.csv is hashed (pandas'
+hash_pandas_object over all its columns) and compared by key (entity_id, address_id) with the
+hashes of the previous build, kept in a snapshot next to the feed. The rows inserted or updated
+since, and the keys deleted, are written as one Parquet file per table with the build's sequence
+number:
+
+    datasets/changes/feed.json                  the builds: sequence, time, files and counts
+    datasets/changes/entities_000002.parquet    sequence, op (insert/update/delete), entity columns
+    datasets/changes/snapshot_entities.parquet  entity_id and content_hash of the last build
+
+A consumer remembers the last sequence it applied and applies the later files in order (see
+read_changes and apply_changes): inserts and updates carry the whole new row, deletes only the
+key. The first build, or one without a snapshot, lists every row as inserted and is marked full:
+deletes before it are unknown, so a consumer reloads instead. A build changing nothing adds no
+sequence.
+
+The feed is written before the snapshot, so a build interrupted between the two repeats its
+changes under the next sequence; applying a change twice by key leaves the same rows.
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dtype_policy import arrow_to_pandas, read_typed_csv
+from pipeline_metrics import record_rows, span
+
+CHANGE_FOLDER = "datasets/changes"
+FEED_FILE = "feed.json"
+# Staged output of every table in the feed, with its key
+TABLES = {
+    "entities": ("datasets/output/entities.csv", "entity_id"),
+    "addresses": ("datasets/output/addresses.csv", "address_id"),
+}
+OPS = ["insert", "update", "delete"]
+
+
+def content_hashes(frame, key):
+    """The 64-bit hash of every row's content, indexed by its key."""
+    duplicated = frame[key].duplicated()
+    if duplicated.any():
+        raise ValueError(f"{key} {frame.loc[duplicated, key].iloc[0]} is repeated ({duplicated.sum()} duplicate rows); the feed needs unique keys.")
+    hashes = pd.util.hash_pandas_object(frame, index=False)
+    return pd.Series(hashes.to_numpy(), index=pd.Index(frame[key].to_numpy(dtype="int64"), name=key), name="content_hash")
+
+
+def load_snapshot(path):
+    """The key -> content hash Series of the previous build, or None when there is none."""
+    if not os.path.exists(path):
+        return None
+    snapshot = pd.read_parquet(path)
+    return snapshot.set_index(snapshot.columns[0])["content_hash"]
+
+
+def save_snapshot(hashes, path):
+    hashes.reset_index().to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def diff_hashes(previous, current):
+    """The keys inserted, updated and deleted from previous to current (Series of key -> hash)."""
+    if previous is None:
+        return {"insert": current.index, "update": current.index[:0], "delete": current.index[:0]}
+    common = current.index.intersection(previous.index)
+    changed = current.loc[common].to_numpy() != previous.loc[common].to_numpy()
+    return {
+        "insert": current.index.difference(previous.index),
+        "update": common[changed],
+        "delete": previous.index.difference(current.index),
+    }
+
+
+def change_table(frame, key, changes, sequence):
+    """
+    The Arrow table of a build's changes to one table: the rows inserted and updated, then the
+    deleted keys with every other column null.
+    """
+    keys = frame[key].to_numpy(dtype="int64")
+    parts = []
+    for op in ["insert", "update"]:
+        rows = frame[pd.Index(keys).isin(changes[op])]
+        parts.append(pd.concat([pd.DataFrame({"sequence": sequence, "op": op}, index=rows.index), rows], axis=1))
+    upserts = pa.Table.from_pandas(pd.concat(parts), preserve_index=False)
+    deleted = len(changes["delete"])
+    deletes = pa.table({
+        field.name: (
+            pa.array([sequence] * deleted, field.type) if field.name == "sequence"
+            else pa.array(["delete"] * deleted, field.type) if field.name == "op"
+            else pa.array(changes["delete"].to_numpy(), field.type) if field.name == key
+            else pa.nulls(deleted, field.type)
+        ) for field in upserts.schema
+    }, schema=upserts.schema)
+    return pa.concat_tables([upserts, deletes])
+
+
+def load_feed(folder=CHANGE_FOLDER):
+    """The feed manifest of a folder (no builds when none was written)."""
+    path = os.path.join(folder, FEED_FILE)
+    if not os.path.exists(path):
+        return {"sequence": 0, "builds": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_changes(folder=CHANGE_FOLDER, tables=TABLES):
+    """
+    Compares the staged tables with the snapshot of the previous build and writes their changes
+    under the next sequence number. Returns the feed entry of the build, or None when nothing changed.
+    """
+    os.makedirs(folder, exist_ok=True)
+    feed = load_feed(folder)
+    sequence = feed["sequence"] + 1
+    frames, hashes, changes = {}, {}, {}
+    full = False
+    for table, (path, key) in tables.items():
+        with span("hash_rows", table=table) as hash_span:
+            frames[table] = read_typed_csv(path)
+            hashes[table] = content_hashes(frames[table], key)
+            hash_span.rows = len(frames[table])
+        previous = load_snapshot(os.path.join(folder, f"snapshot_{table}.parquet"))
+        full = full or previous is None
+        changes[table] = diff_hashes(previous, hashes[table])
+
+    counts = {table: {op: len(changes[table][op]) for op in OPS} for table in tables}
+    total = sum(sum(table_counts.values()) for table_counts in counts.values())
+    record_rows(total)
+    if not total:
+        print(f"No changes since build {feed['sequence']}.")
+        return None
+
+    entry = {"sequence": sequence, "built_at": datetime.now().isoformat(timespec="seconds"), "full": full, "tables": {}}
+    with span("write_changes", rows=total):
+        for table, (_, key) in tables.items():
+            file_name = f"{table}_{sequence:06d}.parquet"
+            pq.write_table(change_table(frames[table], key, changes[table], sequence), os.path.join(folder, file_name))
+            entry["tables"][table] = {"file": file_name, "key": key, **counts[table]}
+        feed["sequence"] = sequence
+        feed["builds"].append(entry)
+        feed_path = os.path.join(folder, FEED_FILE)
+        with open(f"{feed_path}.tmp", "w") as f:
+            json.dump(feed, f, indent=2)
+        os.replace(f"{feed_path}.tmp", feed_path)
+        for table in tables:
+            save_snapshot(hashes[table], os.path.join(folder, f"snapshot_{table}.parquet"))
+
+    summary = ", ".join(f"{table} +{c['insert']} ~{c['update']} -{c['delete']}" for table, c in counts.items())
+    print(f"Build {sequence}{' (full)' if full else ''} written to {folder}: {summary}")
+    return entry
+
+
+def read_changes(table, since=0, folder=CHANGE_FOLDER):
+    """The changes to a table of every build after sequence `since`, oldest first, as one DataFrame."""
+    builds = [build for build in load_feed(folder)["builds"] if build["sequence"] > since]
+    if not builds:
+        return None
+    # Category dictionaries and pandas metadata differ from build to build
+    parts = [pq.read_table(os.path.join(folder, build["tables"][table]["file"])).replace_schema_metadata(None) for build in builds]
+    return arrow_to_pandas(pa.concat_tables(parts, promote_options="default"))
+
+
+def apply_changes(frame, changes, key):
+    """A table with changes (from read_changes) applied: what a consumer of the feed does."""
+    # Of several changes to one key, the last one holds
+    changes = changes.drop_duplicates(subset=key, keep="last")
+    kept = frame[~frame[key].isin(changes[key])]
+    upserts = changes.loc[changes["op"] != "delete", frame.columns]
+    result = pd.concat([kept, upserts], ignore_index=True)
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            result[column] = result[column].astype("category")
+        elif result[column].dtype != frame[column].dtype:
+            # Columns widened by the nulls of the delete rows
+            result[column] = result[column].astype(frame[column].dtype)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the changes to the staged entities and addresses since the last build.")
+    parser.add_argument("--folder", default=CHANGE_FOLDER, help=f"Folder of the feed and snapshots (default: {CHANGE_FOLDER})")
+    args = parser.parse_args(argv)
+    write_changes(args.folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,53 @@
 import sqlite3
 import pandas as pd
+from pipeline_metrics import record_rows
 
-# Connecting to SQLite
-conn = sqlite3.connect('facilities.db')
-cursor = conn.cursor()
 
+def main(db_path='facilities.db'):
+    """Flag the entities that share an address hash with another address row."""
+    # Connecting to SQLite
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
 
-# Identify duplicate hashes
-duplicated_hashes = pd.read_sql_query("""
-    SELECT address_hash
-    FROM addresses
-    GROUP BY address_hash
-    HAVING COUNT(*) > 1;
-""", conn)
-# Update related entities
-for hash_value in duplicated_hashes['address_hash']:
-    update_query = f"""
-        UPDATE entities
-        SET entity_unique_to_address = FALSE
-        WHERE ccn IN (
-            SELECT e.ccn
-            FROM entities e
-            JOIN addresses a ON e.ccn = a.ccn
-            WHERE a.address_hash = '{hash_value}'
-        ) OR npi IN (
-            SELECT e.npi
-            FROM entities e
-            JOIN addresses a ON e.npi = a.npi
-            WHERE a.address_hash = '{hash_value}'
-        );
-    """
-    cursor.execute(update_query)
 
-conn.commit()
-# audit process
-updated_entities = pd.read_sql_query("""
-    SELECT ccn, npi, entity_unique_to_address
-    FROM entities
-    WHERE entity_unique_to_address = FALSE;
-""", conn)
-updated_entities.to_csv('datasets/output/updated_entities_log.csv', index=False)
-conn.close()
-print("Process completed successfully.")
\ No newline at end of file
+    # Identify duplicate hashes
+    duplicated_hashes = pd.read_sql_query("""
+        SELECT address_hash
+        FROM addresses
+        GROUP BY address_hash
+        HAVING COUNT(*) > 1;
+    """, conn)
+    record_rows(len(duplicated_hashes))
+    # Update related entities
+    for hash_value in duplicated_hashes['address_hash']:
+        update_query = f"""
+            UPDATE entities
+            SET entity_unique_to_address = FALSE
+            WHERE ccn IN (
+                SELECT e.ccn
+                FROM entities e
+                JOIN addresses a ON e.ccn = a.ccn
+                WHERE a.address_hash = '{hash_value}'
+            ) OR npi IN (
+                SELECT e.npi
+                FROM entities e
+                JOIN addresses a ON e.npi = a.npi
+                WHERE a.address_hash = '{hash_value}'
+            );
+        """
+        cursor.execute(update_query)
+
+    conn.commit()
+    # audit process
+    updated_entities = pd.read_sql_query("""
+        SELECT ccn, npi, entity_unique_to_address
+        FROM entities
+        WHERE entity_unique_to_address = FALSE;
+    """, conn)
+    updated_entities.to_csv('datasets/output/updated_entities_log.csv', index=False)
+    conn.close()
+    print("Process completed successfully.")
+
+
+if __name__ == "__main__":
+    main()
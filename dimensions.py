@@ -0,0 +1,120 @@
+"""Shared dimensions of the staged tables, with the same ids in every run: states and the NUCC taxonomy."""
+import hashlib
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from dtype_policy import KEY, STRING
+
+TAXONOMY_FILE = "./NPPES_dictionary.csv"
+
+# (state_id, state_code, state_name) with the FIPS code as id (armed forces codes have none: 91-93);
+# add new codes with a new id, never renumber
+STATES = [
+    (1, "AL", "Alabama"), (2, "AK", "Alaska"), (4, "AZ", "Arizona"), (5, "AR", "Arkansas"),
+    (6, "CA", "California"), (8, "CO", "Colorado"), (9, "CT", "Connecticut"), (10, "DE", "Delaware"),
+    (11, "DC", "District of Columbia"), (12, "FL", "Florida"), (13, "GA", "Georgia"), (15, "HI", "Hawaii"),
+    (16, "ID", "Idaho"), (17, "IL", "Illinois"), (18, "IN", "Indiana"), (19, "IA", "Iowa"),
+    (20, "KS", "Kansas"), (21, "KY", "Kentucky"), (22, "LA", "Louisiana"), (23, "ME", "Maine"),
+    (24, "MD", "Maryland"), (25, "MA", "Massachusetts"), (26, "MI", "Michigan"), (27, "MN", "Minnesota"),
+    (28, "MS", "Mississippi"), (29, "MO", "Missouri"), (30, "MT", "Montana"), (31, "NE", "Nebraska"),
+    (32, "NV", "Nevada"), (33, "NH", "New Hampshire"), (34, "NJ", "New Jersey"), (35, "NM", "New Mexico"),
+    (36, "NY", "New York"), (37, "NC", "North Carolina"), (38, "ND", "North Dakota"), (39, "OH", "Ohio"),
+    (40, "OK", "Oklahoma"), (41, "OR", "Oregon"), (42, "PA", "Pennsylvania"), (44, "RI", "Rhode Island"),
+    (45, "SC", "South Carolina"), (46, "SD", "South Dakota"), (47, "TN", "Tennessee"), (48, "TX", "Texas"),
+    (49, "UT", "Utah"), (50, "VT", "Vermont"), (51, "VA", "Virginia"), (53, "WA", "Washington"),
+    (54, "WV", "West Virginia"), (55, "WI", "Wisconsin"), (56, "WY", "Wyoming"),
+    # Territories and freely associated states
+    (60, "AS", "American Samoa"), (64, "FM", "Federated States of Micronesia"), (66, "GU", "Guam"),
+    (68, "MH", "Marshall Islands"), (69, "MP", "Northern Mariana Islands"), (70, "PW", "Palau"),
+    (72, "PR", "Puerto Rico"), (74, "UM", "U.S. Minor Outlying Islands"), (78, "VI", "U.S. Virgin Islands"),
+    # Armed forces postal codes
+    (91, "AA", "Armed Forces Americas"), (92, "AE", "Armed Forces Europe"), (93, "AP", "Armed Forces Pacific"),
+]
+STATE_CODES = pd.Index([code for _, code, _ in STATES])
+STATE_IDS = np.array([state_id for state_id, _, _ in STATES], dtype="int64")
+# Ids of codes outside STATES start here
+OTHER_STATE_ID_START = 1000
+
+
+def normalize_state_codes(codes):
+    """Upper-cased, stripped state codes; blanks become missing."""
+    codes = pd.Series(codes, dtype=STRING).str.strip().str.upper()
+    return codes.mask(codes == "")
+
+
+def other_state_id(code):
+    """The id of a code missing from STATES, derived from the code alone."""
+    return OTHER_STATE_ID_START + int(hashlib.md5(code.encode()).hexdigest(), 16) % (10**9 - OTHER_STATE_ID_START)
+
+
+def state_ids(codes):
+    """Maps a column of state codes to their state ids (Int64, missing codes stay missing)."""
+    codes = normalize_state_codes(codes)
+    positions = pd.Categorical(codes, categories=STATE_CODES).codes
+    ids = pd.Series(STATE_IDS[positions], index=codes.index, dtype=KEY)
+    others = (positions == -1) & codes.notna().to_numpy()
+    if others.any():
+        ids[others] = codes[others].map({code: other_state_id(code) for code in codes[others].unique()}).astype(KEY)
+    ids[codes.isna()] = pd.NA
+    return ids
+
+
+def state_id(code):
+    """The state id of a single code (None when the code is missing)."""
+    return state_ids([code]).iloc[0] if pd.notna(code) else None
+
+
+def states_frame(codes=()):
+    """The states dimension: every preloaded state plus the other codes among `codes`."""
+    states = pd.DataFrame(STATES, columns=["state_id", "state_code", "state_name"])
+    codes = normalize_state_codes(list(codes)).dropna().unique()
+    others = [code for code in codes if code not in STATE_CODES]
+    if others:
+        states = pd.concat([states, pd.DataFrame({
+            "state_id": [other_state_id(code) for code in others],
+            "state_code": others,
+            "state_name": None
+        })], ignore_index=True)
+    return states.astype({"state_id": KEY, "state_code": "category", "state_name": STRING})
+
+
+def save_states(states_file, codes=()):
+    """
+    Writes the states dimension with the codes seen in this run and the ones already in the file.
+    Ids depend only on the code, so importers writing the file one after another agree on them.
+    """
+    if os.path.exists(states_file):
+        codes = list(codes) + pd.read_csv(states_file, dtype={"state_code": str})["state_code"].tolist()
+    states = states_frame(codes)
+    states.to_csv(states_file, index=False)
+    return states
+
+
+@lru_cache(maxsize=None)
+def taxonomy_dimension(path=TAXONOMY_FILE):
+    """The NUCC dictionary indexed by code (sorted) with its nucc_id, type and subtype; read once per process."""
+    taxonomy = pd.read_csv(path, dtype=str)
+    taxonomy = taxonomy.rename(columns={
+        "NUCC Code": "nucc_code", "Fashia - Facility Type": "type", "Fashia - Facility Subtype": "subtype"
+    })
+    taxonomy["nucc_code"] = taxonomy["nucc_code"].str.strip()
+    taxonomy = taxonomy.drop_duplicates("nucc_code").sort_values("nucc_code").set_index("nucc_code")
+    taxonomy.insert(0, "nucc_id", np.arange(1, len(taxonomy) + 1))
+    return taxonomy
+
+
+def taxonomy_details(codes, path=TAXONOMY_FILE):
+    """
+    Looks a column of NUCC codes up in the dictionary: a frame with its nucc_id (Int64), type and
+    subtype, missing for codes the dictionary does not have.
+    """
+    taxonomy = taxonomy_dimension(path)
+    codes = pd.Series(codes, dtype=STRING).str.strip()
+    positions = pd.Categorical(codes, categories=taxonomy.index).codes
+    found = positions != -1
+    details = taxonomy.iloc[np.where(found, positions, 0)].reset_index(drop=True)
+    details = details.astype({"nucc_id": KEY, "type": STRING, "subtype": STRING})
+    details.loc[~found] = pd.NA
+    details.index = codes.index
+    return details
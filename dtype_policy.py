@@ -0,0 +1,181 @@
+"""
+Column dtypes used wherever the pipeline reads a CSV or stages a table:
+
+- category for closed vocabularies (types and subtypes, NUCC codes, states, yes/no and switch
+  flags): a few distinct values repeated on every row, stored once plus a small code per row;
+- string[pyarrow] for free text and identifiers (names, addresses, CCN, NPI, ZIP codes), which
+  also keeps the leading zeros of CCNs and ZIP codes;
+- nullable Int64 for keys, so a missing key does not turn the column into floats.
+
+Columns the policy does not know keep the dtype pandas infers.
+
+CSVs are parsed by pyarrow's multithreaded reader with the policy columns parsed straight into
+their types (see read_typed_csv).
+"""
+import csv
+import io
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as arrow_csv
+
+STRING = pd.StringDtype("pyarrow")
+CATEGORY = "category"
+KEY = "Int64"
+
+# Every NPPES taxonomy slot repeats these columns with suffixes _1 to _15
+NPPES_TAXONOMY_SLOTS = 15
+TAXONOMY_CODE_COLUMNS = [f"Healthcare Provider Taxonomy Code_{n}" for n in range(1, NPPES_TAXONOMY_SLOTS + 1)]
+
+CATEGORY_COLUMNS = [
+    # Staged entities and states
+    "Type", "Subtype", "nucc_code", "employer_group_type", "state_code",
+    # CMS files
+    "State", "Hospital Type",
+    "Offers Nursing Care Services", "Offers Physical Therapy Services", "Offers Occupational Therapy Services",
+    "Offers Speech Pathology Services", "Offers Medical Social Services", "Offers Home Health Aide Services",
+    # NPPES
+    "Entity Type Code",
+    "Provider Business Practice Location Address State Name",
+    "Provider Business Practice Location Address Country Code (If outside U.S.)",
+] + TAXONOMY_CODE_COLUMNS + [
+    f"Provider License Number State Code_{n}" for n in range(1, NPPES_TAXONOMY_SLOTS + 1)
+] + [
+    f"Healthcare Provider Primary Taxonomy Switch_{n}" for n in range(1, NPPES_TAXONOMY_SLOTS + 1)
+]
+
+STRING_COLUMNS = [
+    # Staged entities, addresses and states
+    "name", "ccn", "npi", "employer_num", "address", "city", "zip_code", "cms_addr_id", "state_name",
+    # CMS files
+    "CMS Certification Number (CCN)", "Facility ID", "Facility Name", "Provider Name",
+    "Address Line 1", "Address Line 2", "Address", "Provider Address", "City/Town", "ZIP Code",
+    # NPPES
+    "NPI",
+    "Provider Organization Name (Legal Business Name)",
+    "Provider Last Name (Legal Name)",
+    "Provider First Name",
+    "Provider Middle Name",
+    "Provider First Line Business Practice Location Address",
+    "Provider Second Line Business Practice Location Address",
+    "Provider Business Practice Location Address City Name",
+    "Provider Business Practice Location Address Postal Code",
+    "Last Update Date",
+    "NPI Deactivation Date",
+    "Certification Date",
+] + [f"Provider License Number_{n}" for n in range(1, NPPES_TAXONOMY_SLOTS + 1)]
+
+KEY_COLUMNS = ["entity_id", "address_id", "address_hash", "state_id", "nucc_id"]
+
+COLUMN_DTYPES = {
+    **{column: CATEGORY for column in CATEGORY_COLUMNS},
+    **{column: STRING for column in STRING_COLUMNS},
+    **{column: KEY for column in KEY_COLUMNS},
+}
+
+
+# Arrow type each policy dtype is parsed into: dictionaries become categoricals, large strings are
+# what string[pyarrow] wraps without a copy
+ARROW_TYPES = {CATEGORY: pa.dictionary(pa.int32(), pa.string()), STRING: pa.large_string(), KEY: pa.int64()}
+ARROW_COLUMN_TYPES = {column: ARROW_TYPES[dtype] for column, dtype in COLUMN_DTYPES.items()}
+# What pd.read_csv reads as missing (Arrow's defaults lack "None" and "<NA>")
+NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def csv_dtypes(**overrides):
+    """
+    The dtype argument for read_csv; columns missing from the file are ignored by pandas. Keys are
+    left out: parsing straight into Int64 is about twice as slow as letting the parser infer
+    int64 and converting afterwards (read_typed_csv does both).
+    """
+    return {**{column: dtype for column, dtype in COLUMN_DTYPES.items() if dtype != KEY}, **overrides}
+
+
+def read_typed_csv(path, usecols=None):
+    """
+    Reads a CSV with every column the policy knows typed, parsing only usecols when given.
+
+    pyarrow parses blocks of the file on all cores, straight into the policy types, and the
+    columns are handed to pandas without a copy where the types allow it. A file Arrow cannot
+    read that way (a short row, a key written as a float like "12.0") raises ValueError naming
+    the file and the row or column.
+    """
+    source = io.BytesIO(path.read().encode()) if isinstance(path, io.TextIOBase) else path
+    try:
+        table = arrow_csv.read_csv(
+            source,
+            read_options=arrow_csv.ReadOptions(use_threads=True),
+            convert_options=arrow_csv.ConvertOptions(
+                column_types=ARROW_COLUMN_TYPES,
+                include_columns=usecols,
+                null_values=NULL_VALUES,
+                strings_can_be_null=True
+            )
+        )
+    except pa.ArrowInvalid as error:
+        raise ValueError(f"Cannot read {path}: {describe_arrow_error(source, error)}") from error
+    return arrow_to_pandas(table)
+
+
+def describe_arrow_error(source, error):
+    """Arrow's error message, with the name of the column it gives by number."""
+    match = re.search(r"column #(\d+)", str(error))
+    if match is None:
+        return str(error)
+    if hasattr(source, "seek"):
+        source.seek(0)
+        header = source.readline().decode()
+    else:
+        with open(source, newline="") as f:
+            header = f.readline()
+    columns = next(csv.reader([header]))
+    position = int(match.group(1))
+    return f"{error} ({columns[position]!r})" if position < len(columns) else str(error)
+
+
+def arrow_to_pandas(table):
+    """
+    The DataFrame of an Arrow table with the policy dtypes. Keys are converted on their own:
+    through to_pandas a key column with a missing value would pass through float64, which cannot
+    hold every 63-bit key.
+    """
+    keys = [column for column in table.column_names if COLUMN_DTYPES.get(column) == KEY]
+    key_columns = {column: pd.Int64Dtype().__from_arrow__(table[column]) for column in keys}
+    frame = table.drop_columns(keys).to_pandas(types_mapper={pa.large_string(): STRING}.get, split_blocks=True)
+    for column in keys:
+        frame.insert(table.column_names.index(column), column, key_columns[column])
+    for column in frame.columns:
+        if table.schema.field(column).type == pa.null():
+            # An empty column outside the policy: NaN floats, like pd.read_csv
+            frame[column] = frame[column].astype("float64")
+        elif isinstance(frame[column].dtype, pd.CategoricalDtype):
+            # Sorted categories, like pd.read_csv (Arrow keeps them in order of appearance)
+            frame[column] = frame[column].cat.reorder_categories(sorted(frame[column].cat.categories))
+    return frame
+
+
+def apply_dtypes(frame):
+    """Casts the columns of a frame built in memory (e.g. from a list of records) to the policy dtypes."""
+    for column in frame.columns:
+        dtype = COLUMN_DTYPES.get(column)
+        if dtype is not None and frame[column].dtype != dtype:
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+
+def share_categories(frame, columns):
+    """
+    Gives categorical columns the union of their categories, so they can be compared with each
+    other (pandas only compares categoricals with identical categories).
+    """
+    columns = [column for column in columns if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype)]
+    if not columns:
+        return frame
+    categories = pd.Index(sorted(set().union(*(frame[column].cat.categories for column in columns))))
+    shared = pd.CategoricalDtype(categories)
+    for column in columns:
+        frame[column] = frame[column].astype(shared)
+    return frame
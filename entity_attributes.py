@@ -0,0 +1,182 @@
+import argparse
+import os
+import pandas as pd
+from dtype_policy import read_typed_csv
+from pipeline_metrics import record_rows
+
+# Staged outputs produced by facilities_importer.py and nppes_importer.py
+entities_file = "datasets/output/entities.csv"
+addresses_file = "datasets/output/addresses.csv"
+
+# Flags filled by this stage (defaults live in the importers' required_columns)
+DERIVED_COLUMNS = [
+    "unique_facility_at_location",
+    "employer_group_type",
+    "multi_speciality_facility",
+    "multi_speciality_employer",
+    "employer_num",
+]
+
+
+def employer_key(frame):
+    """
+    Build the organization key used to group entities into employers.
+    CMS rows are keyed by CCN and NPPES rows by NPI, so the CCN wins when both exist.
+    """
+    ccn = frame["ccn"].astype("string").str.strip()
+    npi = frame["npi"].astype("string").str.strip()
+    return ccn.where(ccn.notna() & (ccn != ""), npi)
+
+
+def build_entity_links(entities, addresses):
+    """
+    Join every entity to the address hashes of its employer.
+
+    Returns one row per (entity_id, employer, address_hash) with the entity subtype,
+    which is the only frame the flag computation scans.
+    """
+    entity_frame = pd.DataFrame({
+        "entity_id": entities["entity_id"],
+        "employer": employer_key(entities),
+        "Subtype": entities["Subtype"],
+    })
+    address_frame = pd.DataFrame({
+        "employer": employer_key(addresses),
+        "address_hash": addresses["address_hash"],
+    }).dropna().drop_duplicates()
+    return entity_frame.merge(address_frame, on="employer", how="left")
+
+
+def compute_flags(links):
+    """
+    Compute every derived flag from the link frame in one pass.
+
+    - unique_facility_at_location: no other employer shares any of the entity's addresses.
+    - multi_speciality_facility: some address of the entity hosts more than one subtype.
+    - employer_group_type: 'none' for a single-entity employer, 'single' when all of its
+      entities sit at one address, 'multi' when they are spread across several.
+    - multi_speciality_employer: the employer covers more than one subtype.
+    - employer_num: the employer key (CCN or NPI).
+    """
+    located = links.dropna(subset=["address_hash"])
+    by_address = located.groupby("address_hash").agg(
+        address_employers=("employer", "nunique"),
+        address_subtypes=("Subtype", "nunique"),
+    )
+    by_employer = links.groupby("employer").agg(
+        employer_entities=("entity_id", "nunique"),
+        employer_addresses=("address_hash", "nunique"),
+        employer_subtypes=("Subtype", "nunique"),
+    )
+
+    located = located.join(by_address, on="address_hash")
+    by_entity = located.groupby("entity_id").agg(
+        shared_location=("address_employers", "max"),
+        location_subtypes=("address_subtypes", "max"),
+    )
+
+    flags = links.drop_duplicates(subset="entity_id")[["entity_id", "employer"]]
+    flags = flags.join(by_employer, on="employer").join(by_entity, on="entity_id")
+
+    flags["unique_facility_at_location"] = (flags["shared_location"] == 1).astype(int)
+    flags["multi_speciality_facility"] = (flags["location_subtypes"] > 1).astype(int)
+    flags["multi_speciality_employer"] = (flags["employer_subtypes"] > 1).astype(int)
+    flags["employer_group_type"] = "none"
+    flags.loc[flags["employer_entities"] > 1, "employer_group_type"] = "single"
+    flags.loc[(flags["employer_entities"] > 1) & (flags["employer_addresses"] > 1), "employer_group_type"] = "multi"
+    flags["employer_num"] = flags["employer"]
+    return flags.set_index("entity_id")[DERIVED_COLUMNS]
+
+
+def changed_scope(entities, addresses, changed_hashes):
+    """
+    The entity and address rows the flags of entities touched by changed addresses depend on,
+    found on the keys alone before any join: the employers with an address among the changed
+    hashes, every address of those employers, and every employer at one of those addresses.
+    """
+    address_employers = employer_key(addresses)
+    touched = address_employers[addresses["address_hash"].isin(changed_hashes)].dropna().unique()
+    hashes = addresses.loc[address_employers.isin(touched), "address_hash"].dropna().unique()
+    employers = address_employers[addresses["address_hash"].isin(hashes)].dropna().unique()
+    return (
+        entities[employer_key(entities).isin(employers)],
+        addresses[address_employers.isin(employers)]
+    )
+
+
+def affected_links(links, changed_hashes):
+    """
+    Restrict the link frame to what is needed to recompute entities touched by changed addresses.
+
+    Returns the restricted links and the entity ids whose flags must be refreshed. The
+    restricted frame keeps every row of the addresses and employers those entities reach,
+    so the group statistics computed from it are exact.
+    """
+    touched = links["address_hash"].isin(changed_hashes)
+    employers = links.loc[touched, "employer"].dropna().unique()
+    entity_ids = links.loc[touched | links["employer"].isin(employers), "entity_id"].unique()
+
+    scope = links["entity_id"].isin(entity_ids)
+    hashes = links.loc[scope, "address_hash"].dropna().unique()
+    employers = links.loc[scope, "employer"].dropna().unique()
+    subset = links[links["address_hash"].isin(hashes) | links["employer"].isin(employers)]
+    return subset, entity_ids
+
+
+def derive_entity_attributes(entities, addresses, changed_hashes=None):
+    """
+    Fill the derived entity flags from the staged entities and addresses.
+
+    When changed_hashes is given only the entities reachable from those address hashes are
+    recomputed, from a join of just the rows they depend on; every other row keeps its current
+    values.
+    """
+    if changed_hashes is not None:
+        changed_hashes = set(changed_hashes)
+        links = build_entity_links(*changed_scope(entities, addresses, changed_hashes))
+        links, entity_ids = affected_links(links, changed_hashes)
+    else:
+        links = build_entity_links(entities, addresses)
+        entity_ids = links["entity_id"].unique()
+
+    flags = compute_flags(links).loc[entity_ids]
+
+    entities = entities.copy()
+    mask = entities["entity_id"].isin(flags.index)
+    for column in DERIVED_COLUMNS:
+        if column not in entities.columns:
+            entities[column] = None
+        entities[column] = entities[column].astype(object)
+        entities.loc[mask, column] = entities.loc[mask, "entity_id"].map(flags[column]).values
+    return entities
+
+
+def load_changed_hashes(path):
+    """Read the address_hash column of a CSV listing the addresses that changed."""
+    return pd.read_csv(path, usecols=["address_hash"])["address_hash"].tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Derive entity flags from the staged entities and addresses.")
+    parser.add_argument("--changed-hashes", help="CSV with an address_hash column; only entities at those addresses are recomputed.")
+    args = parser.parse_args(argv)
+
+    if not (os.path.exists(entities_file) and os.path.exists(addresses_file)):
+        print(f"Staged files not found ({entities_file}, {addresses_file}). Nothing to derive.")
+        return
+
+    entities = read_typed_csv(entities_file)
+    # The flags only need the keys linking addresses to employers
+    addresses = read_typed_csv(addresses_file, usecols=["ccn", "npi", "address_hash"])
+
+    changed_hashes = load_changed_hashes(args.changed_hashes) if args.changed_hashes else None
+    entities = derive_entity_attributes(entities, addresses, changed_hashes)
+    entities.to_csv(entities_file, index=False)
+    record_rows(len(entities))
+
+    scope = "all" if changed_hashes is None else f"{len(changed_hashes)} changed addresses of"
+    print(f"Derived attributes for {scope} {len(entities)} entities saved to {entities_file}")
+
+
+if __name__ == "__main__":
+    main()
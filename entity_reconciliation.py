@@ -0,0 +1,99 @@
+"""
+Reconciles NPPES organizations with the CMS facilities they describe, by address_hash and NUCC
+code rather than by name.
+"""
+import pandas as pd
+from dtype_policy import KEY, STRING
+
+# NUCC codes are a four character classification and a specialization; "00000X" is none
+CLASSIFICATION_LENGTH = 4
+GENERIC_SPECIALIZATION = "00000X"
+# NPPES name columns compared with the CMS name, as in nppes_importer.compare_and_update
+NAME_COLUMNS = ["Provider Organization Name (Legal Business Name)", "Parent Organization LBN", "Provider Other Organization Name"]
+MATCH_COLUMNS = ["position", "taxonomy_field", "entity_id", "npi", "same_name", "attach_npi"]
+
+
+def comparable_names(values):
+    return pd.Series(values, dtype=STRING).str.strip().str.lower()
+
+
+def nppes_candidates(nppes_data, taxonomy_fields, address_hash_column, npi_column="NPI"):
+    """One row per filled taxonomy slot: its row position, field, code, address_hash, NPI and names."""
+    names = {column: comparable_names(nppes_data[column]).to_numpy() for column in NAME_COLUMNS if column in nppes_data.columns}
+    frames = []
+    for field in taxonomy_fields:
+        frame = pd.DataFrame({
+            "position": range(len(nppes_data)),
+            "taxonomy_field": field,
+            "nucc_code": pd.Series(nppes_data[field], dtype=STRING).str.strip().to_numpy(),
+            "address_hash": pd.Series(address_hash_column, dtype=KEY).to_numpy(),
+            "npi": pd.Series(nppes_data[npi_column], dtype=STRING).to_numpy(),
+            **{f"name_{index}": values for index, values in enumerate(names.values())}
+        })
+        frames.append(frame[frame["nucc_code"].notna() & frame["address_hash"].notna()])
+    if not frames:
+        return pd.DataFrame(columns=["position", "taxonomy_field", "nucc_code", "address_hash", "npi"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def cms_locations(cms_data, cms_addresses):
+    """CMS entities with the address_hash of their address, joined on the CCN."""
+    entities = pd.DataFrame({
+        "entity_id": pd.Series(cms_data["entity_id"], dtype=KEY).to_numpy(),
+        "ccn": pd.Series(cms_data["ccn"], dtype=STRING).to_numpy(),
+        "cms_nucc_code": pd.Series(cms_data["nucc_code"], dtype=STRING).str.strip().to_numpy(),
+        "cms_npi": pd.Series(cms_data["npi"], dtype=STRING).to_numpy(),
+        "cms_name": comparable_names(cms_data["name"]).to_numpy()
+    })
+    addresses = pd.DataFrame({
+        "ccn": pd.Series(cms_addresses["ccn"], dtype=STRING).to_numpy(),
+        "address_hash": pd.Series(cms_addresses["address_hash"], dtype=KEY).to_numpy()
+    }).dropna().drop_duplicates()
+    entities = entities[entities["ccn"].notna() & entities["cms_nucc_code"].notna()]
+    return entities.merge(addresses, on="ccn")
+
+
+def no_matches():
+    return pd.DataFrame(columns=MATCH_COLUMNS).astype({"position": "int64", "entity_id": KEY, "npi": STRING, "same_name": bool, "attach_npi": bool})
+
+
+def with_classification(frame, code_column):
+    frame = frame.copy()
+    frame["classification"] = frame[code_column].str[:CLASSIFICATION_LENGTH]
+    return frame
+
+
+def reconcile(nppes_data, taxonomy_fields, address_hash_column, cms_data, cms_addresses):
+    """
+    Matches the taxonomy slots of NPPES rows with the CMS entity at the same address_hash and a
+    compatible NUCC code. Returns one row per matched slot (MATCH_COLUMNS); attach_npi marks the
+    match whose NPI the entity takes.
+    """
+    candidates = nppes_candidates(nppes_data, taxonomy_fields, address_hash_column)
+    locations = cms_locations(cms_data, cms_addresses)
+    if candidates.empty or locations.empty:
+        return no_matches()
+
+    exact = candidates.merge(locations, left_on=["address_hash", "nucc_code"], right_on=["address_hash", "cms_nucc_code"])
+    matched = pd.MultiIndex.from_frame(exact[["position", "taxonomy_field"]])
+    rest = candidates[~pd.MultiIndex.from_frame(candidates[["position", "taxonomy_field"]]).isin(matched)]
+    # The others on the NUCC classification, when one code is the classification itself: an NPPES
+    # "Clinic/Center" (261Q00000X) finds the CMS dialysis clinic (261QE0700X), two specializations do not
+    related = with_classification(rest, "nucc_code").merge(with_classification(locations, "cms_nucc_code"), on=["address_hash", "classification"])
+    generic = related["nucc_code"].str.endswith(GENERIC_SPECIALIZATION) | related["cms_nucc_code"].str.endswith(GENERIC_SPECIALIZATION)
+    matches = pd.concat([exact, related[generic.fillna(False).astype(bool)]], ignore_index=True)
+    if matches.empty:
+        return no_matches()
+
+    name_columns = [column for column in matches.columns if column.startswith("name_")]
+    matches["same_name"] = False
+    for column in name_columns:
+        matches["same_name"] |= (matches[column] == matches["cms_name"]).fillna(False).astype(bool)
+
+    # One CMS entity per slot: the same name first, then the lowest entity_id
+    matches = matches.sort_values(["same_name", "entity_id"], ascending=[False, True], kind="stable")
+    matches = matches.drop_duplicates(["position", "taxonomy_field"])
+    # One NPI per CMS entity still without one: the same name first, then the lowest NPI
+    matches = matches.sort_values(["same_name", "npi"], ascending=[False, True], kind="stable")
+    matches["attach_npi"] = ~matches.duplicated("entity_id") & matches["cms_npi"].isna() & matches["npi"].notna()
+    return matches[MATCH_COLUMNS].sort_values(["position", "taxonomy_field"]).reset_index(drop=True)
@@ -1,40 +1,389 @@
-import subprocess
+import argparse
+import ast
+import asyncio
+import glob
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime
+import pipeline_metrics
 
-def execute_file(file_path):
+# Fingerprints of the last successful run of every stage
+STATE_FILE = "datasets/.chain_state.json"
+# Stages run at the same time when their inputs allow it
+MAX_PARALLEL_STAGES = int(os.getenv("CHAIN_MAX_PARALLEL_STAGES", "2"))
+
+entities_file = "datasets/output/entities.csv"
+addresses_file = "datasets/output/addresses.csv"
+states_file = "datasets/output/states.csv"
+key_migration_file = "datasets/output/key_migration.csv"
+nppes_filtered_file = "datasets/filtered/nppes_filtered_data.csv"
+db_file = "facilities.db"
+shard_manifest_file = "shards/manifest.json"
+change_feed_file = "datasets/changes/feed.json"
+
+# The pipeline, in an order that is valid when run one stage at a time. Every stage runs in this
+# process by calling `entry` (default main) of its module, with `kwargs`.
+# - inputs: files (or glob patterns) read by the stage
+# - outputs: files written or updated by the stage
+# - rebuilds: outputs the stage appends to, removed before it runs so a rerun starts clean
+# - appends: files created by an earlier stage that this stage appends to; rerunning it reruns their creator
+# Dependencies follow from the files: a stage waits for every earlier stage writing a file it reads
+# or writes, and for every earlier stage reading a file it writes.
+STAGES = [
+    {
+        "name": "facilities_importer",
+        "module": "facilities_importer",
+        "inputs": ["datasets/*_dataset.csv"],
+        "outputs": [entities_file, addresses_file, states_file, key_migration_file],
+        "rebuilds": [entities_file, addresses_file, states_file, key_migration_file]
+    },
+    {
+        "name": "filter_nppes_data",
+        "module": "filter_nppes_data",
+        "inputs": ["datasets/NPPES_file.csv"],
+        "outputs": [nppes_filtered_file]
+    },
+    {
+        "name": "nppes_importer",
+        "module": "nppes_importer",
+        "inputs": [nppes_filtered_file, entities_file, addresses_file, states_file, "NPPES_dictionary.csv"],
+        "outputs": [entities_file, addresses_file, states_file, key_migration_file],
+        "appends": [entities_file, addresses_file, states_file, key_migration_file]
+    },
+    {
+        "name": "entity_attributes",
+        "module": "entity_attributes",
+        "kwargs": {"argv": []},
+        "inputs": [entities_file, addresses_file],
+        "outputs": [entities_file]
+    },
+    {
+        "name": "change_feed",
+        "module": "change_feed",
+        "kwargs": {"argv": []},
+        "inputs": [entities_file, addresses_file],
+        "outputs": [change_feed_file]
+    },
+    {
+        "name": "setup_database",
+        "module": "setup_database",
+        "entry": "create_database",
+        "inputs": [entities_file, addresses_file, states_file, key_migration_file, "schema.sql"],
+        "outputs": [db_file]
+    },
+    {
+        "name": "check_unique_address_hash",
+        "module": "check_unique_address_hash",
+        "inputs": [db_file],
+        "outputs": [db_file, "datasets/output/updated_entities_log.csv"]
+    },
+    {
+        "name": "zip_centroid_geocoder",
+        "module": "zip_centroid_geocoder",
+        "inputs": [db_file, "zip5_centroids.csv.gz"],
+        "outputs": [db_file]
+    },
+    {
+        "name": "address_geocoder",
+        "module": "address_geocoder",
+        "inputs": [db_file],
+        "outputs": [db_file]
+    }
+]
+
+# Per-state shards of the database (see setup_database.create_shards), built only with --shards
+SHARD_STAGE = {
+    "name": "shard_database",
+    "module": "setup_database",
+    "entry": "create_shards",
+    "inputs": [db_file, "schema.sql"],
+    "outputs": [shard_manifest_file]
+}
+
+
+def stage_dependencies(stages):
+    """Maps each stage name to the earlier stages it has to wait for."""
+    dependencies = {}
+    for index, stage in enumerate(stages):
+        reads, writes = set(stage["inputs"]), set(stage["outputs"])
+        dependencies[stage["name"]] = [
+            earlier["name"] for earlier in stages[:index]
+            if set(earlier["outputs"]) & (reads | writes) or set(earlier["inputs"]) & writes
+        ]
+    return dependencies
+
+
+def file_fingerprint(pattern):
+    """(path, size, mtime) of every file matching a path or glob pattern."""
+    fingerprint = []
+    for path in sorted(glob.glob(pattern)):
+        stat = os.stat(path)
+        fingerprint.append([path, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def module_path(module):
+    """Source file of a module, found without importing it (None for built-in or missing modules)."""
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None or not spec.origin.endswith(".py"):
+        return None
+    return spec.origin
+
+
+def local_imports(path):
+    """Names of the modules imported by a source file, read from its syntax tree."""
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module)
+    return names
+
+
+def source_fingerprint(module):
     """
-    Run a Python file and capture the output.
+    Hash of the module's source and of every project module it imports, directly or through other
+    project modules (those next to it on disk), so an edit to a shared helper such as dimensions or
+    dtype_policy reruns the stages using it.
     """
-    try:
-        print(f"Running: {file_path}")
-        result = subprocess.run(
-            ["/usr/bin/python3", file_path],  # Full route
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"Output of {file_path}:\n{result.stdout}")
+    root = module_path(module)
+    if root is None:
+        return None
+    folder = os.path.dirname(root)
+    sources, pending = {}, [root]
+    while pending:
+        path = pending.pop()
+        if path in sources:
+            continue
+        with open(path, "rb") as f:
+            sources[path] = hashlib.sha256(f.read()).hexdigest()
+        for name in local_imports(path):
+            imported = module_path(name)
+            if imported is not None and os.path.dirname(imported) == folder:
+                pending.append(imported)
+    digest = hashlib.sha256()
+    for path in sorted(sources):
+        digest.update(f"{os.path.basename(path)}:{sources[path]}\n".encode())
+    return digest.hexdigest()
+
+
+def stage_fingerprints(stages, dependencies, state):
+    """
+    Fingerprints every stage from its source, the size and mtime of its external inputs (files no
+    stage produces) and the fingerprints of the stages it depends on, so a change anywhere upstream
+    reaches every stage below it.
+
+    A stage whose external inputs are all gone (say the NPPES download was deleted after filtering)
+    but whose outputs exist keeps the fingerprint of its last successful run; those stages are
+    returned as well.
+    """
+    fingerprints, kept, produced = {}, set(), set()
+    for stage in stages:
+        external = [pattern for pattern in stage["inputs"] if pattern not in produced]
+        inputs = {pattern: file_fingerprint(pattern) for pattern in external}
+        produced.update(stage["outputs"])
+        if external and not any(inputs.values()) and stage["name"] in state and outputs_exist(stage):
+            fingerprints[stage["name"]] = state[stage["name"]]
+            kept.add(stage["name"])
+            continue
+        payload = {
+            "source": source_fingerprint(stage["module"]),
+            "entry": stage.get("entry", "main"),
+            "kwargs": stage.get("kwargs", {}),
+            "inputs": inputs,
+            "upstream": [fingerprints[name] for name in dependencies[stage["name"]]]
+        }
+        fingerprints[stage["name"]] = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return fingerprints, kept
+
+
+def outputs_exist(stage):
+    return all(glob.glob(pattern) for pattern in stage["outputs"])
+
+
+def plan_stages(stages, dependencies, fingerprints, state, force=None):
+    """
+    Returns the names of the stages to run: forced ones, those whose fingerprint differs from the
+    last successful run or whose outputs are gone, everything downstream of them, and the creators
+    of files a rerun stage appends to.
+    """
+    force = set(force or [])
+    run = {
+        stage["name"] for stage in stages
+        if stage["name"] in force or state.get(stage["name"]) != fingerprints[stage["name"]] or not outputs_exist(stage)
+    }
+
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            name = stage["name"]
+            if name in run:
+                continue
+            downstream = any(dependency in run for dependency in dependencies[name])
+            appended = any(
+                set(stage.get("rebuilds", [])) & set(other.get("appends", []))
+                for other in stages if other["name"] in run
+            )
+            if downstream or appended:
+                run.add(name)
+                changed = True
+    return run
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    """Writes the state file atomically, so an interrupted run never leaves it half written."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def run_stage(stage, profiler=None, profile_stem=None):
+    """
+    Runs one stage in this process inside a metrics span (optionally under a profiler) and returns
+    its duration in seconds.
+    """
+    with pipeline_metrics.span(stage["name"], sample_memory=True) as stage_span:
+        for path in stage.get("rebuilds", []):
+            if os.path.exists(path):
+                os.remove(path)
+        module = importlib.import_module(stage["module"])
+        entry = getattr(module, stage.get("entry", "main"))
+        with pipeline_metrics.profiled(profiler, profile_stem) if profiler else nullcontext():
+            result = entry(**stage.get("kwargs", {}))
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+    return stage_span.wall_seconds
+
+
+def run_chain(stages=STAGES, state_path=STATE_FILE, max_parallel=MAX_PARALLEL_STAGES, force=None, dry_run=False, profile=None, report_path=None):
+    """
+    Runs the stages that are out of date, each as soon as the stages it depends on are done and
+    with at most max_parallel at a time. Stops scheduling after the first failure.
+
+    Timings, rows, throughput and peak memory of the stages that ran are written as a JSON run
+    report (report_path, by default under pipeline_metrics.REPORT_FOLDER). profile maps stage
+    names to a profiler ('cprofile' or 'tracemalloc') whose output is saved next to the report.
+    Returns True when every scheduled stage succeeded.
+    """
+    started_at = datetime.now()
+    report_path = report_path or pipeline_metrics.report_path(started_at)
+    profile = profile or {}
+    dependencies = stage_dependencies(stages)
+    state = load_state(state_path)
+    fingerprints, kept = stage_fingerprints(stages, dependencies, state)
+    to_run = plan_stages(stages, dependencies, fingerprints, state, force)
+
+    for stage in stages:
+        if stage["name"] in to_run:
+            print(f"[{stage['name']}] run")
+        elif stage["name"] in kept:
+            print(f"[{stage['name']}] inputs not found, keeping the existing outputs")
+        else:
+            print(f"[{stage['name']}] up to date, skipped")
+    if dry_run or not to_run:
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing {file_path}: {e.stderr}")
+
+    pending = [stage for stage in stages if stage["name"] in to_run]
+    running, done, failed = {}, set(), None
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while pending or running:
+            if failed is None:
+                for stage in list(pending):
+                    if len(running) >= max_parallel:
+                        break
+                    if all(d in done or d not in to_run for d in dependencies[stage["name"]]):
+                        # Forget the last success first, so an interrupted stage is never skipped
+                        state.pop(stage["name"], None)
+                        save_state(state, state_path)
+                        print(f"[{stage['name']}] started")
+                        profile_stem = f"{os.path.splitext(report_path)[0]}.{stage['name']}"
+                        running[executor.submit(run_stage, stage, profile.get(stage["name"]), profile_stem)] = stage
+                        pending.remove(stage)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    elapsed = future.result()
+                except (Exception, SystemExit) as e:
+                    print(f"[{stage['name']}] failed: {e!r}")
+                    failed = failed or stage["name"]
+                    continue
+                done.add(stage["name"])
+                state[stage["name"]] = fingerprints[stage["name"]]
+                save_state(state, state_path)
+                print(f"[{stage['name']}] finished in {elapsed:.2f} seconds")
+
+    report = pipeline_metrics.run_report(
+        started_at,
+        skipped=[stage["name"] for stage in stages if stage["name"] not in to_run],
+        failed=failed
+    )
+    pipeline_metrics.write_report(report, report_path)
+    pipeline_metrics.reset()
+    print(f"Run report saved to {report_path}")
+
+    if failed is not None:
+        print(f"Stopping execution due to an error in {failed}.")
         return False
+    return True
+
 
 def main():
-    # List of files to be executed in a chain
-    files_to_execute = [
-        "facilities_importer.py",
-        "nppes_importer.py",
-        "setup_database.py",
-        "check_unique_address_hash.py",
-        "address_geocoder.py"
-    ]
-
-    for file in files_to_execute:
-        success = execute_file(file)
-        if not success:
-            print(f"Stopping execution due to an error in {file}.")
-            break
-    else:
-        print("All files executed successfully.")
+    parser = argparse.ArgumentParser(description="Run the import pipeline, skipping stages whose inputs have not changed.")
+    parser.add_argument("--force", nargs="*", default=None, metavar="STAGE", help="Rerun these stages (all when no stage is given) and everything below them")
+    parser.add_argument("--jobs", type=int, default=MAX_PARALLEL_STAGES, help="Stages run at the same time (use 1 for per-stage peak memory)")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run")
+    parser.add_argument("--shards", action="store_true", help="Also split the database into per-state shards")
+    parser.add_argument("--report", default=None, help="Path of the JSON run report")
+    parser.add_argument(
+        "--profile", action="append", default=[], metavar="STAGE[=PROFILER]",
+        help=f"Profile a stage with {' or '.join(pipeline_metrics.PROFILERS)} (default cprofile); may be repeated"
+    )
+    args = parser.parse_args()
+
+    stages = STAGES + [SHARD_STAGE] if args.shards else STAGES
+    force = args.force
+    if force is not None and not force:
+        force = [stage["name"] for stage in stages]
+    profile = dict(
+        (option.split("=", 1) + ["cprofile"])[:2] for option in args.profile
+    )
+    unknown = (set(force or []) | set(profile)) - {stage["name"] for stage in stages}
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    if set(profile.values()) - set(pipeline_metrics.PROFILERS):
+        parser.error(f"profilers must be one of {', '.join(pipeline_metrics.PROFILERS)}")
+
+    started = time.time()
+    if run_chain(stages, max_parallel=args.jobs, force=force, dry_run=args.dry_run, profile=profile, report_path=args.report) and not args.dry_run:
+        print(f"All stages up to date in {time.time() - started:.2f} seconds.")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
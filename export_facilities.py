@@ -0,0 +1,174 @@
+"""
+Flat export of every entity with its addresses, state and coordinates, as Parquet or NDJSON.
+
+The four-way join is streamed out of SQLite: the cursor steps through the result and hands over
+--batch-size rows at a time, each written as one Parquet row group (or a block of NDJSON lines) and
+then dropped, so memory stays flat whatever the table size. With --partition-by the rows come
+sorted by state or subtype (SQLite's sorter spills to temporary files, not to memory) and every
+partition goes to its own folder, Hive style:
+
+    export/state_code=IL/part-00000.parquet
+
+    python export_facilities.py --db facilities.db --output export --format parquet --partition-by state
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.parquet as pq
+from stable_keys import keys_as_strings
+
+db_path = "facilities.db"
+BATCH_SIZE = 50_000
+FORMATS = {"parquet": ".parquet", "ndjson": ".ndjson"}
+PARTITION_COLUMNS = {"state": "state_code", "subtype": "subtype"}
+# Folder of the rows whose partition column is empty
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+EXPORT_SCHEMA = pa.schema([
+    ("entity_id", pa.int64()),
+    ("name", pa.string()),
+    ("ccn", pa.string()),
+    ("npi", pa.string()),
+    ("type", pa.string()),
+    ("subtype", pa.string()),
+    ("nucc_code", pa.string()),
+    ("address_hash", pa.int64()),
+    ("address", pa.string()),
+    ("city", pa.string()),
+    ("zip_code", pa.string()),
+    ("state_code", pa.string()),
+    ("state_name", pa.string()),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+    ("precision", pa.string()),
+])
+
+# CMS entities are linked to addresses by CCN and NPPES entities by NPI. Identifiers are cast to
+# text, so a column loaded with mixed types still fits the export schema.
+EXPORT_QUERY = """
+    SELECT e.entity_id, e.name, CAST(e.ccn AS TEXT), CAST(e.npi AS TEXT), e.type, e.subtype, e.nucc_code,
+           a.address_hash, a.address, a.city, CAST(a.zip_code AS TEXT), s.state_code, s.state_name,
+           g.latitude, g.longitude, g."precision"
+    FROM entities e
+    LEFT JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi
+    LEFT JOIN states s ON s.state_id = a.state_id
+    LEFT JOIN address_geolocation g ON g.address_hash = a.address_hash
+    {order_by}
+"""
+
+
+def export_batches(conn, batch_size=BATCH_SIZE, partition_column=None):
+    """Yields the export rows as RecordBatches of at most batch_size rows, sorted by the partition column when given."""
+    order_by = f"ORDER BY {partition_column}" if partition_column else ""
+    cursor = conn.execute(EXPORT_QUERY.format(order_by=order_by))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, EXPORT_SCHEMA)],
+            schema=EXPORT_SCHEMA
+        )
+    cursor.close()
+
+
+class ParquetPart:
+    def __init__(self, path, compression):
+        self.writer = pq.ParquetWriter(path, EXPORT_SCHEMA, compression=compression)
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+class NDJSONPart:
+    def __init__(self, path, compression=None):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, batch):
+        # Keys are written as strings: JSON parsers in JavaScript round numbers past 2**53
+        self.file.writelines(json.dumps(keys_as_strings(row)) + "\n" for row in batch.to_pylist())
+
+    def close(self):
+        self.file.close()
+
+
+def partition_folder(value, column):
+    """Folder name of a partition value; characters unsafe in paths are percent-encoded."""
+    return f"{column}={NULL_PARTITION if value is None else quote(str(value), safe=' &(),-.')}"
+
+
+def split_by_value(batch, column):
+    """Splits a batch sorted by `column` into (value, slice) runs."""
+    values = batch.column(column).to_pylist()
+    start = 0
+    for position in range(1, len(values) + 1):
+        if position == len(values) or values[position] != values[start]:
+            yield values[start], batch.slice(start, position - start)
+            start = position
+
+
+def export(db_path, output, file_format="parquet", partition_by=None, batch_size=BATCH_SIZE, compression="snappy"):
+    """
+    Writes the flat export to `output`: one file (output + extension) without partitioning, or a
+    folder with a file per partition. Returns the number of rows written per file.
+    """
+    part_class = ParquetPart if file_format == "parquet" else NDJSONPart
+    extension = FORMATS[file_format]
+    column = PARTITION_COLUMNS[partition_by] if partition_by else None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    written = {}
+    part, part_path, part_value = None, None, None
+    # A partition met again (e.g. a subtype under another type) gets its next part number
+    parts_per_partition = {}
+    try:
+        for batch in export_batches(conn, batch_size, column):
+            runs = split_by_value(batch, column) if column else [(None, batch)]
+            for value, rows in runs:
+                if part is None or (column and value != part_value):
+                    if part is not None:
+                        part.close()
+                    if column:
+                        folder = os.path.join(output, partition_folder(value, column))
+                        os.makedirs(folder, exist_ok=True)
+                        number = parts_per_partition.get(folder, 0)
+                        parts_per_partition[folder] = number + 1
+                        part_path = os.path.join(folder, f"part-{number:05d}{extension}")
+                    else:
+                        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+                        part_path = output if output.endswith(extension) else output + extension
+                    part, part_value = part_class(part_path, compression), value
+                    written[part_path] = 0
+                part.write(rows)
+                written[part_path] += rows.num_rows
+    finally:
+        if part is not None:
+            part.close()
+        conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export entities with their addresses, states and coordinates to Parquet or NDJSON.")
+    parser.add_argument("--db", default=db_path, help="Facilities database")
+    parser.add_argument("--output", default="datasets/export/facilities", help="Output file (without partitioning) or folder")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--partition-by", choices=sorted(PARTITION_COLUMNS), default=None)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows fetched and written at a time (one Parquet row group)")
+    parser.add_argument("--compression", default="snappy", help="Parquet compression codec")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    written = export(args.db, args.output, args.format, args.partition_by, args.batch_size, args.compression)
+    print(f"Exported {sum(written.values())} rows to {len(written)} files under {args.output} in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import os
 import pandas as pd
-import hashlib
-import math
+from address_normalization import address_keys, key_hashes, legacy_address_hashes
+from dimensions import save_states, state_ids
+from dtype_policy import apply_dtypes, read_typed_csv
+from pipeline_metrics import record_rows, span
+from stable_keys import (KEY_MIGRATION_FILE, KeyLedger, address_id_sources, legacy_address_ids, legacy_keys,
+                         source_strings, stable_key, stable_keys)
 print("Environment setup complete!")
 
 
@@ -17,24 +21,23 @@ files = [
 ]
 
 
-# Create the folder for filtered files if it doesn't exist
+# Folder for filtered files
 filtered_folder = "datasets/filtered"
-os.makedirs(filtered_folder, exist_ok=True)
 
 # Output folder and file
 output_folder = "datasets/output"
-os.makedirs(output_folder, exist_ok=True)
 output_file = os.path.join(output_folder, "entities.csv")
 
 # Output files for the Addresses and States tables
 addresses_file = "datasets/output/addresses.csv"
+ADDRESS_COLUMNS = ["address_id", "npi", "ccn", "address", "city", "state_id", "zip_code", "cms_addr_id", "address_hash", "primary_practice_address"]
 states_file = "datasets/output/states.csv"
 
 # Dictionary of rules based on the file name
 file_rules_mapping = {
     "dialysis_facility_dataset.csv": {"Type": "Clinic", "Subtype": "Dialysis Clinic", "nucc_code": "261QE0700X"},
     "nursing_home_dataset.csv": {"Type": "Nursing & Assisted Living", "Subtype": "Skilled Nursing Facility", "nucc_code": "314000000X"},
-    "hospice_dataset.csv-Information_Aug2024.csv": {"Type": "Agency", "Subtype": "Community Based Hospice Care Agency", "nucc_code": "251G00000X"},
+    "hospice_dataset.csv": {"Type": "Agency", "Subtype": "Community Based Hospice Care Agency", "nucc_code": "251G00000X"},
     "inpatient_rehabilitation_facility_dataset.csv": {
         "SubRules": {
             "true": {"Type": "Hospital", "Subtype": "Rehabilitation Hospital", "nucc_code": "283X00000X"},
@@ -82,9 +85,6 @@ column_mapping = {
     "ZipCode": ["ZIP Code"]  # No alternatives
 }
 
-# Create the folder for filtered files if it doesn't exist
-filtered_folder = "datasets/filtered"
-os.makedirs(filtered_folder, exist_ok=True)
 
 # Required columns and their default values
 required_columns = {
@@ -153,172 +153,131 @@ def process_file(file_name, data):
         return pd.DataFrame()
 
     entities = []
-    def get_base_key(row):
-        """Determine the base key for primary key generation."""
-        if "Facility ID" in data.columns:
-            return row.get("Facility ID")
-        elif "CMS Certification Number (CCN)" in data.columns:
-            return row.get("CMS Certification Number (CCN)")
-        return None
-    
-    # Function to generate a numeric primary key
-    def generate_unique_key(base_key, subrule_index=None):
-        """Generate a unique primary key based on a base key and subrule index."""
-        if subrule_index is not None:
-            unique_key = f"{base_key}_{subrule_index}"
-        else:
-            unique_key = f"{base_key}"
-        return int(hashlib.md5(unique_key.encode()).hexdigest(), 16) % (10**9)
+    # Primary keys come from the Facility ID or CCN, with the subrule index when a subrule made the row
+    base_key_column = next((column for column in ["Facility ID", "CMS Certification Number (CCN)"] if column in data.columns), None)
+
+    def assign_unique_keys(frame, subrule_index=None):
+        """Sets the PrimaryKey of every row of frame (and its source, for the key audit)."""
+        base_keys = frame[base_key_column] if base_key_column else pd.Series(None, index=frame.index, dtype=object)
+        sources = source_strings(base_keys) if subrule_index is None else source_strings(base_keys, subrule_index, separator="_")
+        frame["PrimaryKey"] = stable_keys(sources)
+        key_ledger.add("entity_id", frame["PrimaryKey"], sources, [legacy_keys(sources)])
 
     # Process general rules
     if "Type" in rules and "Subtype" in rules and "nucc_code" in rules:
-        data["Type"] = rules["Type"]
-        data["Subtype"] = rules["Subtype"]
-        data["nucc_code"] = rules["nucc_code"]
-        # Generate unique primary keys for each record
-        data["PrimaryKey"] = data.apply(
-            lambda row: generate_unique_key(get_base_key(row)),
-            axis=1
-        )
-        entities.extend(data.to_dict(orient="records"))
+        with span("general_rules", rows=len(data)):
+            data["Type"] = rules["Type"]
+            data["Subtype"] = rules["Subtype"]
+            data["nucc_code"] = rules["nucc_code"]
+            # Generate unique primary keys for each record
+            assign_unique_keys(data)
+            entities.extend(data.to_dict(orient="records"))
 
     # Process subrules
     if "SubRules" in rules:
-        if rules.get("typeSubRules") == "ifCnnIsNumber":
-            for subrule_index, (condition, subrule) in enumerate(rules["SubRules"].items(), start=1):
-                filtered_data = data[
-                    data["CMS Certification Number (CCN)"].str.isnumeric() if condition == "true" else
-                    ~data["CMS Certification Number (CCN)"].str.isnumeric()
-                ].copy()
-                print(f"Filtered {len(filtered_data)} rows for condition '{condition}' in 'ifCnnIsNumber'.")
+        with span("subrules", rule_type=rules.get("typeSubRules")) as subrules_span:
+            generated_before = len(entities)
+            if rules.get("typeSubRules") == "ifCnnIsNumber":
+                for subrule_index, (condition, subrule) in enumerate(rules["SubRules"].items(), start=1):
+                    filtered_data = data[
+                        data["CMS Certification Number (CCN)"].str.isnumeric() if condition == "true" else
+                        ~data["CMS Certification Number (CCN)"].str.isnumeric()
+                    ].copy()
+                    print(f"Filtered {len(filtered_data)} rows for condition '{condition}' in 'ifCnnIsNumber'.")
                 
-                if not filtered_data.empty:
-                    filtered_data.loc[:, "Type"] = subrule["Type"]
-                    filtered_data.loc[:, "Subtype"] = subrule["Subtype"]
-                    filtered_data.loc[:, "nucc_code"] = subrule["nucc_code"]
-                    # Generate unique primary keys for subrule records
-                    filtered_data["PrimaryKey"] = filtered_data.apply(
-                        lambda row: generate_unique_key(get_base_key(row), subrule_index=subrule_index),
-                        axis=1
-                    )
-                    entities.extend(filtered_data.to_dict(orient="records"))
-
-        elif rules.get("typeSubRules") == "duplicateByActiveFlag":
-            for subrule_index, (column, subrule) in enumerate(rules["SubRules"].items(), start=1):
-                if column in data.columns:
-                    filtered_data = data[data[column] == "Yes"].copy()
-                    print(f"Filtered {len(filtered_data)} rows for column '{column}' in 'duplicateByActiveFlag'.")
-                    
                     if not filtered_data.empty:
                         filtered_data.loc[:, "Type"] = subrule["Type"]
                         filtered_data.loc[:, "Subtype"] = subrule["Subtype"]
                         filtered_data.loc[:, "nucc_code"] = subrule["nucc_code"]
                         # Generate unique primary keys for subrule records
-                        filtered_data["PrimaryKey"] = filtered_data.apply(
-                            lambda row: generate_unique_key(get_base_key(row), subrule_index=subrule_index),
-                            axis=1
-                        )
+                        assign_unique_keys(filtered_data, subrule_index=subrule_index)
                         entities.extend(filtered_data.to_dict(orient="records"))
-                else:
-                    print(f"Column '{column}' not found in {file_name}. Skipping subrule.")
-
-        elif rules.get("typeSubRules") == "checkByFieldValue":
-            if "Hospital Type" in data.columns:
-                for subrule_index, (field_value, subrule) in enumerate(rules["SubRules"].items(), start=1):
-                    if isinstance(subrule, list):  # Handle lists of subrules
-                        filtered_data = data[data["Hospital Type"] == field_value].copy()
-                        print(f"Filtered {len(filtered_data)} rows for field value '{field_value}' in 'checkByFieldValue'.")
-
-                        if not filtered_data.empty:
-                            for rule_index, rule in enumerate(subrule, start=1):
-                                entity_data = filtered_data.copy()
-                                entity_data.loc[:, "Type"] = rule["Type"]
-                                entity_data.loc[:, "Subtype"] = rule["Subtype"]
-                                entity_data.loc[:, "nucc_code"] = rule["nucc_code"]
-                                # Generate unique primary keys for each subrule and subrule index
-                                entity_data["PrimaryKey"] = entity_data.apply(
-                                    lambda row: generate_unique_key(
-                                        get_base_key(row), 
-                                        subrule_index=subrule_index * 10 + rule_index  # Differentiate between subrules
-                                    ),
-                                    axis=1
-                                )
-                                entities.extend(entity_data.to_dict(orient="records"))
-                    else:
-                        filtered_data = data[data["Hospital Type"] == field_value].copy()
-                        print(f"Filtered {len(filtered_data)} rows for field value '{field_value}' in 'checkByFieldValue'.")
 
+            elif rules.get("typeSubRules") == "duplicateByActiveFlag":
+                for subrule_index, (column, subrule) in enumerate(rules["SubRules"].items(), start=1):
+                    if column in data.columns:
+                        filtered_data = data[data[column] == "Yes"].copy()
+                        print(f"Filtered {len(filtered_data)} rows for column '{column}' in 'duplicateByActiveFlag'.")
+                    
                         if not filtered_data.empty:
                             filtered_data.loc[:, "Type"] = subrule["Type"]
                             filtered_data.loc[:, "Subtype"] = subrule["Subtype"]
                             filtered_data.loc[:, "nucc_code"] = subrule["nucc_code"]
                             # Generate unique primary keys for subrule records
-                            filtered_data["PrimaryKey"] = filtered_data.apply(
-                                lambda row: generate_unique_key(get_base_key(row), subrule_index=subrule_index),
-                                axis=1
-                            )
+                            assign_unique_keys(filtered_data, subrule_index=subrule_index)
                             entities.extend(filtered_data.to_dict(orient="records"))
-            else:
-                print(f"'Hospital Type' column not found in {file_name}. Skipping checkByFieldValue subrules.")
+                    else:
+                        print(f"Column '{column}' not found in {file_name}. Skipping subrule.")
+
+            elif rules.get("typeSubRules") == "checkByFieldValue":
+                if "Hospital Type" in data.columns:
+                    for subrule_index, (field_value, subrule) in enumerate(rules["SubRules"].items(), start=1):
+                        if isinstance(subrule, list):  # Handle lists of subrules
+                            filtered_data = data[data["Hospital Type"] == field_value].copy()
+                            print(f"Filtered {len(filtered_data)} rows for field value '{field_value}' in 'checkByFieldValue'.")
+
+                            if not filtered_data.empty:
+                                for rule_index, rule in enumerate(subrule, start=1):
+                                    entity_data = filtered_data.copy()
+                                    entity_data.loc[:, "Type"] = rule["Type"]
+                                    entity_data.loc[:, "Subtype"] = rule["Subtype"]
+                                    entity_data.loc[:, "nucc_code"] = rule["nucc_code"]
+                                    # Generate unique primary keys for each subrule and subrule index
+                                    assign_unique_keys(entity_data, subrule_index=subrule_index * 10 + rule_index)
+                                    entities.extend(entity_data.to_dict(orient="records"))
+                        else:
+                            filtered_data = data[data["Hospital Type"] == field_value].copy()
+                            print(f"Filtered {len(filtered_data)} rows for field value '{field_value}' in 'checkByFieldValue'.")
+
+                            if not filtered_data.empty:
+                                filtered_data.loc[:, "Type"] = subrule["Type"]
+                                filtered_data.loc[:, "Subtype"] = subrule["Subtype"]
+                                filtered_data.loc[:, "nucc_code"] = subrule["nucc_code"]
+                                # Generate unique primary keys for subrule records
+                                assign_unique_keys(filtered_data, subrule_index=subrule_index)
+                                entities.extend(filtered_data.to_dict(orient="records"))
+                else:
+                    print(f"'Hospital Type' column not found in {file_name}. Skipping checkByFieldValue subrules.")
+
+            subrules_span.rows = len(entities) - generated_before
 
     print(f"Generated {len(entities)} entities for file: {file_name}")
-    return pd.DataFrame(entities)
-
-
-# Initialize a global states mapping to assign unique StateIDs
-state_mapping = {}
-def initialize_state_mapping(states_file):
-    """Initialize the state_mapping with the existing states CSV file."""
-    if os.path.exists(states_file):
-        states_df = pd.read_csv(states_file)
-        for _, row in states_df.iterrows():
-            state_code = row["state_code"]
-            state_mapping[state_code] = {
-                "state_id": row["state_id"],
-                "state_code": state_code,
-                "state_name": row["state_name"]
-            }
-        print(f"State mapping initialized with {len(state_mapping)} states from {states_file}.")
-    else:
-        print(f"States file {states_file} not found. State mapping will start empty.")
+    return apply_dtypes(pd.DataFrame(entities))
+
+
+# State codes seen in this run, saved with the states dimension
+seen_state_codes = set()
+# Keys handed out in this run, audited and saved with their old ids at the end
+key_ledger = KeyLedger()
 
 
 # Function to generate a unique address ID (hash)
 def generate_address_id(ccn, address, city, state, zip_code):
-    """Generate a unique ID for an address based on CNN and address hash."""
-    # Use only the first 5 digits of the ZIP code
-    zip_trimmed = str(zip_code)[:5] if pd.notna(zip_code) else ""
-    address_str = f"{address}|{city}|{state}|{zip_trimmed}"
-    address_hash = hashlib.md5(address_str.encode()).hexdigest()
-    return int(hashlib.md5(f"{ccn}{address_hash}".encode()).hexdigest(), 16) % (10**9)  # 9-digit limit
-
-# Function to get or assign StateID
-def get_or_create_state_id(state_code):
-    """Retrieve an existing StateID or create a new one for a state code."""
-    if state_code not in state_mapping:
-        state_id = len(state_mapping) + 1
-        state_mapping[state_code] = {"state_id": state_id, "state_code": state_code, "state_name": None}
-    return state_mapping[state_code]["state_id"]
+    """Generate a unique ID for an address from its CCN and the address as written."""
+    return stable_key(address_id_sources([ccn], [address], [city], [state], [zip_code]).iloc[0])
 
 # Function to extract addresses and save to CSV
 def extract_addresses(data, ccn_column="CMS Certification Number (CCN)"):
     """Extract addresses from the data and save them to a CSV."""
     address_records = []
-    for _, row in data.iterrows():
-        # Dynamically map columns
-        address_col = next((alt for alt in column_mapping["Address"] if alt in data.columns), None)
-        city_col = next((alt for alt in column_mapping["City"] if alt in data.columns), None)
-        state_col = next((alt for alt in column_mapping["State"] if alt in data.columns), None)
-        zip_col = next((alt for alt in column_mapping["ZipCode"] if alt in data.columns), None)
-        
-        if not all([address_col, city_col, state_col, zip_col]):
-            continue  # Skip rows with missing required columns
-        
+    # Dynamically map columns
+    address_col = next((alt for alt in column_mapping["Address"] if alt in data.columns), None)
+    city_col = next((alt for alt in column_mapping["City"] if alt in data.columns), None)
+    state_col = next((alt for alt in column_mapping["State"] if alt in data.columns), None)
+    zip_col = next((alt for alt in column_mapping["ZipCode"] if alt in data.columns), None)
+    if not all([address_col, city_col, state_col, zip_col]):
+        print("Required address columns not found. Skipping addresses.")
+        return
+
+    # Assign StateIDs for the whole column from the states dimension
+    state_id_column = state_ids(data[state_col])
+    seen_state_codes.update(data[state_col].dropna().unique())
+    for (_, row), state_id in zip(data.iterrows(), state_id_column):
         # Handle concatenation for Address Line 1 and Address Line 2
         if address_col == "Address Line 1":
             address_line_2 = row.get("Address Line 2", "")
 
-            if address_line_2 and not (isinstance(address_line_2, float) and math.isnan(address_line_2)):
+            if pd.notna(address_line_2) and address_line_2:
                 full_address = f"{row['Address Line 1']} {address_line_2}".strip(", ")
             else:
                 full_address = row["Address Line 1"]
@@ -331,18 +290,9 @@ def extract_addresses(data, ccn_column="CMS Certification Number (CCN)"):
         zip_code = row[zip_col]
         ccn = row.get(ccn_column, None)
 
-        # Generate address ID
-        address_id = generate_address_id(ccn, full_address, city, state, zip_code)
-        
-        # Assign StateID using state_mapping
-        state_id = get_or_create_state_id(state)
-        
-        # Create address hash (for tracking uniqueness)
-        address_hash = int(hashlib.md5(f"{full_address}|{city}|{state}|{str(zip_code)[:5]}".encode()).hexdigest(), 16) % (10**9)
-        
         # Append to records
         address_records.append({
-            "address_id": address_id,
+            "address_id": None,
             "npi": None,  # Placeholder, not defined in requirements
             "ccn": ccn,
             "address": full_address,
@@ -350,81 +300,114 @@ def extract_addresses(data, ccn_column="CMS Certification Number (CCN)"):
             "state_id": state_id,
             "zip_code": str(zip_code)[:5],
             "cms_addr_id": None,  # Placeholder
-            "address_hash": address_hash,
+            "address_hash": None,
             "primary_practice_address": False
         })
-    
+
+    address_frame = pd.DataFrame(address_records, columns=ADDRESS_COLUMNS)
+    written = (address_frame["address"], address_frame["city"], data[state_col].to_numpy(), data[zip_col].to_numpy())
+
+    # Address IDs of the addresses as written, for the whole column
+    sources = address_id_sources(address_frame["ccn"], *written)
+    address_frame["address_id"] = stable_keys(sources).to_numpy()
+    key_ledger.add("address_id", address_frame["address_id"], sources, [legacy_address_ids(address_frame["ccn"], *written)])
+
+    # Address hashes (for tracking uniqueness) of the normalized addresses
+    keys = address_keys(*written)
+    address_frame["address_hash"] = key_hashes(keys).to_numpy()
+    key_ledger.add("address_hash", address_frame["address_hash"], keys, legacy_address_hashes(*written, keys=keys))
+
     # Save addresses to CSV
     if os.path.exists(addresses_file):
-        pd.DataFrame(address_records).to_csv(addresses_file, mode='a', index=False, header=False)
+        address_frame.to_csv(addresses_file, mode='a', index=False, header=False)
     else:
-        pd.DataFrame(address_records).to_csv(addresses_file, index=False)
+        address_frame.to_csv(addresses_file, index=False)
     print(f"Addresses saved to {addresses_file}")
 
 # Save states to CSV
 def save_states_to_csv():
-    """Save the unique states to the states CSV file."""
-    state_records = list(state_mapping.values())
-    pd.DataFrame(state_records).to_csv(states_file, index=False)
+    """Save the states dimension, with the codes seen in this run, to the states CSV file."""
+    save_states(states_file, seen_state_codes)
     print(f"States saved to {states_file}")
-# Load the existing states.csv file to initialize state_mapping
-initialize_state_mapping(states_file)
 
-for file in files:
-    try:
-        # Load the current file
-        if "hospital_general_information_dataset.csv" == file:
-            df = pd.read_csv("./datasets/"+file, dtype={"Facility ID": str})
-        else:
-            df = pd.read_csv("./datasets/"+file, dtype={"CMS Certification Number (CCN)": str})
-        
-        print(f"Loaded {file} successfully with {len(df)} rows.")
-        print(df.head())
-        
-        # Create a dynamic mapping for columns present in the file
-        dynamic_columns = {}
-        for main_col, alternatives in column_mapping.items():
-            for alt_col in [main_col] + alternatives:
-                if alt_col in df.columns:
-                    dynamic_columns[main_col] = alt_col
-                    break
-        
-        # Check if all required columns (or their alternatives) are present
-        if set(column_mapping.keys()).issubset(dynamic_columns.keys()):
-            print("Required columns found (or alternatives). Applying filter...")
-            
-            # Filter rows with missing values
-            subset_columns = list(dynamic_columns.values())  # Use dynamically found columns
-            filtered_data = df.dropna(subset=subset_columns, how="any")
-            
-            
-            if "Facility ID" in filtered_data.columns:
-                ccn_column = "Facility ID"
+
+def main():
+    """Import the CMS facility files into the staged entities, addresses and states CSVs."""
+    # Create the filtered and output folders if they don't exist
+    os.makedirs(filtered_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+
+    seen_state_codes.clear()
+    key_ledger.clear()
+
+    for file in files:
+        try:
+            # Load the current file
+            with span("read_csv", file=file) as read_span:
+                df = read_typed_csv("./datasets/"+file)
+                read_span.rows = len(df)
+
+            print(f"Loaded {file} successfully with {len(df)} rows.")
+            print(df.head())
+
+            # Create a dynamic mapping for columns present in the file
+            dynamic_columns = {}
+            for main_col, alternatives in column_mapping.items():
+                for alt_col in [main_col] + alternatives:
+                    if alt_col in df.columns:
+                        dynamic_columns[main_col] = alt_col
+                        break
+
+            # Check if all required columns (or their alternatives) are present
+            if set(column_mapping.keys()).issubset(dynamic_columns.keys()):
+                print("Required columns found (or alternatives). Applying filter...")
+
+                # Filter rows with missing values
+                subset_columns = list(dynamic_columns.values())  # Use dynamically found columns
+                filtered_data = df.dropna(subset=subset_columns, how="any")
+
+
+                if "Facility ID" in filtered_data.columns:
+                    ccn_column = "Facility ID"
+                else:
+                    ccn_column = "CMS Certification Number (CCN)"
+
+                # Extract addresses and record their states
+                with span("extract_addresses", file=file, rows=len(filtered_data)):
+                    extract_addresses(filtered_data, ccn_column)
+
+                # Process the CMS file data based on the rules dictionary for the file
+                with span("process_file", file=file) as process_span:
+                    processed_data = process_file(file, filtered_data)
+                    process_span.rows = len(processed_data)
+
+                # map the required columns
+                processed_data = map_columns(processed_data)
+                # Save the generated entities to the CSV file
+                with span("save", file=file, rows=len(processed_data)):
+                    save_entities_to_csv(processed_data, output_file)
+
+                    # Save the filtered data in the specific folder
+                    file_name = os.path.basename(file).replace(".csv", "_filtered.csv")
+                    output_path = os.path.join(filtered_folder, file_name)
+                    filtered_data.to_csv(output_path, index=False)
+                record_rows(len(processed_data))
+                print(f"Filtered data saved to: {output_path}\n\n\n")
+
+
             else:
-                ccn_column = "CMS Certification Number (CCN)"
-            
-            # Extract addresses and update state_mapping
-            extract_addresses(filtered_data, ccn_column)
-            
-            # Process the CMS file data based on the rules dictionary for the file
-            processed_data = process_file(file, filtered_data)
-            
-            # map the required columns
-            processed_data = map_columns(processed_data)
-            # Save the generated entities to the CSV file
-            save_entities_to_csv(processed_data, output_file)
-            
-            # Save the filtered data in the specific folder
-            file_name = os.path.basename(file).replace(".csv", "_filtered.csv")
-            output_path = os.path.join(filtered_folder, file_name)
-            filtered_data.to_csv(output_path, index=False)
-            print(f"Filtered data saved to: {output_path}\n\n\n")
-        
-            
-        else:
-            print("Required columns (or alternatives) not found. Skipping file.\n\n\n")
-    except Exception as e:
-        print(f"Error loading {file}: {e}\n\n\n")
-        
-# Save states to CSV after all files are processed
-save_states_to_csv()
\ No newline at end of file
+                print("Required columns (or alternatives) not found. Skipping file.\n\n\n")
+        except Exception as e:
+            print(f"Error loading {file}: {e}\n\n\n")
+
+    # Save states to CSV after all files are processed
+    save_states_to_csv()
+
+    # The keys of all files at once, so collisions between files are caught too
+    with span("audit_keys"):
+        print(f"Distinct keys: {key_ledger.audit()}")
+        key_ledger.save(KEY_MIGRATION_FILE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Read-only lookups over facilities.db: entities by NPI or CCN, by type (and subtype) in a state or
+ZIP code, the entities at an address_hash, and full-text search by name or street.
+
+Every lookup is one fixed SQL string with bound parameters, so each pooled connection prepares it
+once and reuses the statement from sqlite3's statement cache. Results are kept in an LRU cache;
+the database file (and its WAL) is checked before each lookup and when it has been replaced or
+written to the cache is cleared and the pooled connections are reopened on the new file.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from facility_search import TEXT_SEARCH_COLUMNS, TEXT_SEARCH_QUERY, connect_read_only, match_expression
+
+DB_PATH = "facilities.db"
+POOL_SIZE = int(os.getenv("QUERY_POOL_SIZE", "8"))
+CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Every lookup returns the columns of the full-text search
+RESULT_COLUMNS = TEXT_SEARCH_COLUMNS
+
+# CMS entities are linked to addresses by CCN and NPPES entities by NPI
+ENTITY_ADDRESSES = """
+    SELECT e.entity_id, e.name, e.ccn, e.npi, e.type, e.subtype, e.nucc_code,
+           a.address_hash, a.address, a.city, s.state_code, a.zip_code
+    FROM entities e
+    {join} addresses a ON a.ccn = e.ccn OR a.npi = e.npi
+    LEFT JOIN states s ON s.state_id = a.state_id
+"""
+
+QUERIES = {
+    "npi": ENTITY_ADDRESSES.format(join="LEFT JOIN") + "WHERE e.npi = :npi ORDER BY a.address_hash",
+    "ccn": ENTITY_ADDRESSES.format(join="LEFT JOIN") + "WHERE e.ccn = :ccn ORDER BY e.entity_id, a.address_hash",
+    "type_state": ENTITY_ADDRESSES.format(join="JOIN") + """
+        WHERE e.type = :type AND a.state_id = (SELECT state_id FROM states WHERE state_code = :state)
+        ORDER BY e.entity_id, a.address_hash LIMIT :limit""",
+    "subtype_state": ENTITY_ADDRESSES.format(join="JOIN") + """
+        WHERE e.type = :type AND e.subtype = :subtype AND a.state_id = (SELECT state_id FROM states WHERE state_code = :state)
+        ORDER BY e.entity_id, a.address_hash LIMIT :limit""",
+    "type_zip": ENTITY_ADDRESSES.format(join="JOIN") + """
+        WHERE e.type = :type AND a.zip_code = :zip
+        ORDER BY e.entity_id, a.address_hash LIMIT :limit""",
+    "subtype_zip": ENTITY_ADDRESSES.format(join="JOIN") + """
+        WHERE e.type = :type AND e.subtype = :subtype AND a.zip_code = :zip
+        ORDER BY e.entity_id, a.address_hash LIMIT :limit""",
+    "address": """
+    SELECT e.entity_id, e.name, e.ccn, e.npi, e.type, e.subtype, e.nucc_code,
+           a.address_hash, a.address, a.city, s.state_code, a.zip_code
+    FROM addresses a
+    JOIN entities e ON e.ccn = a.ccn OR e.npi = a.npi
+    LEFT JOIN states s ON s.state_id = a.state_id
+    WHERE a.address_hash = :address_hash
+    ORDER BY e.entity_id
+    LIMIT :limit""",
+    "search": TEXT_SEARCH_QUERY,
+}
+
+
+def file_signature(path):
+    """
+    Identity and version of the database file: a swap changes the inode, a rewrite the size or
+    mtime. In WAL mode (see address_geocoder) writes land in the -wal file first and leave the
+    main file as it was, so the -wal file's size and mtime are part of the signature too.
+    """
+    stat = os.stat(path)
+    try:
+        wal = os.stat(f"{path}-wal")
+        wal_version = wal.st_size, wal.st_mtime_ns
+    except FileNotFoundError:
+        wal_version = None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, wal_version
+
+
+def type_lookup(entity_type, subtype=None, state=None, zip_code=None, limit=DEFAULT_LIMIT):
+    """The query name and parameters of a lookup by type (and subtype) in a state or a ZIP code."""
+    if (state is None) == (zip_code is None):
+        raise ValueError("Give either a state or a ZIP code.")
+    params = {"type": entity_type, "limit": min(int(limit), MAX_LIMIT)}
+    if subtype is not None:
+        params["subtype"] = subtype
+    if state is not None:
+        params["state"] = state.strip().upper()
+    else:
+        params["zip"] = str(zip_code).strip()[:5]
+    return ("subtype_" if subtype is not None else "type_") + ("state" if state is not None else "zip"), params
+
+
+def address_lookup(address_hash, limit=DEFAULT_LIMIT):
+    """The parameters of the lookup of the entities at an address_hash."""
+    return {"address_hash": int(address_hash), "limit": min(int(limit), MAX_LIMIT)}
+
+
+def search_lookup(text, state=None, subtype=None, limit=DEFAULT_LIMIT):
+    """
+    The parameters of a full-text search; ValueError when the text has no words. The state is
+    part of the match expression; it is passed on too (unused by the query) for shard_router.
+    """
+    match = match_expression(text, state)
+    if match is None:
+        raise ValueError("Give some words to search for.")
+    state = state.strip().upper() if state and state.strip() else None
+    return {"match": match, "subtype": subtype, "state": state, "limit": min(int(limit), MAX_LIMIT)}
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache of query results."""
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The cached value, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ConnectionPool:
+    """
+    At most `size` read-only connections to the database, opened on demand and reused.
+    reset() retires every connection: idle ones are closed at once, busy ones when returned.
+    """
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.generation = 0
+        self.opened = 0
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def open(self):
+        conn = connect_read_only(self.db_path)
+        conn.execute("PRAGMA query_only = ON")
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection, waiting while all `size` are in use."""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                generation = self.generation
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self.open()
+            try:
+                yield conn
+            finally:
+                with self._lock:
+                    if generation == self.generation:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+        finally:
+            self._slots.release()
+
+    def reset(self):
+        with self._lock:
+            self.generation += 1
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def close(self):
+        self.reset()
+
+
+class Lookups:
+    """
+    The lookups by NPI, CCN, type, address and text, answered through the cached() and query()
+    of a subclass (FacilityQueries on one database, shard_router.ShardRouter on the shards).
+    Results are lists of dicts with RESULT_COLUMNS; cached lists are shared, so don't modify them.
+    """
+    def cached(self, name, **params):
+        raise NotImplementedError
+
+    def query(self, name, **params):
+        raise NotImplementedError
+
+    def run(self, name, **params):
+        """A lookup answered from the cache when possible."""
+        result = self.cached(name, **params)
+        return result if result is not None else self.query(name, **params)
+
+    def by_npi(self, npi):
+        return self.run("npi", npi=str(npi))
+
+    def by_ccn(self, ccn):
+        return self.run("ccn", ccn=str(ccn))
+
+    def by_type(self, entity_type, subtype=None, state=None, zip_code=None, limit=DEFAULT_LIMIT):
+        """Entities of a type (and subtype) at addresses in a state or a ZIP code; give one of the two."""
+        name, params = type_lookup(entity_type, subtype, state, zip_code, limit)
+        return self.run(name, **params)
+
+    def at_address(self, address_hash, limit=DEFAULT_LIMIT):
+        return self.run("address", **address_lookup(address_hash, limit))
+
+    def search(self, text, state=None, subtype=None, limit=DEFAULT_LIMIT):
+        """Entities by partial name, type or street, best matches first (see facility_search.search_facilities)."""
+        return self.run("search", **search_lookup(text, state, subtype, limit))
+
+
+class FacilityQueries(Lookups):
+    """The lookups on one database, run on a connection pool with an LRU result cache."""
+    def __init__(self, db_path=DB_PATH, pool_size=POOL_SIZE, cache_size=CACHE_SIZE):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.cache = LRUCache(cache_size)
+        self.invalidations = 0
+        self.signature = file_signature(db_path)
+        self._lock = threading.Lock()
+
+    def check_database(self):
+        """Clears the cache and retires the connections when the database file changed."""
+        signature = file_signature(self.db_path)
+        if signature == self.signature:
+            return
+        with self._lock:
+            if signature == self.signature:
+                return
+            self.signature = signature
+            self.pool.reset()
+            self.cache.clear()
+            self.invalidations += 1
+        print(f"{self.db_path} changed; result cache cleared and connections reopened.")
+
+    def cached(self, name, **params):
+        """The cached result of a lookup, or None (cheap enough to call from an event loop)."""
+        self.check_database()
+        return self.cache.get((name, tuple(sorted(params.items()))))
+
+    def query(self, name, **params):
+        """Runs a lookup by its name in QUERIES on a pooled connection and caches the result."""
+        generation = self.pool.generation
+        with self.pool.connection() as conn:
+            rows = conn.execute(QUERIES[name], params).fetchall()
+        result = [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+        # A result read from the previous file is not cached
+        if generation == self.pool.generation:
+            self.cache.put((name, tuple(sorted(params.items()))), result)
+        return result
+
+    def stats(self):
+        return {
+            "cache_entries": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "invalidations": self.invalidations,
+            "connections_opened": self.pool.opened,
+            "pool_size": self.pool.size
+        }
+
+    def close(self):
+        self.pool.close()
+        self.cache.clear()
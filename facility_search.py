@@ -0,0 +1,148 @@
+import math
+import re
+import sqlite3
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LATITUDE = 69.0
+
+# Candidate rows inside the bounding box, found through the R*Tree and joined to their entities.
+# CMS entities are linked to addresses by CCN and NPPES entities by NPI.
+RADIUS_CANDIDATES_QUERY = """
+    SELECT e.entity_id, e.name, e.ccn, e.npi, e.type, e.subtype, e.nucc_code,
+           a.address_hash, a.address, a.city, a.zip_code, g.latitude, g.longitude, g."precision"
+    FROM address_geolocation_rtree r
+    JOIN address_geolocation g ON g.id = r.id
+    JOIN addresses a ON a.address_hash = g.address_hash
+    JOIN entities e ON e.{key} = a.{key}
+    WHERE r.min_lat >= :min_lat AND r.max_lat <= :max_lat
+      AND r.min_lon >= :min_lon AND r.max_lon <= :max_lon
+      {filters}
+"""
+
+RESULT_COLUMNS = [
+    "entity_id", "name", "ccn", "npi", "type", "subtype", "nucc_code",
+    "address_hash", "address", "city", "zip_code", "latitude", "longitude", "precision"
+]
+
+# Ranked full-text search over the entity_search index (see schema.sql); its rowid holds the rowids
+# of the entity and the address. Name matches weigh most, then address, city and subtype.
+TEXT_SEARCH_QUERY = """
+    SELECT e.entity_id, e.name, e.ccn, e.npi, e.type, e.subtype, e.nucc_code,
+           a.address_hash, a.address, a.city, entity_search.state_code, a.zip_code
+    FROM entity_search
+    JOIN entities e ON e.rowid = entity_search.rowid >> 32
+    JOIN addresses a ON a.rowid = entity_search.rowid & 4294967295
+    WHERE entity_search MATCH :match
+      AND (:subtype IS NULL OR e.subtype = :subtype)
+    ORDER BY bm25(entity_search, 10.0, 2.0, 3.0, 4.0, 3.0, 1.0)
+    LIMIT :limit
+"""
+
+TEXT_SEARCH_COLUMNS = [
+    "entity_id", "name", "ccn", "npi", "type", "subtype", "nucc_code",
+    "address_hash", "address", "city", "state_code", "zip_code"
+]
+
+# Words of a search, as the index tokenizer splits them (punctuation and underscores separate)
+SEARCH_WORD = re.compile(r"[^\W_]+")
+
+
+def bounding_box(latitude, longitude, miles):
+    """
+    Returns (min_lat, max_lat, min_lon, max_lon) of a box containing every point within `miles`.
+    Near the poles the box widens to all longitudes.
+    """
+    delta_lat = miles / MILES_PER_DEGREE_LATITUDE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or delta_lat / cos_lat >= 180:
+        delta_lon = 180.0
+    else:
+        delta_lon = delta_lat / cos_lat
+    return latitude - delta_lat, latitude + delta_lat, longitude - delta_lon, longitude + delta_lon
+
+
+def haversine_miles(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in miles from one point to arrays of points."""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def find_facilities_within(conn, latitude, longitude, miles, entity_type=None, subtype=None, limit=None):
+    """
+    Finds the entities within `miles` of a point, optionally restricted to a type and/or subtype.
+
+    The R*Tree prefilters a bounding box, the exact great-circle distance drops the corners and the
+    results come back as dicts sorted by distance (with a 'distance_miles' key). An entity listed
+    at several addresses in range is returned once, at its nearest address.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, miles)
+    params = {"min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon}
+    filters = ""
+    if entity_type is not None:
+        filters += " AND e.type = :entity_type"
+        params["entity_type"] = entity_type
+    if subtype is not None:
+        filters += " AND e.subtype = :subtype"
+        params["subtype"] = subtype
+
+    query = " UNION ALL ".join(RADIUS_CANDIDATES_QUERY.format(key=key, filters=filters) for key in ("ccn", "npi"))
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return []
+
+    coordinates = np.array([(row[11], row[12]) for row in rows], dtype=np.float64)
+    distances = haversine_miles(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+
+    results = {}
+    for index in np.argsort(distances, kind="stable"):
+        distance = float(distances[index])
+        if distance > miles:
+            break
+        row = rows[index]
+        if row[0] in results:
+            continue
+        result = dict(zip(RESULT_COLUMNS, row))
+        result["distance_miles"] = round(distance, 3)
+        results[row[0]] = result
+        if limit is not None and len(results) >= limit:
+            break
+    return list(results.values())
+
+
+def connect_read_only(db_path):
+    """Opens the database read-only for querying."""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def match_expression(text, state=None):
+    """
+    The FTS5 query for free text: every word must match the start of a word in the name, type,
+    subtype, address, city or state ("st mary rehab" finds "ST MARY'S REHABILITATION"), optionally
+    within one state. None when the text has no words.
+    """
+    words = SEARCH_WORD.findall(str(text).lower())
+    if not words:
+        return None
+    expression = " ".join(f'"{word}"*' for word in words)
+    if state:
+        state_words = SEARCH_WORD.findall(str(state).lower())
+        if state_words:
+            expression = f'state_code : "{state_words[0]}" AND ({expression})'
+    return expression
+
+
+def search_facilities(conn, text, state=None, subtype=None, limit=20):
+    """
+    Finds entities by partial name, type or street through the full-text index, best matches first.
+    Returns dicts with TEXT_SEARCH_COLUMNS, one per matching entity and address.
+    """
+    match = match_expression(text, state)
+    if match is None:
+        return []
+    rows = conn.execute(TEXT_SEARCH_QUERY, {"match": match, "subtype": subtype, "limit": limit}).fetchall()
+    return [dict(zip(TEXT_SEARCH_COLUMNS, row)) for row in rows]
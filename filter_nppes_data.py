@@ -1,8 +1,7 @@
+import os
 import dask.dataframe as dd
 import time
-
-# Measure the start time
-start_time = time.time()
+from pipeline_metrics import record_rows
 
 # File paths: input file and output file
 input_file = './datasets/NPPES_file.csv'
@@ -87,35 +86,47 @@ required_columns = [
     "Certification Date",
 ]
 
-# Read only the required columns to reduce memory usage
-df = dd.read_csv(
-    input_file, 
-    dtype="str", 
-    assume_missing=True, 
-    low_memory=False, 
-    usecols=required_columns
-)
+def main():
+    """Keep the active organization (Entity Type Code 2) rows of the NPPES file, with only the required columns."""
+    # Measure the start time
+    start_time = time.time()
 
-# Filter data:
-# 1. 'NPI Deactivation Date' is empty or null
-# 2. 'Entity Type Code' equals 1 or 2
-df_filtered = df[
-    (df['NPI Deactivation Date'].fillna('').str.strip() == '') &
-    (df['Entity Type Code'] == '2')
-]
+    # Read only the required columns to reduce memory usage
+    df = dd.read_csv(
+        input_file, 
+        dtype="str", 
+        assume_missing=True, 
+        low_memory=False, 
+        usecols=required_columns
+    )
+
+    # Filter data:
+    # 1. 'NPI Deactivation Date' is empty or null
+    # 2. 'Entity Type Code' equals 1 or 2
+    df_filtered = df[
+        (df['NPI Deactivation Date'].fillna('').str.strip() == '') &
+        (df['Entity Type Code'] == '2')
+    ]
+
+    # Optimize partitions for more efficient writing
+    df_filtered = df_filtered.repartition(npartitions=10)  # Adjust the number based on your system
+    print('Filtered data ready for processing')
+
+    # Save to a single file using pandas for faster write performance
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    df_filtered = df_filtered.compute()
+    df_filtered.to_csv(output_file, index=False)
+    record_rows(len(df_filtered))
 
-# Optimize partitions for more efficient writing
-df_filtered = df_filtered.repartition(npartitions=10)  # Adjust the number based on your system
-print('Filtered data ready for processing')
+    # Measure the end time
+    end_time = time.time()
 
-# Save to a single file using pandas for faster write performance
-df_filtered.compute().to_csv(output_file, index=False)
+    # Calculate total execution time
+    execution_time = end_time - start_time
 
-# Measure the end time
-end_time = time.time()
+    print(f"Filtered data saved to {output_file}")
+    print(f"Execution time: {execution_time:.2f} seconds")
 
-# Calculate total execution time
-execution_time = end_time - start_time
 
-print(f"Filtered data saved to {output_file}")
-print(f"Execution time: {execution_time:.2f} seconds")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import re
+import sqlite3
+import time
+
+# The cache lives outside facilities.db so it survives full rebuilds
+CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "datasets/cache/geocode_cache.db")
+# How long a coordinate or a "no results" answer stays valid
+POSITIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_TTL_DAYS", "365")) * 86400
+NEGATIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL_DAYS", "30")) * 86400
+
+STATUS_OK = "ok"
+STATUS_NOT_FOUND = "not_found"
+
+NON_ALPHANUMERIC = re.compile(r"[^A-Z0-9]+")
+
+
+def canonical_address(address, city, state_code, zip_code):
+    """
+    Build the cache key for an address.
+    Case, punctuation and repeated whitespace are dropped and the ZIP is cut to 5 digits,
+    so cosmetic differences between sources map to the same key.
+    """
+    parts = [
+        NON_ALPHANUMERIC.sub(" ", str(value).upper()).strip()
+        for value in (address, city, state_code)
+    ]
+    zip5 = str(zip_code).split("-")[0].split(".")[0].strip()[:5].zfill(5)
+    return "|".join(parts + [zip5])
+
+
+def open_cache(path=CACHE_PATH):
+    """Open (and create if needed) the persistent geocode cache."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            status TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            attempts INTEGER
+        )
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(geocode_cache)")]
+    if "attempts" not in columns:
+        conn.execute("ALTER TABLE geocode_cache ADD COLUMN attempts INTEGER")
+    conn.commit()
+    return conn
+
+
+def lookup(conn, address_key, now=None):
+    """
+    Return the cached answer for an address key, or None when it is missing or expired.
+    A cached answer is a dict with 'status' and, for STATUS_OK, 'latitude' and 'longitude'.
+    """
+    row = conn.execute(
+        "SELECT latitude, longitude, status, fetched_at FROM geocode_cache WHERE address_key = ?",
+        (address_key,)
+    ).fetchone()
+    if row is None:
+        return None
+    latitude, longitude, status, fetched_at = row
+    ttl = POSITIVE_TTL_SECONDS if status == STATUS_OK else NEGATIVE_TTL_SECONDS
+    now = time.time() if now is None else now
+    if now - fetched_at > ttl:
+        return None
+    return {"status": status, "latitude": latitude, "longitude": longitude}
+
+
+def store(conn, address_key, latitude, longitude, now=None, attempts=None):
+    """Cache a successful geocode and the number of API attempts it took. The caller owns the commit."""
+    conn.execute(
+        "INSERT OR REPLACE INTO geocode_cache (address_key, latitude, longitude, status, fetched_at, attempts) VALUES (?, ?, ?, ?, ?, ?)",
+        (address_key, latitude, longitude, STATUS_OK, time.time() if now is None else now, attempts)
+    )
+
+
+def store_not_found(conn, address_key, now=None, attempts=None):
+    """Cache a "no results" answer so the address is not retried until the negative TTL runs out."""
+    conn.execute(
+        "INSERT OR REPLACE INTO geocode_cache (address_key, latitude, longitude, status, fetched_at, attempts) VALUES (?, NULL, NULL, ?, ?, ?)",
+        (address_key, STATUS_NOT_FOUND, time.time() if now is None else now, attempts)
+    )
@@ -0,0 +1,286 @@
+import argparse
+import math
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from facility_search import EARTH_RADIUS_MILES, haversine_miles
+from zip_centroid_geocoder import load_zip_centroids
+
+db_path = "facilities.db"
+
+# Grid cell edge in degrees; 0.25 degrees is about 17 miles north-south
+GRID_CELL_DEGREES = 0.25
+# Largest query x candidate matrix computed at once (float64, so 8 bytes each)
+MAX_CHUNK_ELEMENTS = 4_000_000
+
+# Every geocoded location of every entity; CMS entities are linked to addresses by CCN and NPPES entities by NPI
+FACILITY_POINTS_QUERY = """
+    SELECT e.entity_id, e.subtype, g.latitude, g.longitude
+    FROM address_geolocation g
+    JOIN addresses a ON a.address_hash = g.address_hash
+    JOIN entities e ON e.{key} = a.{key}
+"""
+
+
+def unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere; the dot product of two of them falls as their distance grows."""
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def concatenate_ranges(starts, ends):
+    """np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) without the Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+class FacilityGrid:
+    """
+    Facility locations bucketed into a regular latitude/longitude grid and held in contiguous
+    NumPy arrays sorted by cell, with CSR-style offsets per cell.
+
+    Query points are grouped by cell, so every point in a cell shares one candidate block (the
+    cells within `ring` of it) and is compared with it in one matrix product of unit vectors. The
+    block grows until it provably contains the answer; only the k nearest get an exact haversine
+    distance. An entity with several locations counts once.
+    """
+    def __init__(self, entity_ids, latitudes, longitudes, cell_degrees=GRID_CELL_DEGREES):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        codes, self.entity_ids = pd.factorize(np.asarray(entity_ids))
+        self.distinct = len(self.entity_ids) == len(codes)
+        self.cell_degrees = cell_degrees
+        self.lat_origin = float(latitudes.min()) if len(latitudes) else 0.0
+        self.lon_origin = float(longitudes.min()) if len(longitudes) else 0.0
+
+        lat_bins, lon_bins = self.cell_of(latitudes, longitudes)
+        self.n_lat = int(lat_bins.max()) + 1 if len(lat_bins) else 1
+        self.n_lon = int(lon_bins.max()) + 1 if len(lon_bins) else 1
+        cells = lat_bins * self.n_lon + lon_bins
+        order = np.argsort(cells, kind="stable")
+        self.offsets = np.searchsorted(cells[order], np.arange(self.n_lat * self.n_lon + 1))
+
+        self.entity_codes = codes[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.vectors = unit_vectors(self.latitudes, self.longitudes)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def cell_of(self, latitudes, longitudes):
+        """Grid row and column of each point (outside the grid for points beyond its extent)."""
+        lat_bins = np.floor((latitudes - self.lat_origin) / self.cell_degrees).astype(np.int64)
+        lon_bins = np.floor((longitudes - self.lon_origin) / self.cell_degrees).astype(np.int64)
+        return lat_bins, lon_bins
+
+    def _block(self, lat_bin, lon_bin, ring):
+        """Indexes of the locations in the cells within `ring` of a cell, and whether that is all of them."""
+        lat_lo, lat_hi = max(lat_bin - ring, 0), min(lat_bin + ring, self.n_lat - 1)
+        lon_lo, lon_hi = max(lon_bin - ring, 0), min(lon_bin + ring, self.n_lon - 1)
+        complete = lat_bin - ring <= 0 and lat_bin + ring >= self.n_lat - 1 and lon_bin - ring <= 0 and lon_bin + ring >= self.n_lon - 1
+        if lat_lo > lat_hi or lon_lo > lon_hi:
+            return np.empty(0, dtype=np.int64), complete
+        rows = np.arange(lat_lo, lat_hi + 1) * self.n_lon
+        return concatenate_ranges(self.offsets[rows + lon_lo], self.offsets[rows + lon_hi + 1]), complete
+
+    def _coverage(self, lat_bin, ring):
+        """
+        Miles within which the block around a cell is guaranteed complete: a location outside it is at
+        least `ring` cells away in latitude, or `ring` cells of longitude away, which is nearest at the
+        cell's poleward edge.
+        """
+        span = math.radians(ring * self.cell_degrees)
+        edges = (self.lat_origin + lat_bin * self.cell_degrees, self.lat_origin + (lat_bin + 1) * self.cell_degrees)
+        poleward = math.radians(min(max(abs(edges[0]), abs(edges[1])), 90.0))
+        longitude_gap = math.asin(math.cos(poleward) * math.sin(min(span, math.pi / 2)))
+        return EARTH_RADIUS_MILES * min(span, longitude_gap)
+
+    def _query_groups(self, latitudes, longitudes):
+        """Yields (lat_bin, lon_bin, query indexes) for every grid cell holding valid query points."""
+        valid = np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes)))
+        lat_bins, lon_bins = self.cell_of(latitudes[valid], longitudes[valid])
+        keys = (lat_bins + (1 << 24)) * (1 << 26) + (lon_bins + (1 << 24))
+        order = np.argsort(keys, kind="stable")
+        boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                yield int(lat_bins[group[0]]), int(lon_bins[group[0]]), valid[group]
+
+    def _chunks(self, queries, candidates):
+        size = max(1, MAX_CHUNK_ELEMENTS // max(candidates, 1))
+        for start in range(0, len(queries), size):
+            yield queries[start:start + size]
+
+    def _k_nearest(self, similarity, codes, k):
+        """
+        Columns of the k nearest distinct entities per row of a similarity (dot product) matrix,
+        nearest first and padded with -1.
+        """
+        rows, columns = similarity.shape
+        picks = np.full((rows, k), -1, dtype=np.int64)
+        if columns == 0:
+            return picks
+        if k == 1:
+            picks[:, 0] = similarity.argmax(axis=1)
+            return picks
+        if self.distinct:
+            take = min(k, columns)
+            nearest = np.argpartition(-similarity, take - 1, axis=1)[:, :take] if take < columns else np.tile(np.arange(columns), (rows, 1))
+            order = np.argsort(-np.take_along_axis(similarity, nearest, axis=1), axis=1, kind="stable")
+            picks[:, :take] = np.take_along_axis(nearest, order, axis=1)
+            return picks
+        # Sort each row and keep the first (closest) location of every entity
+        order = np.argsort(-similarity, axis=1, kind="stable")
+        keys = (np.arange(rows)[:, np.newaxis] * len(self.entity_ids) + codes[order]).ravel()
+        first = np.zeros(keys.shape, dtype=bool)
+        first[np.unique(keys, return_index=True)[1]] = True
+        first = first.reshape(rows, columns)
+        rank = np.cumsum(first, axis=1) - 1
+        row, column = np.nonzero(first & (rank < k))
+        picks[row, rank[row, column]] = order[row, column]
+        return picks
+
+    def nearest(self, latitudes, longitudes, k=1):
+        """
+        Returns (distances, entity_ids), both shaped (n, k), for the k nearest entities to each query
+        point, sorted by distance in miles. Missing answers (NaN query points, fewer than k entities)
+        are inf and -1.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        query_vectors = unit_vectors(latitudes, longitudes)
+        distances = np.full((len(latitudes), k), np.inf)
+        codes = np.full((len(latitudes), k), -1, dtype=np.int64)
+        if len(self) == 0:
+            return distances, self._entity_ids(codes)
+
+        for lat_bin, lon_bin, pending in self._query_groups(latitudes, longitudes):
+            ring = 1
+            while len(pending):
+                candidates, complete = self._block(lat_bin, lon_bin, ring)
+                if len(candidates) >= k or complete:
+                    coverage = np.inf if complete else self._coverage(lat_bin, ring)
+                    unresolved = []
+                    for chunk in self._chunks(pending, len(candidates)):
+                        picks = self._k_nearest(query_vectors[chunk] @ self.vectors[candidates].T, self.entity_codes[candidates], k)
+                        found = picks >= 0
+                        nearest = candidates[np.where(found, picks, 0)]
+                        chunk_distances = np.where(found, haversine_miles(
+                            latitudes[chunk][:, np.newaxis], longitudes[chunk][:, np.newaxis],
+                            self.latitudes[nearest], self.longitudes[nearest]
+                        ), np.inf)
+                        distances[chunk] = chunk_distances
+                        codes[chunk] = np.where(found, self.entity_codes[nearest], -1)
+                        unresolved.append(chunk[chunk_distances[:, -1] > coverage])
+                    pending = np.concatenate(unresolved)
+                ring *= 2
+        return distances, self._entity_ids(codes)
+
+    def count_within(self, latitudes, longitudes, miles):
+        """Number of distinct entities within `miles` of each query point (0 for NaN query points)."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        query_vectors = unit_vectors(latitudes, longitudes)
+        # Within `miles` exactly when the dot product is at least the cosine of the central angle
+        threshold = math.cos(min(miles / EARTH_RADIUS_MILES, math.pi))
+        counts = np.zeros(len(latitudes), dtype=np.int64)
+        if len(self) == 0:
+            return counts
+
+        for lat_bin, lon_bin, queries in self._query_groups(latitudes, longitudes):
+            ring = 1
+            candidates, complete = self._block(lat_bin, lon_bin, ring)
+            while not complete and self._coverage(lat_bin, ring) < miles:
+                ring += 1
+                candidates, complete = self._block(lat_bin, lon_bin, ring)
+            if len(candidates) == 0:
+                continue
+            for chunk in self._chunks(queries, len(candidates)):
+                inside = query_vectors[chunk] @ self.vectors[candidates].T >= threshold
+                if self.distinct:
+                    counts[chunk] = inside.sum(axis=1)
+                else:
+                    row, column = np.nonzero(inside)
+                    pairs = np.unique(row * len(self.entity_ids) + self.entity_codes[candidates][column])
+                    counts[chunk] = np.bincount(pairs // len(self.entity_ids), minlength=len(chunk))
+        return counts
+
+    def _entity_ids(self, codes):
+        if len(self.entity_ids) == 0:
+            return codes
+        return np.where(codes >= 0, np.asarray(self.entity_ids)[np.maximum(codes, 0)], -1)
+
+
+def load_facility_points(db_path):
+    """Loads (entity_id, subtype, latitude, longitude) for every geocoded entity location."""
+    conn = sqlite3.connect(db_path)
+    query = " UNION ".join(FACILITY_POINTS_QUERY.format(key=key) for key in ("ccn", "npi"))
+    points = pd.read_sql_query(query, conn)
+    conn.close()
+    return points
+
+
+def build_subtype_grids(points, cell_degrees=GRID_CELL_DEGREES):
+    """Builds one FacilityGrid per subtype from a frame of facility points."""
+    return {
+        subtype: FacilityGrid(group["entity_id"].to_numpy(), group["latitude"].to_numpy(), group["longitude"].to_numpy(), cell_degrees)
+        for subtype, group in points.groupby("subtype", sort=True)
+    }
+
+
+def nearest_by_subtype(grids, latitudes, longitudes, miles=None):
+    """
+    For every query point and subtype, the nearest entity and its distance, plus the number of
+    entities of that subtype within `miles` when given. Returns a long frame with one row per
+    (query_index, subtype).
+    """
+    frames = []
+    for subtype, grid in grids.items():
+        distances, entity_ids = grid.nearest(latitudes, longitudes, k=1)
+        frame = pd.DataFrame({
+            "query_index": np.arange(len(distances)),
+            "subtype": subtype,
+            "entity_id": entity_ids[:, 0],
+            "distance_miles": distances[:, 0].round(3)
+        })
+        if miles is not None:
+            frame["count_within"] = grid.count_within(latitudes, longitudes, miles)
+        frames.append(frame)
+    result = pd.concat(frames, ignore_index=True)
+    result["subtype"] = result["subtype"].astype("category")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest facility of each subtype for a batch of points.")
+    parser.add_argument("input", help="CSV with latitude/longitude columns, or a zip_code column")
+    parser.add_argument("output", help="Output CSV, one row per input row and subtype")
+    parser.add_argument("--db", default=db_path, help="Facilities database")
+    parser.add_argument("--miles", type=float, default=None, help="Also count the facilities within this radius")
+    parser.add_argument("--subtypes", nargs="+", default=None, help="Only these subtypes")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    queries = pd.read_csv(args.input, dtype={"zip_code": str})
+    if "latitude" not in queries.columns:
+        queries["latitude"], queries["longitude"] = load_zip_centroids().lookup(queries["zip_code"])
+
+    points = load_facility_points(args.db)
+    if args.subtypes:
+        points = points[points["subtype"].isin(args.subtypes)]
+    grids = build_subtype_grids(points)
+    print(f"Indexed {len(points)} facility locations in {len(grids)} subtypes in {time.time() - start_time:.2f} seconds")
+
+    result = nearest_by_subtype(grids, queries["latitude"].to_numpy(), queries["longitude"].to_numpy(), args.miles)
+    result.to_csv(args.output, index=False)
+    print(f"Nearest facilities for {len(queries)} points written to {args.output} in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 import os
 import pandas as pd
-import hashlib
+import dimensions
+from address_normalization import address_hash as normalized_address_hash, address_keys, key_hashes, legacy_address_hashes
+from dtype_policy import KEY, STRING, apply_dtypes, read_typed_csv, share_categories
+from entity_reconciliation import reconcile
+from pipeline_metrics import record_rows, span
+from stable_keys import (KEY_MIGRATION_FILE, KeyLedger, address_id_sources, legacy_address_ids, legacy_keys,
+                         source_strings, stable_key, stable_keys)
 
 # File paths
 nppes_file = "./datasets/filtered/nppes_filtered_data.csv"  # Input NPPES dataset
@@ -14,13 +20,24 @@ file_path_taxonomy_data = './NPPES_dictionary.csv'
 # Constants
 CMS_TAXONOMY_CODE = "251G00000X"  # Specific taxonomy code for comparison
 TAXONOMY_KEYWORD = "Taxonomy Code"    # Keyword to find taxonomy fields
+CMS_MATCH_COLUMNS = ["entity_id", "name", "ccn", "npi", "nucc_code"]  # CMS entity columns process_nppes reads
 
 def load_datasets(nppes_file, cms_file):
     """Load the NPPES and CMS datasets into pandas DataFrames."""
-    nppes_data = pd.read_csv(nppes_file, dtype={"NPI": str})
-    cms_data = pd.read_csv(cms_file)
+    nppes_data = read_typed_csv(nppes_file)
+    # One category set for every taxonomy slot, so the slots can be compared with each other
+    share_categories(nppes_data, find_taxonomy_fields(nppes_data.columns))
+    # Matching only needs the keys, names and codes of the CMS entities
+    cms_data = read_typed_csv(cms_file, usecols=CMS_MATCH_COLUMNS)
     return nppes_data, cms_data
 
+def load_cms_addresses(addresses_file):
+    """CCN and address_hash of the addresses staged by the CMS import (empty before it ran)."""
+    if not os.path.exists(addresses_file):
+        return pd.DataFrame(columns=["ccn", "address_hash"])
+    addresses = read_typed_csv(addresses_file, usecols=["ccn", "address_hash"])
+    return addresses[addresses["ccn"].notna()]
+
 def find_taxonomy_fields(columns):
     """Identify fields in the dataset that contain the word 'taxonomy'."""
     return [col for col in columns if TAXONOMY_KEYWORD.lower() in col.lower()]
@@ -29,6 +46,8 @@ def compare_and_update(row, cms_row):
     """Compare CMS file record name with alternatives."""
     alternative_fields = ["Provider Organization Name (Legal Business Name)", "Parent Organization LBN", "Provider Other Organization Name"]  # Replace with actual column names
     for alt_field in alternative_fields:
+        if alt_field not in row.index:  # filter_nppes_data keeps only some of them
+            continue
         alt_field_value = str(row[alt_field]).strip().lower() if pd.notna(row[alt_field]) else ""
         cms_name_value = str(cms_row["name"]).strip().lower() if pd.notna(cms_row["name"]) else ""
         if alt_field_value == cms_name_value:
@@ -44,6 +63,7 @@ required_columns = {
     "Type": None,  # General category (e.g., Hospital, Clinic)
     "Subtype": None,  # Specific classification (e.g., Rehabilitation Unit)
     "nucc_code": None,  # Mapping code for type/subtype
+    "nucc_id": None,  # Integer id of nucc_code in the NUCC dimension
     "unique_facility_at_location": 0,  # Flag for single facility at location
     "employer_group_type": "none",  # Group type: none, single, multi
     "entity_unique_to_address": 1,  # True by default
@@ -66,17 +86,19 @@ column_mapping_address = {
     "ZipCode": ["Provider Business Practice Location Address Postal Code"]  # No alternatives
 }
 
-def map_row_to_entity(row, taxonomy_field, taxonomy_mapping):
+def map_row_to_entity(row, taxonomy_field, details, entity_id=None):
     """
-    Assigns the nucc_code, type, and subtype based on a given taxonomy field.
+    Assigns the nucc_code, nucc_id, type, and subtype based on a given taxonomy field.
     
     Parameters:
     - row: A pandas Series representing a row in the dataset.
     - taxonomy_field: The name of the column in the dataset that corresponds to the taxonomy code.
-    - taxonomy_mapping: the taxonomy data dictionary of NPPES
+    - details: the row's code looked up in the NUCC dictionary (dimensions.taxonomy_details),
+      with nucc_id, type and subtype missing for codes the dictionary does not have
+    - entity_id: the entity's key when already computed (entity_keys), else generated here
     
     Returns:
-    - A dictionary with nucc_code, type, and subtype values.
+    - A dictionary with nucc_code, nucc_id, type, and subtype values.
     """
     entity = {col: default_value for col, default_value in required_columns.items()}
 
@@ -88,18 +110,17 @@ def map_row_to_entity(row, taxonomy_field, taxonomy_mapping):
                 break
     
     taxonomy_code = str(row.get(taxonomy_field, "")).strip()
-    if taxonomy_code in taxonomy_mapping:
-        details = taxonomy_mapping[taxonomy_code]
-        entity["nucc_code"] = taxonomy_code
-        entity["Type"] = details["type"]
-        entity["Subtype"] = details["subtype"]
+    entity["nucc_code"] = taxonomy_code
+    if pd.notna(details.nucc_id):
+        entity["nucc_id"] = details.nucc_id
+        entity["Type"] = details.type
+        entity["Subtype"] = details.subtype
     else:
-        entity["nucc_code"] = taxonomy_code
         entity["Type"] = "Clinical Location"
         entity["Subtype"] = None
     # Add derived fields or logic as needed
-    entity["entity_id"] = generate_numeric_key(row["NPI"], taxonomy_field)
-    # Extract addresses and update state_mapping
+    entity["entity_id"] = entity_id if entity_id is not None else generate_numeric_key(row["NPI"], taxonomy_field)
+    # Extract addresses
     #address = extract_addresses(row, "NPI")
     return entity#, address
 
@@ -113,10 +134,16 @@ def generate_numeric_key(npi, taxonomy_field):
     - taxonomy_field: Additional field (e.g., taxonomy code) to ensure uniqueness.
 
     Returns:
-    - A numeric primary key (up to 9 digits).
+    - A numeric primary key (63 bits, see stable_keys).
     """
-    combined_key = f"{npi}|{taxonomy_field}"  # Combine NPI and taxonomy field
-    return int(hashlib.md5(combined_key.encode()).hexdigest(), 16) % (10**9)  # Limits to 9 digits
+    return stable_key(f"{npi}|{taxonomy_field}")  # Combine NPI and taxonomy field
+
+def entity_keys(npis, taxonomy_values, taxonomy_field):
+    """generate_numeric_key for a whole taxonomy column: Int64, missing where the slot is empty."""
+    filled = pd.Series(taxonomy_values).notna().to_numpy()
+    keys = pd.Series(pd.NA, index=pd.Series(taxonomy_values).index, dtype=KEY)
+    keys[filled] = stable_keys(source_strings(pd.Series(npis)[filled], taxonomy_field)).to_numpy()
+    return keys
 
 def validate_and_remove_second_duplicate_within_row(row, taxonomy_fields):
     """
@@ -139,71 +166,153 @@ def validate_and_remove_second_duplicate_within_row(row, taxonomy_fields):
                 seen_values.add(row[field])  # Track the first occurrence
     return row
 
-def process_nppes(nppes_data, cms_data, ):
-    """Process the NPPES dataset based on the flow."""
+def remove_repeated_taxonomy_codes(data, taxonomy_fields):
+    """
+    Column-wise validate_and_remove_second_duplicate_within_row for the whole frame: a taxonomy
+    code already listed in an earlier field of the same row is set to None. Keeps the column
+    dtypes, where a row-wise apply turns every column back into objects.
+    """
+    data = data.copy()
+    fields = [field for field in taxonomy_fields if field in data.columns]
+    share_categories(data, fields)
+    for position, field in enumerate(fields):
+        repeated = pd.Series(False, index=data.index)
+        for earlier in fields[:position]:
+            repeated |= (data[field] == data[earlier]).fillna(False).astype(bool)
+        data.loc[repeated, field] = None
+    return data
+
+def practice_addresses(nppes_data):
+    """(address, city, state, zip code) columns of the practice addresses, built like extract_addresses builds them."""
+    line_1 = nppes_data[column_mapping_address["Address"][0]].astype(STRING)
+    second_line = "Provider Second Line Business Practice Location Address"
+    line_2 = nppes_data[second_line].astype(STRING).fillna("") if second_line in nppes_data.columns else ""
+    full_address = (line_1 + " " + line_2).str.strip(", ")
+    return (
+        full_address,
+        nppes_data[column_mapping_address["City"][0]],
+        nppes_data[column_mapping_address["State"][0]],
+        nppes_data[column_mapping_address["ZipCode"][0]]
+    )
+
+def practice_address_hashes(nppes_data):
+    """address_hash of every row's practice address."""
+    return key_hashes(address_keys(*practice_addresses(nppes_data)))
+
+def process_nppes(nppes_data, cms_data, cms_addresses=None):
+    """
+    Process the NPPES dataset based on the flow. Returns the CMS entities that take an NPPES NPI
+    (entity_id and npi), the new entities and their addresses.
+    """
     taxonomy_fields = find_taxonomy_fields(nppes_data.columns)
-    taxonomy_data = pd.read_csv(file_path_taxonomy_data)
-    # Create the taxonomy_mapping dictionary
-    taxonomy_mapping = taxonomy_data.set_index("NUCC Code").T.to_dict()
-    taxonomy_mapping = {key: {"type": value["Fashia - Facility Type"], "subtype": value["Fashia - Facility Subtype"]}
-                        for key, value in taxonomy_mapping.items()}
+    updated_cms_records = []
     new_entities = []
     new_address = []
+    entity_sources = []
+    address_positions = []
+    if cms_addresses is None:
+        cms_addresses = pd.DataFrame(columns=["ccn", "address_hash"])
     
     # Duplicate records are removed in fields by taxonomy
-    nppes_data = nppes_data.apply(lambda row: validate_and_remove_second_duplicate_within_row(row, taxonomy_fields), axis=1)
-
-    for _, nppes_row in nppes_data.iterrows():
-        new_entity_address = False
-        # Extract addresses and update state_mapping
-        address = extract_addresses(nppes_row, "NPI")
-
-        for taxonomy_field in taxonomy_fields:
-            if pd.notna(nppes_row[taxonomy_field]):  # Ensure field is not NaN
-                
-                #new_address.append(extract_addresses(nppes_row, "NPI"))
-                taxonomy_code = nppes_row[taxonomy_field]
-                cms_match = cms_data[cms_data["nucc_code"] == taxonomy_code]
-
-                if not cms_match.empty:
-                    if taxonomy_code == CMS_TAXONOMY_CODE:
-                        updated_entity = False
-                        for _, cms_row in cms_match.iterrows():
-                            updated = compare_and_update(nppes_row, cms_row)
-                            if updated:
-                                updated_entity = True
-                        if not updated_entity:
-                            entity = map_row_to_entity(nppes_row, taxonomy_field, taxonomy_mapping)
-                            new_entities.append(entity)
-                            new_entity_address = True
-                    else:
+    with span("dedupe_taxonomy_fields", rows=len(nppes_data)):
+        nppes_data = remove_repeated_taxonomy_codes(nppes_data, taxonomy_fields)
+
+    # nucc_id, type and subtype of every taxonomy column, one categorical lookup per column
+    with span("taxonomy_lookup", rows=len(nppes_data) * len(taxonomy_fields)):
+        taxonomy_details = {
+            field: list(dimensions.taxonomy_details(nppes_data[field], file_path_taxonomy_data).itertuples(index=False))
+            for field in taxonomy_fields
+        }
+
+    # StateIDs for the whole column from the states dimension
+    state_codes = nppes_data[column_mapping_address["State"][0]]
+    state_id_column = dimensions.state_ids(state_codes)
+    seen_state_codes.update(state_codes.dropna().unique())
+
+    # Address IDs of the practice addresses and hashes of their normalized form, for the whole column
+    with span("address_keys", rows=len(nppes_data)):
+        written = practice_addresses(nppes_data)
+        address_id_column = stable_keys(address_id_sources(nppes_data["NPI"], *written))
+        address_key_column = address_keys(*written)
+        address_hash_column = key_hashes(address_key_column)
+
+    # Entity IDs of the filled taxonomy slots, one column at a time
+    with span("entity_keys", rows=len(nppes_data) * len(taxonomy_fields)):
+        entity_id_columns = {field: entity_keys(nppes_data["NPI"], nppes_data[field], field).to_numpy() for field in taxonomy_fields}
+
+    # Taxonomy slots at a CMS facility's address with a compatible code are that facility
+    with span("reconcile", rows=len(nppes_data) + len(cms_data)):
+        matches = reconcile(nppes_data, taxonomy_fields, address_hash_column, cms_data, cms_addresses)
+        reconciled = set(zip(matches["position"], matches["taxonomy_field"]))
+        attached = matches[matches["attach_npi"]]
+        updated_cms_records.extend({"entity_id": entity_id, "npi": npi} for entity_id, npi in zip(attached["entity_id"], attached["npi"]))
+    print(f"Reconciled {len(matches)} NPPES taxonomy records with CMS entities.")
+
+    # CMS entities by code, looked up once per taxonomy slot
+    cms_by_code = {code: cms_rows for code, cms_rows in cms_data.groupby("nucc_code", observed=True)}
+
+    with span("match_rows", rows=len(nppes_data)):
+        for position, ((_, nppes_row), state_id, address_hash, address_id) in enumerate(zip(nppes_data.iterrows(), state_id_column, address_hash_column, address_id_column)):
+            new_entity_address = False
+            # Extract addresses with their state and keys
+            address = extract_addresses(nppes_row, "NPI", state_id, address_hash, address_id)
+
+            for taxonomy_field in taxonomy_fields:
+                if pd.notna(nppes_row[taxonomy_field]):  # Ensure field is not NaN
+                    if (position, taxonomy_field) in reconciled:
                         continue
-                else:
-                    entity = map_row_to_entity(nppes_row, taxonomy_field, taxonomy_mapping)
+                    taxonomy_code = nppes_row[taxonomy_field]
+                    cms_match = cms_by_code.get(taxonomy_code)
+
+                    # Hospices elsewhere than their CMS address are still matched by name
+                    if cms_match is not None and taxonomy_code == CMS_TAXONOMY_CODE:
+                        named = [cms_row for _, cms_row in cms_match.iterrows() if compare_and_update(nppes_row, cms_row)]
+                        if named:
+                            updated_cms_records.append({"entity_id": named[0]["entity_id"], "npi": str(nppes_row["NPI"])})
+                            continue
+                    entity = map_row_to_entity(nppes_row, taxonomy_field, taxonomy_details[taxonomy_field][position], entity_id_columns[taxonomy_field][position])
                     new_entities.append(entity)
+                    entity_sources.append(f"{nppes_row['NPI']}|{taxonomy_field}")
                     new_entity_address = True
-        if new_entity_address:
-            new_address.append(address)
-
-    return new_entities, new_address
-
-def save_to_cms_file(new_entities, extract_addresses):    
+            if new_entity_address:
+                new_address.append(address)
+                address_positions.append(position)
+
+    # Keys of the rows written, for the collision audit and the migration file
+    with span("key_ledger", rows=len(new_entities) + len(address_positions)):
+        key_ledger.add("entity_id", [entity["entity_id"] for entity in new_entities], entity_sources, [legacy_keys(entity_sources)])
+        kept = [column.iloc[address_positions] for column in written]
+        npis = nppes_data["NPI"].iloc[address_positions]
+        kept_keys = address_key_column.iloc[address_positions]
+        key_ledger.add("address_id", address_id_column.iloc[address_positions], address_id_sources(npis, *kept), [legacy_address_ids(npis, *kept)])
+        key_ledger.add("address_hash", address_hash_column.iloc[address_positions], kept_keys, legacy_address_hashes(*kept, keys=kept_keys))
+
+    return updated_cms_records, new_entities, new_address
+
+def save_to_cms_file(new_entities, extract_addresses, updated_cms_records=()):
     # Load the existing CMS entities file
     if os.path.exists(cms_file):
-        cms_entities = pd.read_csv(cms_file,
-            dtype={
-                "entity_id": str,  # Force NPI as string
-                "Type": str,  # Force Type field as Strings
-                "Subtype": str,  # Force Subtype field as Strings
-            },
-            low_memory=False  # Disable optimized loading to avoid type fragmentation
-        )
+        cms_entities = read_typed_csv(cms_file)
     else:
         cms_entities = pd.DataFrame(columns=required_columns.keys())  # Initialize with required columns
 
+    # NPIs of the NPPES organizations reconciled with CMS entities, kept where the entity has one
+    if updated_cms_records and "npi" in cms_entities.columns:
+        updates = apply_dtypes(pd.DataFrame(updated_cms_records)).drop_duplicates("entity_id")
+        npis = updates.set_index("entity_id")["npi"]
+        missing = cms_entities["npi"].isna()
+        cms_entities.loc[missing, "npi"] = cms_entities.loc[missing, "entity_id"].map(npis)
+
+
+    # New entity IDs are audited against each other and the CMS ones before anything is written
+    if "entity_id" in cms_entities.columns:
+        cms_ids = cms_entities["entity_id"].dropna()
+        key_ledger.add("entity_id", cms_ids, "cms:" + cms_ids.astype(str))
+    with span("audit_keys"):
+        print(f"Distinct keys: {key_ledger.audit()}")
 
     if new_entities:
-        new_entities_df = pd.DataFrame(new_entities)
+        new_entities_df = apply_dtypes(pd.DataFrame(new_entities))
         new_entities_df = new_entities_df.drop_duplicates(subset="entity_id")  # Ensure no duplicates
     else:
         new_entities_df = pd.DataFrame(columns=cms_entities.columns)
@@ -232,6 +341,10 @@ def save_to_cms_file(new_entities, extract_addresses):
         new_entities_df = new_entities_df.drop_duplicates(subset="entity_id")
         cms_entities = pd.concat([cms_entities, new_entities_df], ignore_index=True)
 
+    # Integer NUCC ids for every entity, CMS rows included
+    if "nucc_code" in cms_entities.columns:
+        cms_entities["nucc_id"] = dimensions.taxonomy_details(cms_entities["nucc_code"], file_path_taxonomy_data)["nucc_id"]
+
     # Save the updated entities back to the file
     cms_entities.to_csv(cms_file, index=False)
     
@@ -246,43 +359,19 @@ def save_to_cms_file(new_entities, extract_addresses):
     print("Addresses saved successfully.")
 
 
-# Initialize a global states mapping to assign unique StateIDs
-state_mapping = {}
-def initialize_state_mapping(states_file):
-    """Initialize the state_mapping with the existing states CSV file."""
-    if os.path.exists(states_file):
-        states_df = pd.read_csv(states_file)
-        for _, row in states_df.iterrows():
-            state_code = row["state_code"]
-            state_mapping[state_code] = {
-                "state_id": row["state_id"],
-                "state_code": state_code,
-                "state_name": row["state_name"]
-            }
-        print(f"State mapping initialized with {len(state_mapping)} states from {states_file}.")
-    else:
-        print(f"States file {states_file} not found. State mapping will start empty.")
+# State codes seen in this run, saved with the states dimension
+seen_state_codes = set()
+# Keys handed out in this run, audited before the entities are saved
+key_ledger = KeyLedger()
 
 # Function to generate a unique address ID (hash)
 def generate_address_id(npi, address, city, state, zip_code):
-    """Generate a unique ID for an address based on CNN and address hash."""
-    # Use only the first 5 digits of the ZIP code
-    zip_trimmed = str(zip_code)[:5] if pd.notna(zip_code) else ""
-    address_str = f"{address}|{city}|{state}|{zip_trimmed}"
-    address_hash = hashlib.md5(address_str.encode()).hexdigest()
-    return int(hashlib.md5(f"{npi}{address_hash}".encode()).hexdigest(), 16) % (10**9)  # 9-digit limit
-
-# Function to get or assign StateID
-def get_or_create_state_id(state_code):
-    """Retrieve an existing StateID or create a new one for a state code."""
-    if state_code not in state_mapping:
-        state_id = len(state_mapping) + 1
-        state_mapping[state_code] = {"state_id": state_id, "state_code": state_code, "state_name": None}
-    return state_mapping[state_code]["state_id"]
+    """Generate a unique ID for an address from its NPI and the address as written."""
+    return stable_key(address_id_sources([npi], [address], [city], [state], [zip_code]).iloc[0])
 
 # Function to extract addresses and save to CSV
-def extract_addresses(row, npi_column="NPI"):
-    """Extract address from the data and return address record"""
+def extract_addresses(row, npi_column="NPI", state_id=None, address_hash=None, address_id=None):
+    """Extract address from the data and return address record (state_id, address_hash and address_id are computed when not given)"""
     # Dynamically map columns
     address_col = next((alt for alt in column_mapping_address["Address"] if alt in row.index), None)
     city_col = next((alt for alt in column_mapping_address["City"] if alt in row.index), None)
@@ -309,13 +398,17 @@ def extract_addresses(row, npi_column="NPI"):
     npi = row.get(npi_column, None)
     
     # Generate address ID
-    address_id = generate_address_id(npi, full_address, city, state, zip_code)
+    if address_id is None:
+        address_id = generate_address_id(npi, full_address, city, state, zip_code)
     
-    # Assign StateID using state_mapping
-    state_id = get_or_create_state_id(state)
+    # Assign StateID from the states dimension
+    if state_id is None:
+        state_id = dimensions.state_id(state)
+        seen_state_codes.add(state)
     
-    # Create address hash (for tracking uniqueness)
-    address_hash = int(hashlib.md5(f"{full_address}|{city}|{state}|{str(zip_code)[:5]}".encode()).hexdigest(), 16) % (10**9)
+    # Create address hash (for tracking uniqueness) of the normalized address
+    if address_hash is None:
+        address_hash = normalized_address_hash(full_address, city, state, zip_code)
     
     # Append to records
     return {
@@ -332,19 +425,25 @@ def extract_addresses(row, npi_column="NPI"):
     }
     
 
-# Load the existing states.csv file to initialize state_mapping
-initialize_state_mapping(states_file)
-
-
 def main():
     """Main function to orchestrate the NPPES processing."""
+    seen_state_codes.clear()
+    key_ledger.clear()
+
     print("Loading datasets...")
-    nppes_data, cms_data = load_datasets(nppes_file, cms_file)
+    with span("load_datasets") as load_span:
+        nppes_data, cms_data = load_datasets(nppes_file, cms_file)
+        load_span.rows = len(nppes_data) + len(cms_data)
     
     print("Processing NPPES data...")
-    new_entities, extract_addresses = process_nppes(nppes_data, cms_data)
-    print(f"New Entities: {len(new_entities)}")
-    save_to_cms_file(new_entities, extract_addresses)
+    with span("process_nppes", rows=len(nppes_data)):
+        updated_cms_records, new_entities, extract_addresses = process_nppes(nppes_data, cms_data, load_cms_addresses(addresses_file))
+    print(f"New Entities: {len(new_entities)}, CMS entities given an NPI: {len(updated_cms_records)}")
+    with span("save", rows=len(new_entities)):
+        save_to_cms_file(new_entities, extract_addresses, updated_cms_records)
+        dimensions.save_states(states_file, seen_state_codes)
+        key_ledger.save(KEY_MIGRATION_FILE)
+    record_rows(len(nppes_data))
     print("Processing complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Run reports (and profiler output) are written here
+REPORT_FOLDER = "datasets/reports"
+# How often a stage's resident memory is sampled
+RSS_SAMPLE_SECONDS = 0.05
+# Allocation sites listed in a tracemalloc report
+TRACEMALLOC_TOP_LINES = 50
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+_local = threading.local()
+_lock = threading.Lock()
+# Finished top-level spans of this run, in the order they finished
+finished_spans = []
+# Spans whose memory is being sampled right now
+_sampled_spans = set()
+
+
+def peak_rss_bytes():
+    """Peak resident memory of the process so far."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    """Resident memory of the process now (Linux), falling back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+class RssSampler:
+    """Background thread tracking the highest resident memory seen between start() and stop()."""
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = current_rss_bytes() or 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes() or 0)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes() or 0)
+        return self.peak
+
+
+class Span:
+    """
+    One timed piece of work: wall time, CPU time of the thread running it and of the whole
+    process, a row count and, for sampled spans, the peak resident memory.
+    """
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.rows = None
+        self.status = "ok"
+        self.children = []
+        self.peak_rss = None
+        # Names of the sampled spans that ran at the same time, whose memory is in peak_rss too
+        self.shared_with = set()
+        self.wall_seconds = self.thread_cpu_seconds = self.process_cpu_seconds = 0.0
+        self._started = (time.perf_counter(), time.thread_time(), time.process_time())
+
+    def add_rows(self, count):
+        self.rows = (self.rows or 0) + int(count)
+
+    def finish(self):
+        wall, thread_cpu, process_cpu = self._started
+        self.wall_seconds = time.perf_counter() - wall
+        self.thread_cpu_seconds = time.thread_time() - thread_cpu
+        self.process_cpu_seconds = time.process_time() - process_cpu
+
+    def to_dict(self):
+        report = {"name": self.name, **self.attributes, "status": self.status, "wall_seconds": round(self.wall_seconds, 4),
+                  "cpu_seconds": round(self.thread_cpu_seconds, 4), "process_cpu_seconds": round(self.process_cpu_seconds, 4)}
+        if self.rows is not None:
+            report["rows"] = self.rows
+            report["rows_per_second"] = round(self.rows / self.wall_seconds, 1) if self.wall_seconds > 0 else None
+        if self.peak_rss is not None:
+            # Resident memory is only known for the whole process
+            report["peak_rss_mb"] = round(self.peak_rss / 2**20, 1)
+            report["peak_rss_scope"] = "process"
+            if self.shared_with:
+                report["peak_rss_shared_with"] = sorted(self.shared_with)
+        if self.children:
+            report["spans"] = [child.to_dict() for child in self.children]
+        return report
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def span(name, rows=None, sample_memory=False, **attributes):
+    """
+    Times the enclosed block as a span nested in the enclosing span of the same thread.
+    Row counts can be given up front, set on the yielded span or added with record_rows();
+    sample_memory tracks the peak resident memory of the process while the block runs; sampled
+    spans running at the same time (stages run in parallel) list each other in
+    peak_rss_shared_with, since each peak includes the other's memory. Run one stage at a time
+    for a per-stage figure.
+    """
+    current = Span(name, attributes)
+    if rows is not None:
+        current.add_rows(rows)
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    sampler = RssSampler().start() if sample_memory else None
+    if sample_memory:
+        with _lock:
+            for other in _sampled_spans:
+                other.shared_with.add(name)
+                current.shared_with.add(other.name)
+            _sampled_spans.add(current)
+    stack.append(current)
+    try:
+        yield current
+    except BaseException:
+        current.status = "failed"
+        raise
+    finally:
+        stack.pop()
+        current.finish()
+        if sampler is not None:
+            current.peak_rss = sampler.stop()
+            with _lock:
+                _sampled_spans.discard(current)
+        if parent is not None:
+            parent.children.append(current)
+        else:
+            with _lock:
+                finished_spans.append(current)
+
+
+def record_rows(count):
+    """Adds rows to the innermost open span of this thread (no-op outside a span)."""
+    stack = _stack()
+    if stack:
+        stack[-1].add_rows(count)
+
+
+@contextmanager
+def profiled(kind, output_stem):
+    """
+    Runs the enclosed block under cProfile (written to <output_stem>.prof, readable with pstats)
+    or tracemalloc (top allocation sites written to <output_stem>.tracemalloc.txt).
+    cProfile follows the calling thread only; tracemalloc sees every thread of the process.
+    """
+    if kind not in PROFILERS:
+        raise ValueError(f"Unknown profiler {kind!r}, expected one of {PROFILERS}")
+    directory = os.path.dirname(output_stem)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{output_stem}.prof")
+        return
+
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+        with open(f"{output_stem}.tracemalloc.txt", "w") as f:
+            f.write(f"Traced memory: current {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB\n\n")
+            for statistic in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_LINES]:
+                f.write(f"{statistic}\n")
+
+
+def report_path(started_at=None, folder=REPORT_FOLDER):
+    """Default location of a run report: <folder>/run_<timestamp>.json."""
+    started_at = started_at or datetime.now()
+    return os.path.join(folder, f"run_{started_at:%Y%m%d_%H%M%S}.json")
+
+
+def run_report(started_at, spans=None, **extra):
+    """Builds the JSON-ready report of a run from its finished top-level spans."""
+    spans = finished_spans if spans is None else spans
+    peak = peak_rss_bytes()
+    return {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "wall_seconds": round((datetime.now() - started_at).total_seconds(), 3),
+        "peak_rss_mb": round(peak / 2**20, 1) if peak is not None else None,
+        **extra,
+        "stages": [finished.to_dict() for finished in spans]
+    }
+
+
+def write_report(report, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def reset():
+    """Forgets the spans recorded so far."""
+    with _lock:
+        finished_spans.clear()
@@ -0,0 +1,137 @@
+"""
+Local read-only HTTP service over facilities.db (see facility_queries for the lookups).
+
+    GET /entities/npi/{npi}
+    GET /entities/ccn/{ccn}
+    GET /entities?type=Hospital&subtype=...&state=IL    (or &zip=62704; optional &limit=)
+    GET /addresses/{address_hash}/entities
+    GET /search?q=st+mary+rehab+springfield          (optional &state=, &subtype=, &limit=)
+    GET /stats
+
+Answers are JSON objects with "count" and "results", where entity_id and address_hash are strings
+(they are 63-bit keys). Cached results are served straight from the event loop; the others run on
+a thread per pooled connection, so a slow query never blocks the loop.
+
+    python query_service.py --db facilities.db --port 8080
+
+With --shards the lookups run on the per-state shards instead (see shard_router), all of them or
+only those of --states on a regional node:
+
+    python query_service.py --shards shards --states IL WI
+"""
+import argparse
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from facility_queries import CACHE_SIZE, DB_PATH, DEFAULT_LIMIT, POOL_SIZE, FacilityQueries, Lookups, address_lookup, search_lookup, type_lookup
+from shard_router import ShardRouter
+from stable_keys import keys_as_strings
+
+QUERIES = web.AppKey("queries", Lookups)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+
+
+async def lookup(request, name, **params):
+    """Answers a lookup from the cache or, on a miss, from a pooled connection."""
+    queries = request.app[QUERIES]
+    results = queries.cached(name, **params)
+    if results is None:
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(request.app[EXECUTOR], functools.partial(queries.query, name, **params))
+    return results
+
+
+def respond(results, not_found=False):
+    if not results and not_found:
+        return web.json_response({"count": 0, "results": [], "error": "not found"}, status=404)
+    # Keys are 63-bit, past what a JSON number keeps exactly in JavaScript
+    return web.json_response({"count": len(results), "results": [keys_as_strings(row) for row in results]})
+
+
+def bad_request(message):
+    return web.json_response({"error": message}, status=400)
+
+
+async def entity_by_npi(request):
+    return respond(await lookup(request, "npi", npi=request.match_info["npi"]), not_found=True)
+
+
+async def entity_by_ccn(request):
+    return respond(await lookup(request, "ccn", ccn=request.match_info["ccn"]), not_found=True)
+
+
+async def entities_by_type(request):
+    query = request.query
+    if "type" not in query:
+        return bad_request("type is required")
+    try:
+        name, params = type_lookup(query["type"], query.get("subtype"), query.get("state"), query.get("zip"), query.get("limit", DEFAULT_LIMIT))
+    except ValueError as error:
+        return bad_request(str(error))
+    return respond(await lookup(request, name, **params))
+
+
+async def entities_at_address(request):
+    try:
+        params = address_lookup(request.match_info["address_hash"], request.query.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return bad_request("address_hash and limit must be integers")
+    return respond(await lookup(request, "address", **params))
+
+
+async def search(request):
+    query = request.query
+    try:
+        params = search_lookup(query.get("q", ""), query.get("state"), query.get("subtype"), query.get("limit", DEFAULT_LIMIT))
+    except ValueError as error:
+        return bad_request(str(error))
+    return respond(await lookup(request, "search", **params))
+
+
+async def stats(request):
+    return web.json_response(request.app[QUERIES].stats())
+
+
+def create_app(db_path=DB_PATH, pool_size=POOL_SIZE, cache_size=CACHE_SIZE, shard_folder=None, states=None):
+    """
+    The service application over a database, or over the shards in shard_folder (limited to
+    states when given); the pools, caches and worker threads are released on cleanup.
+    """
+    app = web.Application()
+    if shard_folder is not None:
+        app[QUERIES] = ShardRouter(shard_folder, states, pool_size, cache_size)
+    else:
+        app[QUERIES] = FacilityQueries(db_path, pool_size, cache_size)
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="query")
+    app.router.add_get("/entities/npi/{npi}", entity_by_npi)
+    app.router.add_get("/entities/ccn/{ccn}", entity_by_ccn)
+    app.router.add_get("/entities", entities_by_type)
+    app.router.add_get("/addresses/{address_hash}/entities", entities_at_address)
+    app.router.add_get("/search", search)
+    app.router.add_get("/stats", stats)
+
+    async def close(app):
+        app[EXECUTOR].shutdown(wait=True)
+        app[QUERIES].close()
+
+    app.on_cleanup.append(close)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve read-only facility lookups over HTTP.")
+    parser.add_argument("--db", default=DB_PATH, help="Database to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="Read-only connections (and query threads)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="Cached results (0 disables the cache)")
+    parser.add_argument("--shards", default=None, help="Serve the per-state shards in this folder instead of --db")
+    parser.add_argument("--states", nargs="+", default=None, help="With --shards, the state codes served (default: all)")
+    args = parser.parse_args()
+    app = create_app(args.db, args.pool_size, args.cache_size, args.shards, args.states)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
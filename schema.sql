@@ -45,10 +45,106 @@ CREATE TABLE IF NOT EXISTS address_geolocation (
     address_hash INTEGER NOT NULL,
     latitude REAL NOT NULL,
     longitude REAL NOT NULL,
+    "precision" TEXT NOT NULL DEFAULT 'rooftop', -- 'zip' for ZIP5 centroids, 'rooftop' for API geocodes
     FOREIGN KEY (address_hash) REFERENCES addresses(address_hash) ON DELETE CASCADE
 );
 
+-- R*Tree over the geolocation points, kept in sync by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS address_geolocation_rtree USING rtree (
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+);
+
+-- Plain statements only: an outer upsert's conflict handling would override an OR REPLACE here
+CREATE TRIGGER IF NOT EXISTS address_geolocation_rtree_insert AFTER INSERT ON address_geolocation
+BEGIN
+    DELETE FROM address_geolocation_rtree WHERE id = new.id;
+    INSERT INTO address_geolocation_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS address_geolocation_rtree_update AFTER UPDATE OF latitude, longitude ON address_geolocation
+BEGIN
+    UPDATE address_geolocation_rtree
+    SET min_lat = new.latitude, max_lat = new.latitude, min_lon = new.longitude, max_lon = new.longitude
+    WHERE id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS address_geolocation_rtree_delete AFTER DELETE ON address_geolocation
+BEGIN
+    DELETE FROM address_geolocation_rtree WHERE id = old.id;
+END;
+
+-- Full-text index over entity names, types and addresses, one row per entity and linked address.
+-- The rowid packs both rowids (entity rowid << 32 | address rowid), so the triggers below find the
+-- rows of an entity with a rowid range and the row of a pair directly.
+CREATE VIRTUAL TABLE IF NOT EXISTS entity_search USING fts5 (
+    name, "type", subtype, "address", city, state_code,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+
+CREATE TRIGGER IF NOT EXISTS entity_search_entity_insert AFTER INSERT ON entities
+BEGIN
+    INSERT INTO entity_search (rowid, name, "type", subtype, "address", city, state_code)
+    SELECT (new.rowid << 32) | a.rowid, new.name, new."type", new.subtype, a."address", a.city, s.state_code
+    FROM addresses a LEFT JOIN states s ON s.state_id = a.state_id
+    WHERE a.ccn = new.ccn OR a.npi = new.npi;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entity_search_entity_update AFTER UPDATE OF name, "type", subtype, ccn, npi ON entities
+BEGIN
+    DELETE FROM entity_search WHERE rowid BETWEEN old.rowid << 32 AND (old.rowid << 32) | 4294967295;
+    INSERT INTO entity_search (rowid, name, "type", subtype, "address", city, state_code)
+    SELECT (new.rowid << 32) | a.rowid, new.name, new."type", new.subtype, a."address", a.city, s.state_code
+    FROM addresses a LEFT JOIN states s ON s.state_id = a.state_id
+    WHERE a.ccn = new.ccn OR a.npi = new.npi;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entity_search_entity_delete AFTER DELETE ON entities
+BEGIN
+    DELETE FROM entity_search WHERE rowid BETWEEN old.rowid << 32 AND (old.rowid << 32) | 4294967295;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entity_search_address_insert AFTER INSERT ON addresses
+BEGIN
+    INSERT INTO entity_search (rowid, name, "type", subtype, "address", city, state_code)
+    SELECT (e.rowid << 32) | new.rowid, e.name, e."type", e.subtype, new."address", new.city,
+           (SELECT state_code FROM states WHERE state_id = new.state_id)
+    FROM entities e
+    WHERE e.ccn = new.ccn OR e.npi = new.npi;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entity_search_address_update AFTER UPDATE OF "address", city, state_id, ccn, npi ON addresses
+BEGIN
+    DELETE FROM entity_search WHERE rowid IN (
+        SELECT (e.rowid << 32) | old.rowid FROM entities e WHERE e.ccn = old.ccn OR e.npi = old.npi
+    );
+    INSERT INTO entity_search (rowid, name, "type", subtype, "address", city, state_code)
+    SELECT (e.rowid << 32) | new.rowid, e.name, e."type", e.subtype, new."address", new.city,
+           (SELECT state_code FROM states WHERE state_id = new.state_id)
+    FROM entities e
+    WHERE e.ccn = new.ccn OR e.npi = new.npi;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entity_search_address_delete AFTER DELETE ON addresses
+BEGIN
+    DELETE FROM entity_search WHERE rowid IN (
+        SELECT (e.rowid << 32) | old.rowid FROM entities e WHERE e.ccn = old.ccn OR e.npi = old.npi
+    );
+END;
+
 -- Indexes for optimization
 CREATE INDEX IF NOT EXISTS idx_entities_npi_ccn ON entities (npi, ccn);
+CREATE INDEX IF NOT EXISTS idx_entities_ccn ON entities (ccn);
 CREATE INDEX IF NOT EXISTS idx_addresses_hash ON addresses (address_hash);
-CREATE INDEX IF NOT EXISTS idx_states_code ON states (state_code);
\ No newline at end of file
+-- Lookups of facility_queries: addresses of an entity, entities by type in a state or ZIP code
+CREATE INDEX IF NOT EXISTS idx_addresses_ccn ON addresses (ccn);
+CREATE INDEX IF NOT EXISTS idx_addresses_npi ON addresses (npi);
+CREATE INDEX IF NOT EXISTS idx_addresses_state_zip ON addresses (state_id, zip_code);
+CREATE INDEX IF NOT EXISTS idx_addresses_zip ON addresses (zip_code);
+CREATE INDEX IF NOT EXISTS idx_entities_type ON entities ("type", subtype);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_address_geolocation_hash ON address_geolocation (address_hash);
+CREATE INDEX IF NOT EXISTS idx_states_code ON states (state_code);
+-- The key of states, lost when setup_database replaces the table
+CREATE UNIQUE INDEX IF NOT EXISTS idx_states_id ON states (state_id);
\ No newline at end of file
@@ -1,38 +1,340 @@
+import argparse
+import hashlib
+import json
+import os
 import sqlite3
 import pandas as pd
+from dtype_policy import read_typed_csv
+from pipeline_metrics import record_rows, span
+from stable_keys import KEY_MIGRATION_FILE, load_key_migration
+
+# One database per state for the regional nodes (see create_shards and shard_router)
+SHARD_FOLDER = "shards"
+SHARD_MANIFEST = "manifest.json"
+# Shard of the addresses without a state and of the entities without addresses
+NO_STATE_SHARD = "none"
+
+def sync_spatial_index(connection):
+    """Adds geolocation rows missing from the R*Tree (databases geocoded before the index existed)."""
+    connection.execute("""
+        INSERT INTO address_geolocation_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT g.id, g.latitude, g.latitude, g.longitude, g.longitude
+        FROM address_geolocation g
+        LEFT JOIN address_geolocation_rtree r ON r.id = g.id
+        WHERE r.id IS NULL
+    """)
+
+def collapse_geolocation_duplicates(connection):
+    """
+    Keeps the latest geocode (highest id) of every address_hash. Databases geocoded before
+    address_geolocation became unique per hash hold one row per addresses row, and the schema's
+    unique index cannot be created over them.
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'address_geolocation'"
+    ).fetchone()
+    if exists:
+        connection.execute("""
+            DELETE FROM address_geolocation
+            WHERE id NOT IN (SELECT MAX(id) FROM address_geolocation GROUP BY address_hash)
+        """)
+
+def migrate_geolocation_keys(connection, migration_file=KEY_MIGRATION_FILE):
+    """
+    Moves geocodes stored under an earlier scheme's address_hash to the hash of this build, using
+    the key migration the importers wrote (see stable_keys). A geocode already under the new hash
+    wins over migrated ones, and of several old hashes of one address the latest geocode is kept.
+    Returns the number of geocodes moved.
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'address_geolocation'"
+    ).fetchone()
+    migration = load_key_migration(migration_file, "address_hash")
+    if not exists or migration.empty:
+        return 0
+    connection.execute("CREATE TEMP TABLE key_migration (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)")
+    connection.executemany(
+        "INSERT INTO key_migration (old_id, new_id) VALUES (?, ?)",
+        migration[["old_id", "new_id"]].astype("int64").to_numpy().tolist()
+    )
+    connection.execute("""
+        DELETE FROM address_geolocation
+        WHERE address_hash IN (
+            SELECT old_id FROM key_migration WHERE new_id IN (SELECT address_hash FROM address_geolocation)
+        ) OR (
+            address_hash IN (SELECT old_id FROM key_migration)
+            AND id NOT IN (
+                SELECT MAX(g.id) FROM address_geolocation g JOIN key_migration m ON m.old_id = g.address_hash
+                GROUP BY m.new_id
+            )
+        )
+    """)
+    moved = connection.execute("""
+        UPDATE address_geolocation
+        SET address_hash = (SELECT new_id FROM key_migration WHERE old_id = address_geolocation.address_hash)
+        WHERE address_hash IN (SELECT old_id FROM key_migration)
+    """).rowcount
+    connection.execute("DROP TABLE key_migration")
+    return moved
+
+def rebuild_search_index(connection):
+    """
+    Refills the entity_search full-text index from entities and addresses. The tables are replaced
+    by the load, which drops the triggers that keep the index in step; they are back (with the
+    schema) for later incremental writes.
+    """
+    connection.execute("DELETE FROM entity_search")
+    connection.execute("""
+        INSERT INTO entity_search (rowid, name, "type", subtype, "address", city, state_code)
+        SELECT (e.rowid << 32) | a.rowid, e.name, e."type", e.subtype, a."address", a.city, s.state_code
+        FROM entities e
+        JOIN addresses a ON a.ccn = e.ccn OR a.npi = e.npi
+        LEFT JOIN states s ON s.state_id = a.state_id
+    """)
+    # Merge the index segments written by the bulk insert
+    connection.execute("INSERT INTO entity_search (entity_search) VALUES ('optimize')")
+
+def finish_database(connection, schema):
+    """
+    Indexes a database whose tables were just loaded with to_sql(if_exists='replace'), which drops
+    the schema indexes: runs the schema again to restore them, brings the R*Tree up to date with
+    address_geolocation, refills the search index and gathers the planner statistics.
+    """
+    with span("indexes"):
+        connection.executescript(schema)
+        sync_spatial_index(connection)
+    with span("search_index"):
+        rebuild_search_index(connection)
+    with span("analyze"):
+        # Table statistics, without which the planner joins entities of a type to every address in a state
+        connection.execute("ANALYZE")
 
 def create_database(db_name="facilities.db", schema_file="schema.sql"):
     # Connect to SQLite
     connection = sqlite3.connect(db_name)
     cursor = connection.cursor()
 
+    # Existing databases may still hold duplicate geocodes, which the schema's unique index rejects,
+    # and geocodes under the address_hash of an earlier keying scheme
+    collapse_geolocation_duplicates(connection)
+    with span("migrate_keys") as migrate_span:
+        migrate_span.rows = migrate_geolocation_keys(connection)
+        if migrate_span.rows:
+            print(f"Moved {migrate_span.rows} geocodes to their new address_hash.")
+
     # Read the SQL schema and execute it
     with open(schema_file, 'r') as f:
         schema = f.read()
         cursor.executescript(schema)
         
     # Loading entities
-    entities = pd.read_csv(
-        'datasets/output/entities.csv', 
-        dtype={"ccn": str},  # Adjust the column name according to your file
-        low_memory=False  # Suppress warning for large files
-    )
-    entities.to_sql('entities', connection, if_exists='replace', index=False)
+    with span("load_entities") as load_span:
+        # Identifiers are read as text, so they join with addresses
+        entities = read_typed_csv('datasets/output/entities.csv')
+        entities.to_sql('entities', connection, if_exists='replace', index=False)
+        load_span.rows = len(entities)
 
     # Loading addresses
-    addresses = pd.read_csv('datasets/output/addresses.csv')
-    addresses.to_sql('addresses', connection, if_exists='replace', index=False)
+    with span("load_addresses") as load_span:
+        addresses = read_typed_csv('datasets/output/addresses.csv')
+        addresses.to_sql('addresses', connection, if_exists='replace', index=False)
+        load_span.rows = len(addresses)
 
     # Loading states
-    states = pd.read_csv('datasets/output/states.csv')
-    states.to_sql('states', connection, if_exists='replace', index=False)
+    with span("load_states") as load_span:
+        states = read_typed_csv('datasets/output/states.csv')
+        states.to_sql('states', connection, if_exists='replace', index=False)
+        load_span.rows = len(states)
+    record_rows(len(entities) + len(addresses) + len(states))
 
     print("Data loaded successfully into SQLite.")
 
+    finish_database(connection, schema)
+
     # Commit changes and close the connection
     connection.commit()
     connection.close()
     print(f"Database created in {db_name}")
 
+# Rows of every shard, read from the full database (`shard` is the shard key)
+SHARD_ROWS = {
+    "entities": """
+        SELECT e.* FROM entities e JOIN temp.shard_entities s ON s.entity_rowid = e.rowid
+        WHERE s.shard = :shard ORDER BY e.rowid""",
+    "addresses": """
+        SELECT a.* FROM addresses a JOIN temp.shard_addresses s ON s.address_rowid = a.rowid
+        WHERE s.shard = :shard ORDER BY a.rowid""",
+    "states": "SELECT * FROM states ORDER BY rowid",
+    "address_geolocation": """
+        SELECT g.* FROM address_geolocation g
+        WHERE g.address_hash IN (
+            SELECT a.address_hash FROM addresses a JOIN temp.shard_addresses s ON s.address_rowid = a.rowid
+            WHERE s.shard = :shard
+        ) ORDER BY g.id""",
+}
+
+def assign_shards(connection):
+    """
+    Puts the shard of every address (its state_id) and of every entity (the states of the
+    addresses linked to it by CCN or NPI, like the lookups link them) in temp tables. An entity
+    with addresses in several states is in each of their shards, with the addresses of that state.
+    """
+    connection.executescript(f"""
+        DROP TABLE IF EXISTS temp.shard_addresses;
+        DROP TABLE IF EXISTS temp.shard_entities;
+        CREATE TEMP TABLE shard_addresses AS
+            SELECT rowid AS address_rowid, COALESCE(CAST(state_id AS TEXT), '{NO_STATE_SHARD}') AS shard FROM addresses;
+        CREATE INDEX temp.idx_shard_addresses ON shard_addresses (shard, address_rowid);
+        CREATE TEMP TABLE shard_entities AS
+            SELECT s.shard, e.rowid AS entity_rowid
+            FROM entities e JOIN addresses a ON a.ccn = e.ccn JOIN temp.shard_addresses s ON s.address_rowid = a.rowid
+            UNION
+            SELECT s.shard, e.rowid
+            FROM entities e JOIN addresses a ON a.npi = e.npi JOIN temp.shard_addresses s ON s.address_rowid = a.rowid
+            UNION
+            SELECT '{NO_STATE_SHARD}', e.rowid FROM entities e
+            WHERE NOT EXISTS (SELECT 1 FROM addresses a WHERE a.ccn = e.ccn)
+              AND NOT EXISTS (SELECT 1 FROM addresses a WHERE a.npi = e.npi);
+        CREATE INDEX temp.idx_shard_entities ON shard_entities (shard, entity_rowid);
+    """)
+    shards = connection.execute("SELECT shard FROM temp.shard_addresses UNION SELECT shard FROM temp.shard_entities").fetchall()
+    return sorted(shard for (shard,) in shards)
+
+def shard_fingerprint(connection, shard, schema):
+    """Hash of the schema and of every row going into a shard, with the row counts of its tables."""
+    digest = hashlib.sha256(schema.encode())
+    counts = {}
+    for table, query in SHARD_ROWS.items():
+        digest.update(table.encode())
+        counts[table] = 0
+        for row in connection.execute(query, {"shard": shard}):
+            digest.update(repr(row).encode())
+            counts[table] += 1
+    return digest.hexdigest(), counts
+
+def build_shard(connection, shard, path, schema):
+    """
+    Writes one shard next to `path` and swaps it in, so readers of the old file (see
+    facility_queries) see either shard whole. The tables are copied with SQL, keeping the keys
+    exactly as stored, and indexed like the full database.
+    """
+    building = f"{path}.building"
+    if os.path.exists(building):
+        os.remove(building)
+    # Nothing reads the file before it is complete and swapped in, so it is written without syncs
+    # or a journal (the schema alone would otherwise cost a sync per statement)
+    unsynced = "PRAGMA {schema}synchronous = OFF; PRAGMA {schema}journal_mode = OFF;"
+    shard_connection = sqlite3.connect(building)
+    shard_connection.executescript(unsynced.format(schema="") + schema)
+    shard_connection.close()
+
+    connection.execute("ATTACH DATABASE ? AS shard", (building,))
+    try:
+        connection.executescript(unsynced.format(schema="shard."))
+        for table in ["entities", "addresses", "states"]:
+            # Like to_sql(if_exists='replace') in create_database: the loaded tables replace the schema's
+            connection.execute(f"DROP TABLE shard.{table}")
+            connection.execute(f"CREATE TABLE shard.{table} AS {SHARD_ROWS[table]}", {"shard": shard})
+        columns = [row[1] for row in connection.execute("PRAGMA main.table_info(address_geolocation)")]
+        connection.execute(
+            f"INSERT INTO shard.address_geolocation ({', '.join(columns)}) {SHARD_ROWS['address_geolocation']}",
+            {"shard": shard}
+        )
+        connection.commit()
+    finally:
+        connection.execute("DETACH DATABASE shard")
+
+    shard_connection = sqlite3.connect(building)
+    try:
+        shard_connection.executescript(unsynced.format(schema=""))
+        finish_database(shard_connection, schema)
+        shard_connection.commit()
+    finally:
+        shard_connection.close()
+    os.replace(building, path)
+
+def load_manifest(shard_folder=SHARD_FOLDER):
+    """The manifest of the shards in a folder (empty when none were built)."""
+    path = os.path.join(shard_folder, SHARD_MANIFEST)
+    if not os.path.exists(path):
+        return {"shards": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def create_shards(db_name="facilities.db", shard_folder=SHARD_FOLDER, schema_file="schema.sql", states=None):
+    """
+    Splits the built database into one database per state_id of its addresses (plus NO_STATE_SHARD)
+    in shard_folder, with a manifest naming the state, file, fingerprint and ZIP codes of each. A shard whose
+    rows and schema are unchanged since the last run is kept as it is. states limits the run to
+    those state codes (a regional node): the other shards in the folder and their manifest entries
+    are left as they are. Only shards whose state no longer has addresses are removed.
+    Returns the manifest.
+    """
+    os.makedirs(shard_folder, exist_ok=True)
+    with open(schema_file) as f:
+        schema = f.read()
+    previous = load_manifest(shard_folder)["shards"]
+    wanted = {state.strip().upper() for state in states} if states else None
+
+    connection = sqlite3.connect(db_name)
+    try:
+        with span("assign_shards"):
+            shard_keys = assign_shards(connection)
+        state_codes = {str(state_id): code for state_id, code in connection.execute("SELECT state_id, state_code FROM states")}
+        manifest = {}
+        checked = []
+        built = 0
+        for shard in shard_keys:
+            state_code = state_codes.get(shard)
+            if wanted is not None and (state_code or shard).upper() not in wanted:
+                # Another node's shard in a shared folder: kept as the last run left it
+                if shard in previous:
+                    manifest[shard] = previous[shard]
+                continue
+            checked.append(shard)
+            file_name = f"facilities_{shard}.db"
+            path = os.path.join(shard_folder, file_name)
+            with span("shard", shard=shard) as shard_span:
+                fingerprint, counts = shard_fingerprint(connection, shard, schema)
+                shard_span.rows = sum(counts.values())
+                if previous.get(shard, {}).get("fingerprint") != fingerprint or not os.path.exists(path):
+                    build_shard(connection, shard, path, schema)
+                    built += 1
+            zip_codes = connection.execute(
+                "SELECT DISTINCT zip_code FROM addresses a JOIN temp.shard_addresses s ON s.address_rowid = a.rowid "
+                "WHERE s.shard = ? AND zip_code IS NOT NULL ORDER BY zip_code", (shard,)
+            ).fetchall()
+            manifest[shard] = {
+                "state_code": state_code, "file": file_name, "fingerprint": fingerprint, **counts,
+                # Lets the router send lookups by ZIP code to the shards holding it
+                "zip_codes": [zip_code for (zip_code,) in zip_codes]
+            }
+    finally:
+        connection.close()
+
+    # Swapped in before the shards of vanished states are removed, so the router never sees a
+    # manifest naming a missing shard
+    manifest_path = os.path.join(shard_folder, SHARD_MANIFEST)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump({"source": db_name, "shards": manifest}, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    for shard, entry in previous.items():
+        if shard not in shard_keys and os.path.exists(os.path.join(shard_folder, entry["file"])):
+            os.remove(os.path.join(shard_folder, entry["file"]))
+    record_rows(sum(manifest[shard]["entities"] + manifest[shard]["addresses"] for shard in checked))
+    kept = f", {len(manifest) - len(checked)} of other states kept" if wanted is not None else ""
+    print(f"{len(checked)} shards in {shard_folder}: {built} rebuilt, {len(checked) - built} unchanged{kept}.")
+    return {"source": db_name, "shards": manifest}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the staged CSVs into the SQLite database.")
+    parser.add_argument("--shards", nargs="?", const=SHARD_FOLDER, default=None,
+                        help=f"Also split the database into one database per state (default folder: {SHARD_FOLDER})")
+    parser.add_argument("--states", nargs="+", default=None, help="State codes of the shards to build (default: all)")
+    args = parser.parse_args(argv)
+    create_database()
+    if args.shards:
+        create_shards(shard_folder=args.shards, states=args.states)
+
 if __name__ == "__main__":
-    create_database()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+The lookups of facility_queries over the per-state shards written by setup_database.create_shards.
+
+A lookup in one state (by type in a state, search within a state) goes to that state's shard,
+and one by ZIP code to the shards whose addresses have it (listed in the manifest). The others
+(by NPI, CCN or address_hash, search without a state) go to every shard at once on a thread pool,
+and the answers are merged in the order the single database returns them. Search results hold the
+same rows as on the single database, ranked by bm25 over each shard's own index.
+
+    router = ShardRouter("shards", states=["IL", "WI"])
+    router.by_type("Hospital", state="IL")
+
+A regional node given states opens only their shards; lookups in other states find nothing there.
+The manifest is checked before each lookup, so shards added or removed by a rebuild are picked up,
+and each shard's FacilityQueries notices when its own file is swapped.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from facility_queries import CACHE_SIZE, POOL_SIZE, FacilityQueries, Lookups
+from setup_database import SHARD_FOLDER, SHARD_MANIFEST, load_manifest
+
+FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+
+# Columns the merged answers are sorted by, as in the ORDER BY of each query. Search results are
+# interleaved instead: bm25 scores depend on each shard's own index, so they do not compare.
+MERGE_ORDER = {
+    "npi": ["address_hash"],
+    "ccn": ["entity_id", "address_hash"],
+    "type_state": ["entity_id", "address_hash"],
+    "subtype_state": ["entity_id", "address_hash"],
+    "type_zip": ["entity_id", "address_hash"],
+    "subtype_zip": ["entity_id", "address_hash"],
+    "address": ["entity_id"],
+}
+
+
+def order_key(columns):
+    """Sort key of result rows by columns, with missing values first like SQLite."""
+    return lambda row: tuple((row[column] is not None, row[column]) for column in columns)
+
+
+def interleave(parts):
+    """The first row of every part, then the second of every part, and so on."""
+    rows = []
+    for position in range(max((len(part) for part in parts), default=0)):
+        rows.extend(part[position] for part in parts if position < len(part))
+    return rows
+
+
+def merge_results(name, params, parts):
+    """One answer from the answers of several shards, cut to the lookup's limit."""
+    if len(parts) == 1:
+        return parts[0]
+    if name in MERGE_ORDER:
+        rows = sorted((row for part in parts for row in part), key=order_key(MERGE_ORDER[name]))
+    else:
+        rows = interleave(parts)
+    limit = params.get("limit")
+    return rows[:limit] if limit is not None else rows
+
+
+class ShardRouter(Lookups):
+    """The lookups over a folder of shards, each shard with its own FacilityQueries (pool and cache)."""
+    def __init__(self, shard_folder=SHARD_FOLDER, states=None, pool_size=POOL_SIZE, cache_size=CACHE_SIZE, workers=FANOUT_WORKERS):
+        self.shard_folder = shard_folder
+        self.states = {state.strip().upper() for state in states} if states else None
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.shards = {}
+        self.state_shards = {}
+        self.zip_shards = {}
+        self.fanouts = 0
+        self.manifest_signature = None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+        self._lock = threading.Lock()
+        self.check_manifest()
+
+    def check_manifest(self):
+        """Opens the shards a rebuild added and closes the ones it removed."""
+        stat = os.stat(os.path.join(self.shard_folder, SHARD_MANIFEST))
+        signature = stat.st_ino, stat.st_size, stat.st_mtime_ns
+        if signature == self.manifest_signature:
+            return
+        with self._lock:
+            if signature == self.manifest_signature:
+                return
+            shards, state_shards, zip_shards = {}, {}, {}
+            for shard, entry in load_manifest(self.shard_folder)["shards"].items():
+                state_code = entry["state_code"]
+                if self.states is not None and (state_code or shard).upper() not in self.states:
+                    continue
+                path = os.path.join(self.shard_folder, entry["file"])
+                current = self.shards.get(shard)
+                shards[shard] = current if current is not None and current.db_path == path else FacilityQueries(path, self.pool_size, self.cache_size)
+                if state_code:
+                    state_shards[state_code] = shard
+                for zip_code in entry.get("zip_codes", []):
+                    zip_shards.setdefault(zip_code, []).append(shard)
+            for shard, queries in self.shards.items():
+                if shards.get(shard) is not queries:
+                    queries.close()
+            self.shards, self.state_shards, self.zip_shards = shards, state_shards, zip_shards
+            self.manifest_signature = signature
+
+    def route(self, name, params):
+        """The shards a lookup goes to: those of its state or ZIP code when it has one, else every shard."""
+        shards = self.shards
+        if params.get("state") is not None:
+            keys = [self.state_shards.get(params["state"])]
+        elif params.get("zip") is not None:
+            keys = self.zip_shards.get(params["zip"], [])
+        else:
+            return list(shards.values())
+        return [shards[key] for key in keys if key in shards]
+
+    def cached(self, name, **params):
+        """The merged answer when every shard the lookup goes to has its part cached, else None."""
+        self.check_manifest()
+        parts = []
+        for shard in self.route(name, params):
+            part = shard.cached(name, **params)
+            if part is None:
+                return None
+            parts.append(part)
+        return merge_results(name, params, parts)
+
+    def query(self, name, **params):
+        """Runs a lookup on its shards, in parallel when there are several, and merges the answers."""
+        shards = self.route(name, params)
+        if len(shards) <= 1:
+            return merge_results(name, params, [shard.run(name, **params) for shard in shards])
+        with self._lock:
+            self.fanouts += 1
+        futures = [self.executor.submit(shard.run, name, **params) for shard in shards]
+        return merge_results(name, params, [future.result() for future in futures])
+
+    def stats(self):
+        shard_stats = [queries.stats() for queries in self.shards.values()]
+        totals = {key: sum(stats[key] for stats in shard_stats) for key in ["cache_entries", "cache_hits", "cache_misses", "invalidations", "connections_opened"]}
+        return {**totals, "pool_size": self.pool_size, "shards": len(self.shards), "fanouts": self.fanouts}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for queries in self.shards.values():
+            queries.close()
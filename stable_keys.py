@@ -0,0 +1,181 @@
+"""
+Deterministic 63-bit keys (entity_id, address_id, address_hash), audited for collisions, and the
+migration from the 9-digit md5 ids of earlier builds.
+"""
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from dtype_policy import KEY
+
+# The SipHash key: changing it changes every key, like changing the scheme
+HASH_KEY = "fashia-keys-v001"
+KEY_BITS = 63
+LEGACY_MODULUS = 10**9
+# Old id -> new id of every key written by this build, for consumers of the 9-digit ids
+KEY_MIGRATION_FILE = "datasets/output/key_migration.csv"
+MIGRATION_COLUMNS = ["key", "old_id", "new_id"]
+# Colliding keys listed in the audit error
+SHOWN_COLLISIONS = 5
+# Columns holding stable keys. JSON output writes them as strings: a JavaScript number holds 53 bits.
+KEY_ID_COLUMNS = ["entity_id", "address_id", "address_hash"]
+
+
+class KeyCollisionError(ValueError):
+    """Two different sources hashed to the same key."""
+
+
+def source_strings(*parts, separator="|"):
+    """
+    Joins columns (or scalars) position by position into the source strings of their keys, the
+    way an f-string would format each value. Indexed like the first Series among the parts.
+    """
+    index = next((part.index for part in parts if isinstance(part, pd.Series)), None)
+    columns = [pd.Series(np.asarray(part, dtype=object), dtype=object).astype(str) if np.ndim(part) else str(part) for part in parts]
+    sources = columns[0]
+    for column in columns[1:]:
+        sources = sources + separator + column
+    if index is not None:
+        sources.index = index
+    return sources
+
+
+def address_strings(address, city, state, zip_code, missing_zip=""):
+    """
+    The "address|city|state|zip5" string of every row as written (what the 9-digit ids hashed).
+    Missing ZIP codes become missing_zip, or are formatted like the rest with missing_zip=None.
+    """
+    zip_code = pd.Series(np.asarray(zip_code, dtype=object), dtype=object)
+    zip5 = zip_code.astype(str).str[:5]
+    if missing_zip is not None:
+        zip5 = zip5.where(zip_code.notna(), missing_zip)
+    return source_strings(address, city, state, zip5)
+
+
+def address_id_sources(owner, address, city, state, zip_code):
+    """The source of address_id: the CCN or NPI the address belongs to and the address as written."""
+    return source_strings(owner, address_strings(address, city, state, zip_code))
+
+
+def stable_keys(sources):
+    """The keys of a column of source strings, as an Int64 Series aligned to it."""
+    sources = pd.Series(sources, dtype=object)
+    hashes = pd.util.hash_array(sources.astype(str).to_numpy(), hash_key=HASH_KEY, categorize=False)
+    return pd.Series((hashes >> np.uint64(64 - KEY_BITS)).astype(np.int64), index=sources.index, dtype=KEY)
+
+
+def stable_key(source):
+    """The key of one source string (the row-by-row callers)."""
+    hashes = pd.util.hash_array(np.array([str(source)], dtype=object), hash_key=HASH_KEY, categorize=False)
+    return int(hashes[0] >> np.uint64(64 - KEY_BITS))
+
+
+def legacy_key(source):
+    """The 9-digit md5 id the importers gave the source before stable keys."""
+    return int(hashlib.md5(str(source).encode()).hexdigest(), 16) % LEGACY_MODULUS
+
+
+def legacy_keys(sources):
+    sources = pd.Series(sources, dtype=object)
+    codes, uniques = pd.factorize(sources.astype(str))
+    ids = np.array([legacy_key(source) for source in uniques], dtype=np.int64)
+    return pd.Series(ids[codes], index=sources.index, dtype=KEY)
+
+
+def legacy_address_ids(owner, address, city, state, zip_code):
+    """The 9-digit address_id of every row: md5 of the owner and the md5 of the address string."""
+    pairs = pd.DataFrame({
+        "owner": source_strings(owner).to_numpy(),
+        "address": address_strings(address, city, state, zip_code).to_numpy()
+    })
+    codes, uniques = pd.factorize(pd.MultiIndex.from_frame(pairs))
+    ids = np.array([
+        legacy_key(owner + hashlib.md5(address.encode()).hexdigest()) for owner, address in uniques
+    ], dtype=np.int64)
+    return pd.Series(ids[codes], dtype=KEY)
+
+
+def keys_as_strings(row):
+    """A record (dict) with its key columns as strings, for JSON output; missing keys stay null."""
+    return {column: str(value) if column in KEY_ID_COLUMNS and value is not None else value for column, value in row.items()}
+
+
+def audit_keys(name, keys, sources):
+    """
+    Raises KeyCollisionError when two different sources share a key, naming the first few.
+    The same source may appear any number of times. Returns the number of distinct keys.
+    """
+    pairs = pd.DataFrame({"key": pd.Series(keys, dtype=KEY).to_numpy(), "source": pd.Series(sources, dtype=object).astype(str).to_numpy()})
+    pairs = pairs.dropna(subset=["key"]).drop_duplicates()
+    colliding = pairs[pairs.duplicated("key", keep=False)]
+    if not colliding.empty:
+        examples = colliding.groupby("key")["source"].apply(list).head(SHOWN_COLLISIONS)
+        described = "; ".join(f"{key}: {', '.join(sources)}" for key, sources in examples.items())
+        raise KeyCollisionError(f"{colliding['key'].nunique()} {name} values shared by different sources ({described})")
+    return len(pairs)
+
+
+def key_migration(name, old_ids, new_ids):
+    """The distinct old id -> new id rows of one key."""
+    migration = pd.DataFrame({"key": name, "old_id": pd.Series(old_ids, dtype=KEY).to_numpy(), "new_id": pd.Series(new_ids, dtype=KEY).to_numpy()})
+    return migration.dropna().drop_duplicates()
+
+
+def unambiguous(migration):
+    """Leaves out the old ids that led to several new ones (a 9-digit collision: nothing tells which was meant)."""
+    migration = migration.drop_duplicates()
+    return migration[~migration.duplicated(["key", "old_id"], keep=False)]
+
+
+def save_key_migration(migrations, path=KEY_MIGRATION_FILE):
+    """Appends the migration rows to the build's migration file."""
+    migrations = unambiguous(pd.concat(migrations, ignore_index=True) if isinstance(migrations, list) else migrations)
+    migrations = migrations[MIGRATION_COLUMNS]
+    if os.path.exists(path):
+        migrations.to_csv(path, mode="a", index=False, header=False)
+    else:
+        migrations.to_csv(path, index=False)
+
+
+def load_key_migration(path=KEY_MIGRATION_FILE, key=None):
+    """The unambiguous rows of a migration file (of one key when given); empty without the file."""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=MIGRATION_COLUMNS).astype({"old_id": KEY, "new_id": KEY})
+    migration = pd.read_csv(path, dtype={"key": str, "old_id": KEY, "new_id": KEY})
+    if key is not None:
+        migration = migration[migration["key"] == key]
+    return unambiguous(migration)
+
+
+class KeyLedger:
+    """
+    The keys an importer hands out during a run: their sources, audited together at the end so
+    collisions between files are caught too, and their old ids for the migration file.
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self.migrations = []
+
+    def clear(self):
+        self.sources.clear()
+        self.migrations.clear()
+
+    def add(self, name, keys, sources, legacy_ids=()):
+        """Records keys with their source strings and, for each earlier scheme, their old ids."""
+        keys = pd.Series(keys, dtype=KEY).to_numpy()
+        self.sources.setdefault(name, []).append(pd.DataFrame({"key": keys, "source": pd.Series(sources, dtype=object).to_numpy()}))
+        for old_ids in legacy_ids:
+            self.migrations.append(key_migration(name, old_ids, keys))
+
+    def audit(self):
+        """audit_keys over everything recorded; returns the number of distinct keys by name."""
+        counts = {}
+        for name, frames in self.sources.items():
+            recorded = pd.concat(frames, ignore_index=True)
+            counts[name] = audit_keys(name, recorded["key"], recorded["source"])
+        return counts
+
+    def save(self, path=KEY_MIGRATION_FILE):
+        if self.migrations:
+            save_key_migration(self.migrations, path)
@@ -0,0 +1,494 @@
+"""
+Synthetic versions of the seven CMS facility files and of the raw and filtered NPPES files, with
+the column names the importers read, for benchmarking the pipeline at any scale.
+
+    python synthetic_data.py --scale 10 --folder datasets
+
+Scale 1 is about 1% of the national CMS files and 0.1% of the NPPES file: at scale 100 the CMS
+files have their national size and the NPPES organization rows already keep the row-by-row NPPES
+import busy for minutes.
+
+What makes the data realistic enough to benchmark with:
+- addresses sit at real ZIP codes, so states and geocoding follow the real density;
+- some facilities share an address: IRF units and hospital-within-hospital LTCHs sit at a
+  hospital's address, and a few medical campuses host many facilities;
+- most CMS facilities have their own NPPES organization record (same name and address, written
+  the NPPES way: upper case, spelled-out street suffixes, ZIP+4);
+- organizations list one taxonomy code most of the time and up to fifteen rarely, repeat a code
+  now and then (one per licensing state) and concentrate on a few common facility types;
+- the raw NPPES file also holds individuals, deactivated NPIs and columns the filter drops.
+"""
+import argparse
+import math
+import os
+import time
+import numpy as np
+import pandas as pd
+from facilities_importer import column_mapping, file_rules_mapping, files
+from filter_nppes_data import required_columns as nppes_columns
+from zip_centroid_geocoder import ZIP_CENTROIDS_FILE
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Raw NPPES rows at scale 1; the CMS files are sized in CMS_DATASETS
+NPPES_ROWS = 9000
+# Shares of the raw NPPES rows
+ORGANIZATION_SHARE = 0.22
+DEACTIVATED_SHARE = 0.03
+# Share of CMS facilities with their own NPPES organization record
+FACILITY_NPI_SHARE = 0.6
+# Share of CMS facilities on a shared medical campus, and campuses per facility
+CAMPUS_SHARE = 0.12
+CAMPUSES_PER_FACILITY = 0.03
+# Share of other organizations located at a CMS facility's address
+COLOCATED_ORGANIZATION_SHARE = 0.25
+# Missing address fields, which the CMS import drops
+MISSING_ADDRESS_SHARE = 0.005
+# Distribution of the number of taxonomy codes of an organization (1, 2, 3, ...)
+TAXONOMY_COUNT_WEIGHTS = [0.72, 0.15, 0.06, 0.03, 0.015, 0.01, 0.005, 0.003, 0.002, 0.002, 0.001, 0.001, 0.001, 0.0005, 0.0005]
+# Share of multi-taxonomy rows repeating their first code under a second license
+DUPLICATE_TAXONOMY_SHARE = 0.05
+
+NPPES_RAW_FILE = "NPPES_file.csv"
+NPPES_FILTERED_FILE = os.path.join("filtered", "nppes_filtered_data.csv")
+
+# Per CMS file: rows at scale 1 (1% of the national file), the CCN, name and address columns,
+# the CCN sequence range of the provider type, the facility's NUCC code, how names are built
+# and whether the file is written in upper case like the CMS download
+CMS_DATASETS = {
+    "dialysis_facility_dataset.csv": {
+        "rows": 76, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Facility Name",
+        "address_column": "Address Line 1", "line_2_column": "Address Line 2", "ccn_start": 2300,
+        "taxonomy": "261QE0700X", "kind": "Dialysis", "chains": ["DaVita", "Fresenius Kidney Care"], "chain_share": 0.7
+    },
+    "home_health_agency_dataset.csv": {
+        "rows": 116, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Provider Name",
+        "address_column": "Address", "ccn_start": 7000, "taxonomy": "251E00000X", "kind": "Home Health",
+        "chains": ["Amedisys", "Enhabit"], "chain_share": 0.1
+    },
+    "hospice_dataset.csv": {
+        "rows": 69, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Facility Name",
+        "address_column": "Address Line 1", "line_2_column": "Address Line 2", "ccn_start": 1500,
+        "taxonomy": "251G00000X", "kind": "Hospice", "chains": ["VITAS Healthcare", "Gentiva Hospice"], "chain_share": 0.1
+    },
+    "hospital_general_information_dataset.csv": {
+        "rows": 54, "ccn_column": "Facility ID", "name_column": "Facility Name", "address_column": "Address",
+        "ccn_start": 1, "taxonomy": "282N00000X", "kind": "Hospital", "upper": True
+    },
+    "inpatient_rehabilitation_facility_dataset.csv": {
+        "rows": 12, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Provider Name",
+        "address_column": "Address Line 1", "line_2_column": "Address Line 2", "ccn_start": 3025,
+        "taxonomy": "283X00000X", "kind": "Rehabilitation Hospital"
+    },
+    "long_term_care_hospital_dataset.csv": {
+        "rows": 4, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Provider Name",
+        "address_column": "Address Line 1", "line_2_column": "Address Line 2", "ccn_start": 2000,
+        "taxonomy": "282E00000X", "kind": "Specialty Hospital"
+    },
+    "nursing_home_dataset.csv": {
+        "rows": 147, "ccn_column": "CMS Certification Number (CCN)", "name_column": "Provider Name",
+        "address_column": "Provider Address", "ccn_start": 5000, "taxonomy": "314000000X",
+        "kind": "Nursing and Rehabilitation Center", "upper": True
+    }
+}
+
+# Hospital types of the hospital file, their share and CCN sequence start
+HOSPITAL_TYPES = {
+    "Acute Care Hospitals": (0.58, 1),
+    "Critical Access Hospitals": (0.25, 1300),
+    "Psychiatric": (0.11, 4000),
+    "Childrens": (0.018, 3300),
+    "Acute Care - Veterans Administration": (0.025, 1),
+    "Acute Care - Department of Defense": (0.006, 1)
+}
+# Share of IRFs that are hospital units (CCN with a T) and of LTCHs inside a hospital
+IRF_UNIT_SHARE = 0.75
+LTCH_IN_HOSPITAL_SHARE = 0.4
+# Share of home health agencies offering each service
+HOME_HEALTH_SERVICES = {
+    "Offers Nursing Care Services": 0.99,
+    "Offers Physical Therapy Services": 0.97,
+    "Offers Occupational Therapy Services": 0.9,
+    "Offers Speech Pathology Services": 0.85,
+    "Offers Medical Social Services": 0.8,
+    "Offers Home Health Aide Services": 0.95
+}
+
+# SSA state codes opening every CCN
+STATE_CCN_PREFIX = {
+    "AL": "01", "AK": "02", "AZ": "03", "AR": "04", "CA": "05", "CO": "06", "CT": "07", "DE": "08", "DC": "09",
+    "FL": "10", "GA": "11", "HI": "12", "ID": "13", "IL": "14", "IN": "15", "IA": "16", "KS": "17", "KY": "18",
+    "LA": "19", "ME": "20", "MD": "21", "MA": "22", "MI": "23", "MN": "24", "MS": "25", "MO": "26", "MT": "27",
+    "NE": "28", "NV": "29", "NH": "30", "NJ": "31", "NM": "32", "NY": "33", "NC": "34", "ND": "35", "OH": "36",
+    "OK": "37", "OR": "38", "PA": "39", "PR": "40", "RI": "41", "SC": "42", "SD": "43", "TN": "44", "TX": "45",
+    "UT": "46", "VT": "47", "VA": "49", "WA": "50", "WV": "51", "WI": "52", "WY": "53"
+}
+
+# Taxonomy codes of organizations without a CMS facility: the common ones with their share, the
+# rest of the NPPES dictionary (Zipf distributed) and group practice codes missing from it
+COMMON_TAXONOMIES = {
+    "3336C0003X": 0.12, "332B00000X": 0.08, "261QM1300X": 0.06, "261QP2300X": 0.05, "291U00000X": 0.04,
+    "341600000X": 0.03, "251E00000X": 0.03, "261QR1300X": 0.02, "261QF0400X": 0.02, "310400000X": 0.02
+}
+DICTIONARY_TAXONOMY_SHARE = 0.3
+GROUP_PRACTICE_TAXONOMIES = ["193200000X", "193400000X", "207Q00000X", "208D00000X", "207R00000X", "225100000X", "363L00000X"]
+INDIVIDUAL_TAXONOMIES = ["207Q00000X", "207R00000X", "363L00000X", "225100000X", "1223G0001X", "367500000X", "163W00000X", "183500000X"]
+
+# Columns of the raw NPPES file that the filter drops (the download has about 330)
+NPPES_EXTRA_COLUMNS = [
+    "Replacement NPI",
+    "Employer Identification Number (EIN)",
+    "Provider Other Organization Name",
+    "Provider Other Organization Name Type Code",
+    "Provider First Line Business Mailing Address",
+    "Provider Business Mailing Address City Name",
+    "Provider Business Mailing Address State Name",
+    "Provider Business Mailing Address Postal Code",
+    "Provider Business Practice Location Address Telephone Number",
+    "Provider Enumeration Date",
+    "Provider Gender Code",
+    "Is Sole Proprietor",
+    "Is Organization Subpart",
+    "Parent Organization LBN"
+]
+
+STREET_NAMES = [
+    "Main", "Oak", "Maple", "Cedar", "Pine", "Elm", "Washington", "Lake", "Hill", "Park", "Church", "Lincoln",
+    "Jefferson", "Madison", "Franklin", "Highland", "Center", "River", "Spring", "Walnut", "Sunset", "Ridge",
+    "Meadow", "Forest", "Jackson", "College", "Hospital", "Medical Center", "Mill", "Broad", "Market", "Union",
+    "Valley", "Chestnut", "Willow", "Adams", "Liberty", "Harbor", "Prospect", "Wilson"
+]
+# Street suffixes as CMS abbreviates them, and as NPPES often spells them out
+STREET_SUFFIXES = {"St": "STREET", "Ave": "AVENUE", "Rd": "ROAD", "Blvd": "BOULEVARD", "Dr": "DRIVE", "Ln": "LANE", "Way": "WAY", "Pkwy": "PARKWAY", "Hwy": "HIGHWAY", "Ct": "COURT"}
+DIRECTIONS = ["N", "S", "E", "W"]
+SUITE_FORMATS = ["Suite {}", "Ste {}", "Unit {}", "Bldg {}", "Floor {}"]
+CITY_PREFIXES = ["Spring", "Oak", "Maple", "River", "Cedar", "Fair", "Green", "Lake", "Mill", "Ash", "Clear", "West", "North", "Stone", "Glen", "Mount"]
+CITY_SUFFIXES = ["field", "ville", "ton", "wood", "dale", "port", "burg", "view", "haven", "ford"]
+NAME_WORDS = ["Saint Mary", "Mercy", "Riverside", "Valley", "Lakeview", "Good Samaritan", "Memorial", "Community", "Regional", "University", "Providence", "Baptist", "Methodist", "Sunrise", "Heritage", "Pinecrest", "Highland", "Summit"]
+ORGANIZATION_KINDS = ["Family Medicine", "Pharmacy", "Medical Supply", "Physical Therapy", "Imaging Center", "Urgent Care", "Laboratory", "Ambulance Service", "Pediatrics", "Health Partners"]
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William", "Barbara", "Maria", "Wei", "Priya", "Ahmed"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Nguyen", "Patel", "Kim", "Lee", "Walker", "Hall"]
+
+
+def scaled_rows(base_rows, scale):
+    """Rows of a file at the given scale; every file keeps at least one row."""
+    return max(1, int(round(base_rows * scale)))
+
+
+def pick(rng, values, size, weights=None):
+    """size values drawn from values, uniformly or by weights."""
+    values = np.asarray(values, dtype=object)
+    probabilities = None if weights is None else np.asarray(weights, dtype=float) / np.sum(weights)
+    return values[rng.choice(len(values), size=size, p=probabilities)]
+
+
+def zipf_weights(count, exponent=1.1):
+    return 1.0 / np.arange(1, count + 1) ** exponent
+
+
+def load_zip_codes(path=os.path.join(ROOT, ZIP_CENTROIDS_FILE)):
+    """The bundled ZIP centroids of the states that have a CCN prefix."""
+    centroids = pd.read_csv(path, dtype={"zip_code": str})
+    return centroids[centroids["state_code"].isin(STATE_CCN_PREFIX)].reset_index(drop=True)
+
+
+def random_addresses(rng, zip_codes, count):
+    """
+    count street addresses at random ZIP codes, in CMS spelling. The city follows from the ZIP3,
+    so every ZIP of an area shares its city name.
+    """
+    zips = zip_codes.iloc[rng.integers(0, len(zip_codes), count)].reset_index(drop=True)
+    # Log-uniform house numbers: low numbers are the most common, like on real streets
+    numbers = pd.Series(np.exp(rng.uniform(0, np.log(20000), count)).astype(int) + 1).astype(str)
+    directions = pd.Series(pick(rng, DIRECTIONS, count)) + " "
+    directions[rng.random(count) > 0.2] = ""
+    suffixes = pd.Series(pick(rng, list(STREET_SUFFIXES), count))
+    line_1 = numbers + " " + directions + pd.Series(pick(rng, STREET_NAMES, count)) + " " + suffixes
+
+    suites = pd.Series([form.format(number) for form, number in zip(pick(rng, SUITE_FORMATS, count), rng.integers(1, 999, count))])
+    line_2 = suites.where(rng.random(count) < 0.2)
+
+    zip3 = zips["zip_code"].str[:3].astype(int)
+    city = (pd.Series(CITY_PREFIXES).iloc[zip3 % len(CITY_PREFIXES)].reset_index(drop=True)
+            + pd.Series(CITY_SUFFIXES).iloc[(zip3 // len(CITY_PREFIXES)) % len(CITY_SUFFIXES)].reset_index(drop=True))
+    return pd.DataFrame({
+        "line_1": line_1,
+        "line_2": line_2,
+        "city": city,
+        "state": zips["state_code"],
+        "zip5": zips["zip_code"],
+        "zip4": pd.Series(rng.integers(1, 9999, count)).astype(str).str.zfill(4),
+        "suffix": suffixes
+    })
+
+
+def facility_names(rng, dataset, addresses):
+    """Names like 'Mercy Springfield Dialysis', with the chain share going to the big chains."""
+    count = len(addresses)
+    places = pd.Series(pick(rng, NAME_WORDS, count))
+    from_city = rng.random(count) < 0.4
+    places[from_city] = addresses["city"][from_city].to_numpy()
+    names = places + " " + dataset["kind"]
+    chains = dataset.get("chains")
+    if chains:
+        in_chain = rng.random(count) < dataset["chain_share"]
+        names[in_chain] = pick(rng, chains, int(in_chain.sum())) + " " + addresses["city"][in_chain].to_numpy()
+    return names
+
+
+def assign_ccns(facilities, marker=None):
+    """
+    CCNs: the state's SSA prefix, then a sequence per state starting at the provider type's range,
+    or the marker (T for hospital units) and a three digit sequence.
+    """
+    prefix = facilities["state"].map(STATE_CCN_PREFIX)
+    sequence = facilities.groupby(["state", "sequence_start"]).cumcount()
+    if marker is not None:
+        return prefix + marker + (sequence + 1).astype(str).str.zfill(3)
+    return prefix + (facilities["sequence_start"] + sequence).astype(str).str.zfill(4)
+
+
+def generate_facilities(rng, zip_codes, scale):
+    """
+    One row per CMS facility with its file, name, CCN, address, NUCC code and file-specific
+    fields. Hospitals come first, so units and campuses can sit at their addresses.
+    """
+    counts = {name: scaled_rows(dataset["rows"], scale) for name, dataset in CMS_DATASETS.items()}
+    total = sum(counts.values())
+    campuses = random_addresses(rng, zip_codes, max(1, int(math.ceil(total * CAMPUSES_PER_FACILITY))))
+    campus_weights = zipf_weights(len(campuses))
+
+    frames = []
+    hospital_file = "hospital_general_information_dataset.csv"
+    order = [hospital_file] + [name for name in CMS_DATASETS if name != hospital_file]
+    hospitals = None
+    for file in order:
+        dataset = CMS_DATASETS[file]
+        count = counts[file]
+        addresses = random_addresses(rng, zip_codes, count)
+        on_campus = rng.random(count) < CAMPUS_SHARE
+        addresses[on_campus] = campuses.iloc[rng.choice(len(campuses), int(on_campus.sum()), p=campus_weights / campus_weights.sum())].to_numpy()
+
+        facilities = addresses
+        facilities["file"] = file
+        facilities["taxonomy"] = dataset["taxonomy"]
+        facilities["sequence_start"] = dataset["ccn_start"]
+        marker = None
+
+        if file == hospital_file:
+            types = list(HOSPITAL_TYPES)
+            facilities["Hospital Type"] = pick(rng, types, count, [HOSPITAL_TYPES[name][0] for name in types])
+            facilities["sequence_start"] = facilities["Hospital Type"].map({name: start for name, (_, start) in HOSPITAL_TYPES.items()})
+            rules = file_rules_mapping[file]["SubRules"]
+            codes = {name: (rule[0] if isinstance(rule, list) else rule)["nucc_code"] for name, rule in rules.items()}
+            facilities["taxonomy"] = facilities["Hospital Type"].map(codes).replace("N/A", dataset["taxonomy"]).fillna(dataset["taxonomy"])
+        elif file in ("inpatient_rehabilitation_facility_dataset.csv", "long_term_care_hospital_dataset.csv"):
+            share = IRF_UNIT_SHARE if file.startswith("inpatient") else LTCH_IN_HOSPITAL_SHARE
+            in_hospital = rng.random(count) < share
+            columns = list(campuses.columns)
+            facilities.loc[in_hospital, columns] = hospitals[columns].iloc[rng.integers(0, len(hospitals), int(in_hospital.sum()))].to_numpy()
+            if file.startswith("inpatient"):
+                # Units get a T in their CCN and the unit's NUCC code
+                marker = np.where(in_hospital, "T", "")
+                facilities["taxonomy"] = np.where(in_hospital, "273Y00000X", dataset["taxonomy"])
+        elif file == "home_health_agency_dataset.csv":
+            for column, share in HOME_HEALTH_SERVICES.items():
+                facilities[column] = np.where(rng.random(count) < share, "Yes", "No")
+
+        facilities["ccn"] = assign_ccns(facilities)
+        if marker is not None:
+            units = marker == "T"
+            facilities.loc[units, "ccn"] = assign_ccns(facilities[units], marker="T")
+        if file == hospital_file:
+            # Federal hospitals end their CCN with an F
+            federal = facilities["Hospital Type"].str.startswith("Acute Care - ")
+            facilities.loc[federal, "ccn"] = assign_ccns(facilities[federal], marker="") + "F"
+            hospitals = facilities
+        facilities["name"] = facility_names(rng, dataset, facilities)
+        frames.append(facilities)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def cms_dataset(facilities, file, rng):
+    """The CMS file as downloaded: its own column names, casing and a few missing addresses."""
+    dataset = CMS_DATASETS[file]
+    rows = facilities[facilities["file"] == file].reset_index(drop=True)
+    upper = dataset.get("upper", False)
+    line_1, line_2 = rows["line_1"], rows["line_2"]
+    if "line_2_column" not in dataset:
+        line_1 = (line_1 + " " + line_2.fillna("")).str.strip()
+    if upper:
+        line_1, line_2 = line_1.str.upper(), line_2.str.upper()
+    frame = pd.DataFrame({
+        dataset["ccn_column"]: rows["ccn"],
+        dataset["name_column"]: rows["name"].str.upper() if upper else rows["name"],
+        dataset["address_column"]: line_1
+    })
+    if "line_2_column" in dataset:
+        frame[dataset["line_2_column"]] = line_2
+    frame[column_mapping["City"][0]] = rows["city"].str.upper() if upper else rows["city"]
+    frame[column_mapping["State"][0]] = rows["state"]
+    frame[column_mapping["ZipCode"][0]] = rows["zip5"]
+    frame["County/Parish"] = rows["city"].str.upper() + " COUNTY"
+    frame["Telephone Number"] = pd.Series(rng.integers(2002000000, 9899999999, len(rows))).astype(str)
+    for column in ("Hospital Type",) + tuple(HOME_HEALTH_SERVICES):
+        if column in rows and rows[column].notna().any():
+            frame[column] = rows[column]
+
+    missing = rng.random(len(frame)) < MISSING_ADDRESS_SHARE
+    frame.loc[missing, rng.choice([dataset["address_column"], column_mapping["City"][0], column_mapping["ZipCode"][0]])] = None
+    return frame
+
+
+def nppes_address(addresses, rng):
+    """Addresses as NPPES writes them: upper case, suffixes often spelled out, mostly ZIP+4."""
+    line_1 = addresses["line_1"]
+    spelled = rng.random(len(addresses)) < 0.3
+    suffixes = addresses["suffix"].map(STREET_SUFFIXES)
+    line_1 = line_1.where(~spelled, line_1.str.rsplit(" ", n=1).str[0] + " " + suffixes)
+    postal = addresses["zip5"].where(rng.random(len(addresses)) < 0.4, addresses["zip5"] + addresses["zip4"])
+    return line_1.str.upper(), addresses["line_2"].str.upper(), addresses["city"].str.upper(), addresses["state"], postal
+
+
+def organization_taxonomies(rng, count):
+    """Taxonomy codes of organizations without a CMS facility."""
+    dictionary = pd.read_csv(os.path.join(ROOT, "NPPES_dictionary.csv"))["NUCC Code"].tolist()
+    common = list(COMMON_TAXONOMIES)
+    rest = 1 - sum(COMMON_TAXONOMIES.values())
+    codes = (common + dictionary + GROUP_PRACTICE_TAXONOMIES)
+    weights = np.concatenate([
+        list(COMMON_TAXONOMIES.values()),
+        zipf_weights(len(dictionary)) / zipf_weights(len(dictionary)).sum() * DICTIONARY_TAXONOMY_SHARE,
+        np.full(len(GROUP_PRACTICE_TAXONOMIES), (rest - DICTIONARY_TAXONOMY_SHARE) / len(GROUP_PRACTICE_TAXONOMIES))
+    ])
+    return pick(rng, codes, count, weights)
+
+
+def random_dates(rng, count, first_year=2007, last_year=2024):
+    days = rng.integers(0, (last_year - first_year + 1) * 365, count)
+    return (pd.Timestamp(f"{first_year}-01-01") + pd.to_timedelta(days, unit="D")).strftime("%m/%d/%Y")
+
+
+def generate_nppes(rng, zip_codes, facilities, scale):
+    """The raw NPPES file: organizations (facility records first), individuals and deactivated NPIs."""
+    rows = scaled_rows(NPPES_ROWS, scale)
+    own_records = facilities[rng.random(len(facilities)) < FACILITY_NPI_SHARE].reset_index(drop=True)
+    organizations = max(int(round(rows * ORGANIZATION_SHARE)), len(own_records))
+    rows = max(rows, organizations)
+    others = organizations - len(own_records)
+
+    # Addresses: facility records at their facility, some organizations at a facility's address
+    addresses = pd.concat([own_records, random_addresses(rng, zip_codes, rows - len(own_records))], ignore_index=True)
+    colocated = np.zeros(rows, dtype=bool)
+    colocated[len(own_records):organizations] = rng.random(others) < COLOCATED_ORGANIZATION_SHARE
+    columns = ["line_1", "line_2", "city", "state", "zip5", "zip4", "suffix"]
+    addresses.loc[colocated, columns] = facilities[columns].iloc[rng.integers(0, len(facilities), int(colocated.sum()))].to_numpy()
+    line_1, line_2, city, state, postal = nppes_address(addresses, rng)
+
+    is_organization = np.arange(rows) < organizations
+    organization_names = pd.concat([
+        own_records["name"],
+        pd.Series(pick(rng, NAME_WORDS, others)) + " " + pd.Series(pick(rng, ORGANIZATION_KINDS, others)) + pd.Series(pick(rng, ["", " LLC", " INC", " PC"], others))
+    ], ignore_index=True).str.upper()
+
+    nppes = pd.DataFrame({
+        "NPI": (1_000_000_000 + rng.choice(999_999_999, rows, replace=False)).astype(str),
+        "Entity Type Code": np.where(is_organization, "2", "1"),
+        "Provider Organization Name (Legal Business Name)": organization_names.reindex(range(rows)),
+        "Provider Last Name (Legal Name)": pd.Series(pick(rng, LAST_NAMES, rows)).str.upper().where(~is_organization),
+        "Provider First Name": pd.Series(pick(rng, FIRST_NAMES, rows)).str.upper().where(~is_organization),
+        "Provider Middle Name": pd.Series(pick(rng, list("ABCDEJKLMR"), rows)).where(~is_organization & (rng.random(rows) < 0.5)),
+        "Provider First Line Business Practice Location Address": line_1,
+        "Provider Second Line Business Practice Location Address": line_2,
+        "Provider Business Practice Location Address City Name": city,
+        "Provider Business Practice Location Address State Name": state,
+        "Provider Business Practice Location Address Postal Code": postal,
+        "Provider Business Practice Location Address Country Code (If outside U.S.)": "US",
+        "Last Update Date": random_dates(rng, rows),
+        "NPI Deactivation Date": pd.Series(random_dates(rng, rows, 2015)).where(rng.random(rows) < DEACTIVATED_SHARE),
+        "Certification Date": pd.Series(random_dates(rng, rows, 2016)).where(~is_organization & (rng.random(rows) < 0.4)),
+    })
+
+    # Taxonomy codes: facility records start with their facility's code
+    taxonomy_counts = rng.choice(len(TAXONOMY_COUNT_WEIGHTS), rows, p=np.asarray(TAXONOMY_COUNT_WEIGHTS) / sum(TAXONOMY_COUNT_WEIGHTS)) + 1
+    taxonomy_counts[~is_organization] = rng.choice([1, 2], int((~is_organization).sum()), p=[0.9, 0.1])
+    repeated = (taxonomy_counts > 1) & (rng.random(rows) < DUPLICATE_TAXONOMY_SHARE)
+    for number in range(1, len(TAXONOMY_COUNT_WEIGHTS) + 1):
+        listed = taxonomy_counts >= number
+        codes = np.where(is_organization, organization_taxonomies(rng, rows), pick(rng, INDIVIDUAL_TAXONOMIES, rows))
+        if number == 1:
+            codes[:len(own_records)] = own_records["taxonomy"].to_numpy()
+            first_codes = codes
+        elif number == 2:
+            codes = np.where(repeated, first_codes, codes)
+        licensed = listed & (~is_organization | (rng.random(rows) < 0.3))
+        nppes[f"Healthcare Provider Taxonomy Code_{number}"] = pd.Series(codes).where(listed)
+        nppes[f"Provider License Number_{number}"] = pd.Series(rng.integers(10000, 99999999, rows)).astype(str).where(licensed)
+        nppes[f"Provider License Number State Code_{number}"] = state.where(licensed)
+        nppes[f"Healthcare Provider Primary Taxonomy Switch_{number}"] = pd.Series("Y" if number == 1 else "N", index=nppes.index).where(listed)
+
+    nppes["Replacement NPI"] = None
+    nppes["Employer Identification Number (EIN)"] = None
+    nppes["Provider Other Organization Name"] = None
+    nppes["Provider Other Organization Name Type Code"] = None
+    nppes["Provider First Line Business Mailing Address"] = line_1
+    nppes["Provider Business Mailing Address City Name"] = city
+    nppes["Provider Business Mailing Address State Name"] = state
+    nppes["Provider Business Mailing Address Postal Code"] = postal
+    nppes["Provider Business Practice Location Address Telephone Number"] = pd.Series(rng.integers(2002000000, 9899999999, rows)).astype(str)
+    nppes["Provider Enumeration Date"] = random_dates(rng, rows, 2005)
+    nppes["Provider Gender Code"] = pd.Series(pick(rng, ["M", "F"], rows)).where(~is_organization)
+    nppes["Is Sole Proprietor"] = np.where(is_organization, None, "N")
+    nppes["Is Organization Subpart"] = np.where(is_organization, "N", None)
+    nppes["Parent Organization LBN"] = None
+
+    # Shuffle, so facility records are spread through the file like in the download
+    nppes = nppes[nppes_columns + NPPES_EXTRA_COLUMNS]
+    return nppes.sample(frac=1, random_state=rng.integers(2**31)).reset_index(drop=True)
+
+
+def filter_nppes(raw):
+    """What filter_nppes_data keeps: active organizations, with only the required columns."""
+    active = raw["NPI Deactivation Date"].fillna("").str.strip() == ""
+    return raw.loc[active & (raw["Entity Type Code"] == "2"), nppes_columns]
+
+
+def generate_datasets(scale=1, seed=0, zip_codes=None):
+    """All the synthetic files as DataFrames, keyed by their path relative to the datasets folder."""
+    rng = np.random.default_rng(seed)
+    zip_codes = load_zip_codes() if zip_codes is None else zip_codes
+    facilities = generate_facilities(rng, zip_codes, scale)
+    datasets = {file: cms_dataset(facilities, file, rng) for file in files}
+    raw = generate_nppes(rng, zip_codes, facilities, scale)
+    datasets[NPPES_RAW_FILE] = raw
+    datasets[NPPES_FILTERED_FILE] = filter_nppes(raw)
+    return datasets
+
+
+def write_datasets(folder="datasets", scale=1, seed=0):
+    """Writes the synthetic files under folder and returns the rows written per file."""
+    rows = {}
+    for path, frame in generate_datasets(scale, seed).items():
+        path = os.path.join(folder, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.to_csv(path, index=False)
+        rows[path] = len(frame)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic CMS and NPPES files for benchmarking.")
+    parser.add_argument("--scale", type=float, default=1, help="Size relative to scale 1 (about 1%% of the CMS files, 0.1%% of NPPES)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--folder", default="datasets")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    for path, count in write_datasets(args.folder, args.scale, args.seed).items():
+        print(f"{path}: {count} rows")
+    print(f"Synthetic datasets written in {time.time() - start_time:.2f} seconds.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../benchmarks")))
+import address_geocoder
+import geocode_cache
+import sqlite3
+from address_geocoder import (
+    AdaptiveConcurrency, RateLimiter, TokenManager, new_stats, parse_retry_after,
+    process_addresses, create_session, write_results, load_addresses_from_db,
+    prepare_geolocation_table, save_results_to_db
+)
+from setup_database import create_database
+from mock_geocoding_server import STATS, create_app as create_mock_app, start_server
+
+SLOW_SECONDS = 1.0
+
+
+async def start_stand_in_server(**options):
+    """
+    The mock geocoding server of the benchmarks, answering in 10 ms; addresses containing 'Slow'
+    answer after SLOW_SECONDS. Returns the runner, its base URL and the server stats.
+    """
+    app = create_mock_app(latency="fixed:0.01", token_latency=0.05, slow_marker="Slow", slow_latency=SLOW_SECONDS, seed=0, **options)
+    runner, base_url = await start_server(app)
+    return runner, base_url, app[STATS]
+
+
+def make_addresses(count, slow_hashes=()):
+    return [
+        {
+            'address_hash': i,
+            'address': f"{'Slow' if i in slow_hashes else 'Fast'} {i} Main St",
+            'city': "Springfield",
+            'state_code': "IL",
+            'zip_code': "62704"
+        }
+        for i in range(count)
+    ]
+
+
+def run_against_stand_in(addresses, max_workers, requests_per_second=10000, stats=None, cache=None, **server_options):
+    """Geocode addresses against a fresh stand-in server and return results, elapsed time, server state and token manager."""
+    async def scenario():
+        runner, base_url, state = await start_stand_in_server(**server_options)
+        try:
+            with patch.object(address_geocoder, "APPLE_MAPS_BASE_URL", base_url):
+                async with create_session(max_workers=max_workers) as session:
+                    tokens = TokenManager(session, retry_delay=0.01)
+                    started = time.monotonic()
+                    results = await process_addresses(addresses, tokens, cache, max_workers=max_workers, requests_per_second=requests_per_second, stats=stats)
+                    return results, time.monotonic() - started, state, tokens
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(scenario())
+
+
+def test_slow_request_does_not_stall_the_pool():
+    results, elapsed, _, _ = run_against_stand_in(make_addresses(40, slow_hashes={0}), max_workers=8)
+
+    assert len(results) == 40, "Every address should be geocoded."
+    assert results[-1]['address_hash'] == 0, "Fast addresses should finish while the slow one is pending."
+    assert elapsed < 2 * SLOW_SECONDS, "The slow request should only hold one worker slot."
+
+
+def test_large_pools_get_enough_connections_and_cache_rows_are_committed(tmpdir):
+    cache_path = str(tmpdir.join("geocode_cache.db"))
+    cache = geocode_cache.open_cache(cache_path)
+    results, _, _, _ = run_against_stand_in(make_addresses(200), max_workers=120, cache=cache)
+    # Closing discards anything process_addresses left uncommitted
+    cache.close()
+
+    assert len(results) == 200
+    cache = geocode_cache.open_cache(cache_path)
+    stored = cache.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+    cache.close()
+    assert stored == 200, "Cache rows should be committed without a result writer."
+
+    async def connection_limit():
+        async with create_session(max_workers=120) as session:
+            return session.connector.limit
+    assert asyncio.run(connection_limit()) > 120, "The connector should not cap the worker pool."
+
+
+def test_adaptive_concurrency_backs_off_and_recovers():
+    limiter = AdaptiveConcurrency(initial=20, minimum=4, maximum=40, target_latency=1.0, max_error_rate=0.05)
+
+    for _ in range(19):
+        limiter.record(0.1, True)
+    limiter.record(0.1, False)
+    assert limiter.limit == 21, "A single error in a window should not shrink the pool."
+    for _ in range(18):
+        limiter.record(0.1, True)
+    for _ in range(3):
+        limiter.record(0.1, False)
+    assert limiter.limit == 15, "A window with a high error rate should cut the limit by a quarter."
+    for _ in range(15):
+        limiter.record(5.0, True)
+    assert limiter.limit == 14, "A window with high smoothed latency should lower the limit by one."
+
+
+def test_one_token_refresh_per_expiry_under_full_concurrency():
+    results, _, state, tokens = run_against_stand_in(make_addresses(400), max_workers=80, expire_every=150)
+
+    assert len(results) == 400, "Every address should be geocoded across token expiries."
+    # One initial token plus one refresh for each of the two expiries
+    assert state["tokens_issued"] == 3, f"Expected 3 token requests, got {state['tokens_issued']}."
+    assert tokens.refresh_count == 3
+
+
+def test_token_refresh_gives_up_after_bounded_attempts():
+    results, _, state, tokens = run_against_stand_in(make_addresses(20), max_workers=8, token_status=503)
+
+    assert results == []
+    assert state["tokens_issued"] == address_geocoder.MAX_TOKEN_ATTEMPTS, "Token requests should stop after the bounded attempts."
+    assert tokens.token is None
+
+
+def test_transient_errors_are_retried_with_attempt_counts():
+    stats = new_stats()
+    with patch.object(address_geocoder, "RETRY_BASE_DELAY_SECONDS", 0.01):
+        results, _, _, _ = run_against_stand_in(make_addresses(30), max_workers=8, stats=stats, fail_first=503)
+
+    assert len(results) == 30, "Addresses hit by a 503 should be retried instead of dropped."
+    assert all(result['attempts'] == 2 for result in results)
+    assert stats['retries'] == 30
+    assert stats['attempts'] == {2: 30}
+    assert stats['failed'] == 0
+
+
+def test_throttled_requests_honor_retry_after():
+    stats = new_stats()
+    results, _, state, _ = run_against_stand_in(make_addresses(5), max_workers=5, stats=stats, fail_first=429, retry_after=1)
+
+    assert len(results) == 5
+    assert stats['throttled'] == 5
+    assert min(state["retry_waits"]) >= 0.9, "Retries should wait for the Retry-After delay."
+
+
+def test_rate_limiter_paces_requests():
+    async def scenario():
+        limiter = RateLimiter(rate=100, burst=1)
+        started = time.monotonic()
+        for _ in range(21):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.19, "21 requests at 100/s with no burst should take at least 0.2s."
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+@pytest.fixture
+def geocoding_db(tmpdir):
+    """A facilities database with three addresses and an empty address_geolocation table."""
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(__file__), "../schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO states (state_id, state_code, state_name) VALUES (1, 'IL', 'Illinois')")
+    conn.executemany(
+        "INSERT INTO addresses (address, city, state_id, zip_code, address_hash) VALUES (?, 'Springfield', 1, '62704', ?)",
+        [(f"{i} Main St", i) for i in range(3)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def count_geolocations(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM address_geolocation").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_writer_commits_in_batches(geocoding_db):
+    async def scenario():
+        results_queue = asyncio.Queue()
+        writer = asyncio.create_task(write_results(results_queue, geocoding_db, batch_size=2, commit_interval=60))
+        for i in range(2):
+            await results_queue.put({'address_hash': i, 'latitude': 40.0, 'longitude': -75.0})
+        await asyncio.sleep(0.2)
+        checkpointed = count_geolocations(geocoding_db)
+        await results_queue.put(None)
+        return checkpointed, await writer
+
+    checkpointed, saved = asyncio.run(scenario())
+
+    assert checkpointed == 2, "A full batch should be committed while the run is still going."
+    assert saved == 2
+
+
+def test_interrupted_run_resumes_where_it_stopped(geocoding_db):
+    async def interrupted_run():
+        results_queue = asyncio.Queue()
+        writer = asyncio.create_task(write_results(results_queue, geocoding_db, batch_size=100, commit_interval=60))
+        await results_queue.put({'address_hash': 0, 'latitude': 40.0, 'longitude': -75.0})
+        await asyncio.sleep(0.1)
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+
+    asyncio.run(interrupted_run())
+
+    assert count_geolocations(geocoding_db) == 1, "Pending results should be committed when the writer is cancelled."
+    remaining = [address['address_hash'] for address in load_addresses_from_db(geocoding_db)]
+    assert sorted(remaining) == [1, 2], "A resumed run should only see the addresses not yet saved."
+
+
+def test_pending_work_is_one_row_per_distinct_hash(geocoding_db):
+    conn = sqlite3.connect(geocoding_db)
+    # A second entity at 0 Main St shares its address_hash
+    conn.execute("INSERT INTO addresses (address, city, state_id, zip_code, address_hash) VALUES ('0 Main St', 'Springfield', 1, '62704', 0)")
+    conn.commit()
+    conn.close()
+
+    pending = [address['address_hash'] for address in load_addresses_from_db(geocoding_db)]
+
+    assert sorted(pending) == [0, 1, 2], "A shared address should be geocoded once."
+
+
+def test_geolocation_keeps_one_row_per_hash(tmpdir, monkeypatch):
+    # A database geocoded by the old code: no unique index, one geocode per addresses row
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE address_geolocation (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, address_hash INTEGER NOT NULL,
+            latitude REAL NOT NULL, longitude REAL NOT NULL
+        )
+    """)
+    conn.executemany("INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (?, ?, ?)", [(0, 1.0, 1.0), (0, 2.0, 2.0), (1, 5.0, 5.0)])
+    conn.commit()
+    conn.close()
+    output = tmpdir.mkdir("datasets").mkdir("output")
+    output.join("entities.csv").write("entity_id,name,ccn,npi,type,subtype\n1,Clinic,140001,,Clinic,Clinic\n")
+    output.join("addresses.csv").write("address_id,address,city,state_id,zip_code,address_hash,ccn,npi\n1,0 Main St,Springfield,17,62704,0,140001,\n")
+    output.join("states.csv").write("state_id,state_code,state_name\n17,IL,Illinois\n")
+    monkeypatch.chdir(tmpdir)
+
+    create_database(db_path, os.path.join(os.path.dirname(__file__), "../schema.sql"))
+    prepare_geolocation_table(db_path)
+    conn = sqlite3.connect(db_path)
+    collapsed = conn.execute("SELECT address_hash, latitude FROM address_geolocation ORDER BY address_hash").fetchall()
+    conn.close()
+    assert collapsed == [(0, 2.0), (1, 5.0)], "The latest geocode of every hash should be kept."
+
+    save_results_to_db([{'address_hash': 0, 'latitude': 3.0, 'longitude': 3.0}], db_path)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT address_hash, latitude FROM address_geolocation ORDER BY address_hash").fetchall()
+    conn.close()
+    assert rows == [(0, 3.0), (1, 5.0)], "address_geolocation should hold one row per address_hash."
+
+
+def test_geocodes_follow_the_key_migration(tmpdir, monkeypatch):
+    # Geocodes of the last build, under 9-digit hashes; 22 already has one under its new hash
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    conn.executescript(open(os.path.join(os.path.dirname(__file__), "../schema.sql")).read())
+    conn.executemany("INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (?, ?, ?)", [
+        (111111111, 1.0, 1.0), (222222222, 2.0, 2.0), (333333333, 3.0, 3.0), (444444444, 4.0, 4.0), (2**62 + 22, 9.0, 9.0)
+    ])
+    conn.commit()
+    conn.close()
+    output = tmpdir.mkdir("datasets").mkdir("output")
+    output.join("entities.csv").write("entity_id,name,ccn,npi,type,subtype\n1,Clinic,140001,,Clinic,Clinic\n")
+    output.join("addresses.csv").write(f"address_id,address,city,state_id,zip_code,address_hash,ccn,npi\n1,0 Main St,Springfield,17,62704,{2**62 + 11},140001,\n")
+    output.join("states.csv").write("state_id,state_code,state_name\n17,IL,Illinois\n")
+    # 111... and 333... are two old hashes of one address; 444... is a 9-digit collision and stays put
+    output.join("key_migration.csv").write("key,old_id,new_id\n" + "\n".join([
+        f"address_hash,111111111,{2**62 + 11}", f"address_hash,333333333,{2**62 + 11}", f"address_hash,222222222,{2**62 + 22}",
+        f"address_hash,444444444,{2**62 + 44}", f"address_hash,444444444,{2**62 + 45}", f"entity_id,555555555,{2**62 + 55}"
+    ]) + "\n")
+    monkeypatch.chdir(tmpdir)
+
+    create_database(db_path, os.path.join(os.path.dirname(__file__), "../schema.sql"))
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT address_hash, latitude FROM address_geolocation ORDER BY address_hash").fetchall()
+    indexed = conn.execute("SELECT COUNT(*) FROM address_geolocation_rtree").fetchone()[0]
+    conn.close()
+    assert rows == [(444444444, 4.0), (2**62 + 11, 3.0), (2**62 + 22, 9.0)]
+    assert indexed == len(rows), "Geocodes dropped by the migration should leave the spatial index too."
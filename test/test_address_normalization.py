@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from address_normalization import (address_hash, address_hashes, address_keys, city_text, normalize_zip5,
+                                   street_text, zip5_text)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("123 Main Street Suite 4", "123 MAIN ST STE 4"),
+    ("123 MAIN ST., STE. 4", "123 MAIN ST STE 4"),
+    ("  500 north  michigan avenue, floor 2 ", "500 N MICHIGAN AVE FL 2"),
+    ("77 Southwest Parkway #12", "77 SW PKWY # 12"),
+    ("77 SW PKWY #12", "77 SW PKWY # 12"),
+    ("1 Streeter Dr", "1 STREETER DR"),
+    (None, ""),
+])
+def test_street_text(raw, expected):
+    assert street_text(raw) == expected
+
+
+def test_city_and_zip_text():
+    assert city_text("Saint Louis") == city_text("ST. LOUIS") == "ST LOUIS"
+    assert city_text("Fort Wayne") == "FT WAYNE"
+    assert zip5_text("62701-1234") == zip5_text("627011234") == zip5_text(62701.0) == "62701"
+    assert zip5_text(2134) == "02134", "ZIP codes read as numbers get their leading zero back."
+    assert zip5_text(None) == zip5_text("") == ""
+
+
+def test_cms_and_nppes_spellings_share_a_hash():
+    cms = address_hash("123 Main St Suite 4", "Saint Louis", "MO", "63101")
+    nppes = address_hash("123 MAIN STREET STE 4", "ST LOUIS", "mo", "631011234")
+    assert cms == nppes
+    assert cms != address_hash("125 Main St Suite 4", "Saint Louis", "MO", "63101")
+    assert 0 <= cms < 2**63
+
+
+def test_vectorized_hashes_match_the_scalar_ones():
+    address = pd.Series(["123 Main St", "123 MAIN STREET", None, "9 Elm Ave", "123 Main St"])
+    city = pd.Series(["Springfield", "SPRINGFIELD", "Springfield", None, "Springfield"])
+    state = pd.Series(["IL", "IL", "IL", "IL", "IL"])
+    zip_code = pd.Series(["62701", "62701-0001", "62701", "62702", None])
+
+    hashes = address_hashes(address, city, state, zip_code)
+    assert str(hashes.dtype) == "Int64"
+    expected = [address_hash(*row) for row in zip(address, city, state, zip_code)]
+    assert hashes.tolist() == expected
+    assert hashes[0] == hashes[1] != hashes[4]
+
+    keys = address_keys(address, city, state, zip_code)
+    assert keys[2] == "|SPRINGFIELD|IL|62701", "Missing fields become empty parts of the key."
+    assert normalize_zip5(zip_code).tolist() == ["62701", "62701", "62701", "62702", ""]
@@ -0,0 +1,80 @@
+import json
+import pandas as pd
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from change_feed import apply_changes, read_changes, write_changes
+from dtype_policy import read_typed_csv
+
+
+@pytest.fixture
+def staged(tmpdir):
+    """Staged entities and addresses, and the TABLES mapping pointing at them."""
+    entities = pd.DataFrame({
+        "entity_id": [1, 2, 3],
+        "name": ["General Hospital", "County Clinic", "Lakeside Hospice"],
+        "ccn": ["140148", None, None],
+        "npi": [None, "1000000002", "1000000003"],
+        "Type": ["Hospital", "Clinic", "Hospice"],
+        "unique_facility_at_location": [1, 0, 1],
+    })
+    addresses = pd.DataFrame({
+        "address_id": [10, 20, 30],
+        "ccn": ["140148", None, None],
+        "npi": [None, "1000000002", "1000000003"],
+        "address": ["1 Main St", "2 Oak Ave", "3 Lake Rd"],
+        "state_id": pd.array([17, 17, None], dtype="Int64"),
+        "address_hash": [100, 200, 300],
+        "primary_practice_address": [True, False, True],
+    })
+    tables = {
+        "entities": (str(tmpdir.join("entities.csv")), "entity_id"),
+        "addresses": (str(tmpdir.join("addresses.csv")), "address_id"),
+    }
+    entities.to_csv(tables["entities"][0], index=False)
+    addresses.to_csv(tables["addresses"][0], index=False)
+    return tables, str(tmpdir.join("changes"))
+
+
+def test_builds_write_the_rows_that_changed(staged):
+    tables, folder = staged
+    first = write_changes(folder, tables)
+    assert first["sequence"] == 1 and first["full"]
+    assert first["tables"]["entities"]["insert"] == 3
+
+    previous = {table: read_typed_csv(path) for table, (path, _) in tables.items()}
+    entities = previous["entities"].copy()
+    entities.loc[entities["entity_id"] == 2, "name"] = "County Health Clinic"
+    entities = entities[entities["entity_id"] != 3]
+    pd.concat([entities, pd.DataFrame({"entity_id": [4], "name": ["New Hospital"], "Type": ["Hospital"], "unique_facility_at_location": [0]})]) \
+        .to_csv(tables["entities"][0], index=False)
+    addresses = previous["addresses"]
+    addresses.loc[addresses["address_id"] == 30, "state_id"] = 55
+    addresses.to_csv(tables["addresses"][0], index=False)
+
+    second = write_changes(folder, tables)
+    assert second["sequence"] == 2 and not second["full"]
+    assert {op: second["tables"]["entities"][op] for op in ["insert", "update", "delete"]} == {"insert": 1, "update": 1, "delete": 1}
+    assert {op: second["tables"]["addresses"][op] for op in ["insert", "update", "delete"]} == {"insert": 0, "update": 1, "delete": 0}
+    assert write_changes(folder, tables) is None, "A build changing nothing adds no sequence."
+    assert json.load(open(os.path.join(folder, "feed.json")))["sequence"] == 2
+
+    changes = read_changes("entities", since=1, folder=folder)
+    assert changes[["op", "entity_id"]].values.tolist() == [["insert", 4], ["update", 2], ["delete", 3]]
+    # The previous build with the changes applied is the current one
+    for table, (path, key) in tables.items():
+        applied = apply_changes(previous[table], read_changes(table, since=1, folder=folder), key)
+        current = read_typed_csv(path)
+        pd.testing.assert_frame_equal(
+            applied.sort_values(key).reset_index(drop=True), current.sort_values(key).reset_index(drop=True), check_categorical=False
+        )
+
+
+def test_duplicate_keys_stop_the_feed(staged):
+    tables, folder = staged
+    entities = read_typed_csv(tables["entities"][0])
+    pd.concat([entities, entities.iloc[[0]]]).to_csv(tables["entities"][0], index=False)
+    with pytest.raises(ValueError, match="entity_id 1 is repeated"):
+        write_changes(folder, tables)
+    assert not os.path.exists(os.path.join(folder, "feed.json"))
@@ -0,0 +1,41 @@
+import pandas as pd
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from dimensions import OTHER_STATE_ID_START, STATES, save_states, state_id, state_ids, taxonomy_details, taxonomy_dimension
+
+
+def test_state_ids_are_fixed_and_vectorized():
+    ids = state_ids(pd.Series(["CA", " il", "PR", None, "", "ON", "ON"]))
+    assert ids.dtype == "Int64"
+    assert ids.iloc[:3].tolist() == [6, 17, 72]
+    assert ids.iloc[3:5].isna().all()
+    assert ids.iloc[5] == ids.iloc[6] >= OTHER_STATE_ID_START
+    assert state_id("ON") == ids.iloc[5], "Codes outside the dimension get the same id in every call."
+    assert state_id(None) is None
+    assert len({state_id for state_id, _, _ in STATES}) == len(STATES) >= 56
+
+
+def test_save_states_keeps_ids_across_runs(tmpdir):
+    states_file = str(tmpdir.join("states.csv"))
+    first = save_states(states_file, ["ZZ", "TX"])
+    second = save_states(states_file, ["ON"])
+    assert set(first["state_code"]) < set(second["state_code"]), "Codes already in the file are kept."
+    merged = pd.read_csv(states_file)
+    assert merged["state_id"].is_unique and merged["state_code"].is_unique
+    assert merged.set_index("state_code").loc[["TX", "ZZ"], "state_id"].tolist() == [48, state_id("ZZ")]
+    assert merged.set_index("state_code").loc["TX", "state_name"] == "Texas"
+
+
+def test_taxonomy_lookups_agree():
+    taxonomy = taxonomy_dimension()
+    assert taxonomy.index.is_monotonic_increasing and taxonomy["nucc_id"].tolist() == list(range(1, len(taxonomy) + 1))
+    assert taxonomy_dimension() is taxonomy, "The dictionary is read once per process."
+
+    codes = pd.Series(["251G00000X", "not a code", None, "261QA1903X "], index=[5, 6, 7, 8])
+    details = taxonomy_details(codes)
+    assert details.index.tolist() == [5, 6, 7, 8]
+    assert details.loc[5, "nucc_id"] == taxonomy.loc["251G00000X", "nucc_id"]
+    assert details.loc[5, "type"] == taxonomy.loc["251G00000X", "type"]
+    assert details.loc[8, "subtype"] == taxonomy.loc["261QA1903X", "subtype"]
+    assert details.loc[[6, 7]].isna().all().all()
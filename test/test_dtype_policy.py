@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from io import StringIO
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from dtype_policy import STRING, apply_dtypes, read_typed_csv, share_categories
+
+
+def test_csv_dtypes_follow_the_policy():
+    staged = StringIO("""entity_id,name,ccn,npi,Type,Subtype,nucc_code,unique_facility_at_location
+1,Memorial,010001,,Hospital,General Acute Care Hospital,282N00000X,1
+,Home Health,,1234567890,Agency,,251E00000X,0
+""")
+    entities = read_typed_csv(staged)
+
+    assert entities["entity_id"].dtype == "Int64" and entities["entity_id"].isna().sum() == 1
+    assert entities["ccn"].dtype == STRING and entities.at[0, "ccn"] == "010001", "Leading zeros should be kept."
+    assert isinstance(entities["Type"].dtype, pd.CategoricalDtype)
+    assert entities["unique_facility_at_location"].dtype == "int64", "Columns outside the policy keep the inferred dtype."
+
+
+def test_arrow_reader_keeps_large_keys_and_names_what_it_cannot_read():
+    staged = StringIO("address_hash,ccn,State,empty\n9210184024921650663,010001,IL,\n,,TX,\n")
+    addresses = read_typed_csv(staged, usecols=["address_hash", "State", "empty"])
+    assert list(addresses.columns) == ["address_hash", "State", "empty"]
+    assert addresses["address_hash"].tolist()[0] == 9210184024921650663, "63-bit keys should not pass through floats."
+    assert list(addresses["State"].cat.categories) == ["IL", "TX"]
+    assert addresses["empty"].dtype == "float64"
+
+    # Keys written as floats and short rows are errors, not a silent switch to another parser
+    with pytest.raises(ValueError, match="invalid value '12.0' \\('entity_id'\\)"):
+        read_typed_csv(StringIO("name,entity_id,ccn\nA,12.0,010001\n"))
+    with pytest.raises(ValueError, match="Expected 3 columns, got 2: 13,B"):
+        read_typed_csv(StringIO("entity_id,name,ccn\n12,A,010001\n13,B\n"))
+
+
+def test_apply_and_share_categories():
+    records = pd.DataFrame([{"entity_id": 7, "nucc_code": "261QE0700X", "zip_code": "02138"}, {"entity_id": None, "nucc_code": None, "zip_code": None}])
+    apply_dtypes(records)
+    assert records["entity_id"].dtype == "Int64" and records["zip_code"].dtype == STRING
+
+    slots = pd.DataFrame({"first": ["A", "B", None], "second": ["B", "B", "C"]}, dtype="category")
+    share_categories(slots, ["first", "second"])
+    assert list(slots["first"].cat.categories) == ["A", "B", "C"]
+    assert (slots["first"] == slots["second"]).tolist() == [False, True, False]
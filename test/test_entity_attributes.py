@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from entity_attributes import derive_entity_attributes
+
+
+@pytest.fixture
+def staged_data():
+    entities = pd.DataFrame({
+        "entity_id": [1, 2, 3, 4, 5],
+        "name": ["Agency A", "Agency A", "Hospital B", "Clinic C", "Clinic D"],
+        "ccn": ["100", "100", "200", None, None],
+        "npi": [None, None, None, "300", "400"],
+        "Type": ["Agency", "Agency", "Hospital", "Clinic", "Clinic"],
+        "Subtype": ["Home Health", "Hospice", "General Acute Care Hospital", "Dialysis Clinic", "Dialysis Clinic"],
+        "nucc_code": ["251E00000X", "251G00000X", "282N00000X", "261QE0700X", "261QE0700X"],
+    })
+    addresses = pd.DataFrame({
+        "address_id": [10, 11, 12, 13, 14],
+        "npi": [None, None, None, "300", "400"],
+        "ccn": ["100", "100", "200", None, None],
+        "address_hash": [111, 222, 333, 333, 444],
+    })
+    return entities, addresses
+
+
+def test_derive_entity_attributes(staged_data):
+    entities, addresses = staged_data
+    derived = derive_entity_attributes(entities, addresses).set_index("entity_id")
+
+    # Agency A owns two entities at two addresses, alone at both
+    assert derived.loc[1, "employer_group_type"] == "multi"
+    assert derived.loc[1, "multi_speciality_employer"] == 1
+    assert derived.loc[1, "unique_facility_at_location"] == 1
+    assert derived.loc[1, "employer_num"] == "100"
+
+    # Hospital B and Clinic C share address 333
+    assert derived.loc[3, "unique_facility_at_location"] == 0
+    assert derived.loc[3, "multi_speciality_facility"] == 1
+    assert derived.loc[4, "unique_facility_at_location"] == 0
+    assert derived.loc[4, "employer_group_type"] == "none"
+
+    # Clinic D is alone at its address
+    assert derived.loc[5, "unique_facility_at_location"] == 1
+    assert derived.loc[5, "multi_speciality_facility"] == 0
+
+
+def test_derive_entity_attributes_incremental(staged_data):
+    entities, addresses = staged_data
+    derived = derive_entity_attributes(entities, addresses)
+
+    # Clinic D moves into Hospital B's building
+    addresses.loc[addresses["npi"] == "400", "address_hash"] = 333
+    incremental = derive_entity_attributes(derived, addresses, changed_hashes=[333, 444])
+    full = derive_entity_attributes(entities, addresses)
+
+    pd.testing.assert_frame_equal(incremental, full)
+    assert incremental.set_index("entity_id").loc[5, "unique_facility_at_location"] == 0
+
+
+def test_incremental_matches_full_on_random_moves():
+    rng = np.random.default_rng(7)
+    employers = [f"{n:06d}" for n in range(60)]
+    entities = pd.DataFrame({
+        "entity_id": range(200),
+        "ccn": rng.choice(employers, 200),
+        "npi": None,
+        "Subtype": rng.choice(["Hospice", "Home Health", "Dialysis Clinic"], 200),
+    })
+    addresses = pd.DataFrame({
+        "ccn": rng.choice(employers, 150),
+        "npi": None,
+        "address_hash": rng.integers(0, 80, 150),
+    })
+    derived = derive_entity_attributes(entities, addresses)
+
+    moved = rng.choice(len(addresses), 10, replace=False)
+    changed = set(addresses.loc[moved, "address_hash"])
+    addresses.loc[moved, "address_hash"] = rng.integers(0, 80, 10)
+    changed |= set(addresses.loc[moved, "address_hash"])
+
+    incremental = derive_entity_attributes(derived, addresses, changed_hashes=changed)
+    pd.testing.assert_frame_equal(incremental, derive_entity_attributes(entities, addresses))
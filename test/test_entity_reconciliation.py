@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from address_normalization import address_hash
+from entity_reconciliation import reconcile
+from nppes_importer import practice_address_hashes, process_nppes
+
+LINE_1 = "Provider First Line Business Practice Location Address"
+CITY = "Provider Business Practice Location Address City Name"
+STATE = "Provider Business Practice Location Address State Name"
+ZIP = "Provider Business Practice Location Address Postal Code"
+LEGAL_NAME = "Provider Organization Name (Legal Business Name)"
+TAXONOMY_1 = "Healthcare Provider Taxonomy Code_1"
+TAXONOMY_2 = "Healthcare Provider Taxonomy Code_2"
+
+
+@pytest.fixture
+def sample_data():
+    nppes_data = pd.DataFrame({
+        "NPI": ["1000000001", "1000000002", "1000000003", "1000000004", "1000000005"],
+        LEGAL_NAME: ["ST MARYS DIALYSIS LLC", "OTHER DIALYSIS INC", "ST MARYS BEHAVIORAL", "GOOD HOSPICE", "CAMPUS CLINIC"],
+        LINE_1: ["100 NORTH MAIN STREET", "100 N Main St", "100 N MAIN ST", "9 ELM AVENUE", "5 CAMPUS DRIVE"],
+        CITY: ["SPRINGFIELD", "Springfield", "SPRINGFIELD", "SPRINGFIELD", "SPRINGFIELD"],
+        STATE: ["IL"] * 5,
+        ZIP: ["627011234", "62701", "62701", "62702", "62703"],
+        TAXONOMY_1: ["261QE0700X", "261Q00000X", "261QM0850X", "251G00000X", "261QE0700X"],
+        TAXONOMY_2: [None, None, None, None, "282N00000X"],
+    })
+    cms_data = pd.DataFrame({
+        "entity_id": [11, 12, 13, 14],
+        "name": ["St Marys Dialysis LLC", "Good Hospice", "Campus Dialysis East", "Campus Dialysis West"],
+        "ccn": ["142501", "141501", "142502", "142503"],
+        "npi": [None, None, None, None],
+        "nucc_code": ["261QE0700X", "251G00000X", "261QE0700X", "261QE0700X"],
+    })
+    cms_addresses = pd.DataFrame({
+        "ccn": ["142501", "141501", "142502", "142503"],
+        "address_hash": [
+            address_hash("100 N Main St", "Springfield", "IL", "62701"),
+            address_hash("9 Elm Ave", "Springfield", "IL", "62702"),
+            address_hash("5 Campus Dr", "Springfield", "IL", "62703"),
+            address_hash("5 Campus Dr", "Springfield", "IL", "62703"),
+        ],
+    })
+    return nppes_data, cms_data, cms_addresses
+
+
+def test_reconcile_on_address_and_compatible_code(sample_data):
+    nppes_data, cms_data, cms_addresses = sample_data
+    matches = reconcile(nppes_data, [TAXONOMY_1, TAXONOMY_2], practice_address_hashes(nppes_data), cms_data, cms_addresses)
+    by_slot = {(row.position, row.taxonomy_field): row for row in matches.itertuples()}
+
+    assert by_slot[(0, TAXONOMY_1)].entity_id == 11, "NPPES spelling and ZIP+4 still find the CMS address."
+    assert by_slot[(1, TAXONOMY_1)].entity_id == 11, "The generic Clinic/Center code fits the dialysis clinic."
+    assert (2, TAXONOMY_1) not in by_slot, "A mental health clinic is not the dialysis clinic next door."
+    assert by_slot[(3, TAXONOMY_1)].entity_id == 12
+    assert by_slot[(4, TAXONOMY_1)].entity_id == 13, "On a campus the lowest entity_id wins without a name match."
+    assert (4, TAXONOMY_2) not in by_slot, "There is no CMS hospital on the campus."
+
+    attached = matches[matches["attach_npi"]].set_index("entity_id")["npi"].to_dict()
+    assert attached == {11: "1000000001", 12: "1000000004", 13: "1000000005"}, "Same-name NPIs are attached first."
+
+
+def test_process_nppes_attaches_npis_instead_of_duplicating(sample_data):
+    nppes_data, cms_data, cms_addresses = sample_data
+    updated_cms_records, new_entities, new_addresses = process_nppes(nppes_data, cms_data, cms_addresses)
+
+    assert {record["entity_id"]: record["npi"] for record in updated_cms_records} == {11: "1000000001", 12: "1000000004", 13: "1000000005"}
+    assert [(entity["name"], entity["nucc_code"]) for entity in new_entities] == [("ST MARYS BEHAVIORAL", "261QM0850X"), ("CAMPUS CLINIC", "282N00000X")]
+    assert [address["npi"] for address in new_addresses] == ["1000000003", "1000000005"]
@@ -0,0 +1,147 @@
+import json
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from execute_chain import SHARD_STAGE, STAGES, plan_stages, run_chain, stage_dependencies
+
+# Stage module template: appends its name to runs.log, then writes its output from its input
+STAGE_SOURCE = '''
+def main():
+    with open("runs.log", "a") as f:
+        f.write("{name}\\n")
+    with open("{source}") as f:
+        data = f.read()
+    with open("{target}", "w") as f:
+        f.write(data + "{name}")
+'''
+
+
+@pytest.fixture
+def pipeline(tmpdir, monkeypatch, request):
+    """Two chained stages (input.txt -> a.txt -> b.txt) written as modules in a temporary directory."""
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    prefix = f"stage_{request.node.name}"
+    stages = []
+    for name, source, target in (("a", "input.txt", "a.txt"), ("b", "a.txt", "b.txt")):
+        tmpdir.join(f"{prefix}_{name}.py").write(STAGE_SOURCE.format(name=name, source=source, target=target))
+        stages.append({"name": name, "module": f"{prefix}_{name}", "inputs": [source], "outputs": [target]})
+    tmpdir.join("input.txt").write("x")
+    return stages
+
+
+def runs(tmpdir):
+    """Stages run since the last call."""
+    log = tmpdir.join("runs.log")
+    if not log.exists():
+        return []
+    names = log.read().split()
+    log.remove()
+    return names
+
+
+def test_stages_are_skipped_until_their_inputs_change(pipeline, tmpdir):
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a", "b"]
+    assert tmpdir.join("b.txt").read() == "xab"
+
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == [], "A rerun with unchanged inputs should skip every stage."
+
+    tmpdir.join("b.txt").remove()
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["b"], "Only the stage whose output is gone should run."
+
+    tmpdir.join("input.txt").write("changed")
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a", "b"], "A changed input should rerun everything below it."
+
+    assert run_chain(pipeline, state_path="state.json", force=["b"])
+    assert runs(tmpdir) == ["b"]
+
+
+def test_helper_edits_rerun_the_stages_importing_them(pipeline, tmpdir):
+    # Stage a imports a helper, which imports another one
+    stage_a = tmpdir.join(pipeline[0]["module"] + ".py")
+    stage_a.write(f"import {pipeline[0]['module']}_helper\n" + stage_a.read())
+    tmpdir.join(f"{pipeline[0]['module']}_helper.py").write(f"from {pipeline[0]['module']}_shared import VALUE\n")
+    tmpdir.join(f"{pipeline[0]['module']}_shared.py").write("VALUE = 1\n")
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a", "b"]
+
+    tmpdir.join(f"{pipeline[0]['module']}_shared.py").write("VALUE = 2\n")
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a", "b"], "A changed helper should rerun the stage using it and everything below."
+
+
+def test_run_report_and_profile(pipeline, tmpdir):
+    assert run_chain(pipeline, state_path="state.json", profile={"b": "cprofile"}, report_path="reports/run.json")
+    report = json.load(open("reports/run.json"))
+    assert [stage["name"] for stage in report["stages"]] == ["a", "b"]
+    assert all(stage["status"] == "ok" and stage["peak_rss_mb"] > 0 for stage in report["stages"])
+    assert not any("peak_rss_shared_with" in stage for stage in report["stages"]), "Chained stages never overlap."
+    assert tmpdir.join("reports", "run.b.prof").exists()
+
+    assert run_chain(pipeline, state_path="state.json", force=["b"], report_path="reports/rerun.json")
+    assert json.load(open("reports/rerun.json"))["skipped"] == ["a"]
+
+
+def test_failure_stops_downstream_stages(pipeline, tmpdir):
+    tmpdir.join("input.txt").remove()
+    assert not run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a"], "Stages after a failed one should not start."
+
+    tmpdir.join("input.txt").write("x")
+    assert run_chain(pipeline, state_path="state.json")
+    assert runs(tmpdir) == ["a", "b"]
+
+
+def test_independent_stages_run_concurrently(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    # Each stage announces itself and then waits for the other, which only works when both run at once
+    stages = []
+    for name, other in (("left", "right"), ("right", "left")):
+        tmpdir.join(f"concurrent_{name}.py").write(
+            "import os, time\n"
+            "def main():\n"
+            f"    open('{name}.started', 'w').close()\n"
+            "    deadline = time.time() + 10\n"
+            f"    while not os.path.exists('{other}.started'):\n"
+            "        if time.time() > deadline:\n"
+            "            raise TimeoutError\n"
+            "        time.sleep(0.01)\n"
+            f"    open('{name}.txt', 'w').close()\n"
+        )
+        stages.append({"name": name, "module": f"concurrent_{name}", "inputs": [], "outputs": [f"{name}.txt"]})
+
+    assert run_chain(stages, state_path="state.json", max_parallel=2, report_path="run.json")
+    assert tmpdir.join("left.txt").exists() and tmpdir.join("right.txt").exists()
+    # Both peaks are of the whole process, so each names the other stage
+    report = {stage["name"]: stage for stage in json.load(open("run.json"))["stages"]}
+    assert report["left"]["peak_rss_shared_with"] == ["right"] and report["right"]["peak_rss_shared_with"] == ["left"]
+
+
+def test_pipeline_plan(tmpdir, monkeypatch):
+    dependencies = stage_dependencies(STAGES)
+    assert dependencies["filter_nppes_data"] == [], "NPPES filtering should overlap the CMS import."
+    assert set(dependencies["nppes_importer"]) == {"facilities_importer", "filter_nppes_data"}
+    # Sharding is opt-in (--shards), and then waits for the geocoded database
+    assert SHARD_STAGE["name"] not in dependencies
+    assert "address_geocoder" in stage_dependencies(STAGES + [SHARD_STAGE])[SHARD_STAGE["name"]]
+
+    # Rerunning a stage that appends to a file reruns the stage creating it, and everything below that
+    monkeypatch.chdir(tmpdir)
+    stages = [
+        {"name": "create", "module": "create", "inputs": ["raw.csv"], "outputs": ["staged.csv"], "rebuilds": ["staged.csv"]},
+        {"name": "fetch", "module": "fetch", "inputs": ["extra.csv"], "outputs": ["fetched.csv"]},
+        {"name": "append", "module": "append", "inputs": ["fetched.csv", "staged.csv"], "outputs": ["staged.csv"], "appends": ["staged.csv"]},
+        {"name": "load", "module": "load", "inputs": ["staged.csv"], "outputs": ["loaded.db"]}
+    ]
+    for path in ("staged.csv", "fetched.csv", "loaded.db"):
+        tmpdir.join(path).write("")
+    fingerprints = {stage["name"]: "current" for stage in stages}
+    state = dict(fingerprints, fetch="stale")
+    assert plan_stages(stages, stage_dependencies(stages), fingerprints, state) == {"create", "fetch", "append", "load"}
+    assert plan_stages(stages, stage_dependencies(stages), fingerprints, fingerprints) == set()
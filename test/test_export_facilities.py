@@ -0,0 +1,72 @@
+import json
+import sqlite3
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from export_facilities import EXPORT_SCHEMA, NULL_PARTITION, export
+from test_facility_queries import build_db
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    path = str(tmpdir.join("facilities.db"))
+    build_db(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO address_geolocation (address_hash, latitude, longitude, \"precision\") VALUES (1, 39.8092, -89.6536, 'rooftop')")
+    conn.execute("INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (6, 'No Address Clinic', '149999', NULL, 'Clinic', 'Dialysis Clinic')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_flat_parquet_export_in_row_groups(db_path, tmpdir):
+    output = str(tmpdir.join("facilities"))
+    written = export(db_path, output, batch_size=2)
+    assert written == {output + ".parquet": 6}
+
+    parquet = pq.ParquetFile(output + ".parquet")
+    assert parquet.schema_arrow == EXPORT_SCHEMA
+    assert parquet.metadata.num_row_groups == 3, "Every fetched batch becomes one row group."
+    rows = {(row["entity_id"], row["address_hash"]): row for row in parquet.read().to_pylist()}
+    assert rows[(1, 1)]["state_name"] == "Illinois" and rows[(1, 1)]["latitude"] == 39.8092
+    assert rows[(1, 2)]["latitude"] is None, "Addresses without coordinates are kept."
+    assert rows[(6, None)]["address"] is None, "Entities without addresses are kept."
+
+
+def test_partitioned_exports(db_path, tmpdir):
+    folder = str(tmpdir.join("by_state"))
+    written = export(db_path, folder, partition_by="state", batch_size=2)
+    assert {os.path.relpath(path, folder) for path in written} == {
+        os.path.join(f"state_code={NULL_PARTITION}", "part-00000.parquet"),
+        os.path.join("state_code=IL", "part-00000.parquet"),
+        os.path.join("state_code=WI", "part-00000.parquet"),
+    }
+    assert ds.dataset(folder, format="parquet").to_table().num_rows == 6
+
+    folder = str(tmpdir.join("by_subtype"))
+    written = export(db_path, folder, "ndjson", partition_by="subtype")
+    dialysis = os.path.join(folder, "subtype=Dialysis Clinic", "part-00000.ndjson")
+    with open(dialysis) as f:
+        rows = [json.loads(line) for line in f]
+    assert written[dialysis] == 2 and {row["entity_id"] for row in rows} == {"2", "6"}
+    assert os.path.exists(os.path.join(folder, "subtype=Home Health Agency (All)", "part-00000.ndjson"))
+
+
+def test_ndjson_keys_past_2_53_are_exact(db_path, tmpdir):
+    entity_id, address_hash = 2**62 + 1, 2**53 + 1
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (?, 'Big Key Clinic', '149990', NULL, 'Clinic', 'Dialysis Clinic')", (entity_id,))
+    conn.execute("INSERT INTO addresses (ccn, address, city, state_id, zip_code, address_hash) VALUES ('149990', '5 Elm St', 'Springfield', 17, '62701', ?)", (address_hash,))
+    conn.commit()
+    conn.close()
+
+    output = str(tmpdir.join("facilities"))
+    export(db_path, output, "ndjson")
+    with open(output + ".ndjson") as f:
+        rows = [json.loads(line) for line in f]
+    row = next(row for row in rows if row["name"] == "Big Key Clinic")
+    assert (int(row["entity_id"]), int(row["address_hash"])) == (entity_id, address_hash)
+    assert next(row for row in rows if row["entity_id"] == "6")["address_hash"] is None, "Missing keys stay null."
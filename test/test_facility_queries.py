@@ -0,0 +1,122 @@
+import shutil
+import sqlite3
+import threading
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_queries import FacilityQueries
+
+
+def build_db(db_path, hospital_name="Memorial Hospital"):
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(__file__), "../schema.sql")) as f:
+        conn.executescript(f.read())
+    # setup_database loads entities with to_sql, without the schema's constraints, so NPPES rows have no CCN
+    conn.executescript("""
+        DROP TABLE entities;
+        CREATE TABLE entities (entity_id INTEGER, name TEXT, ccn TEXT, npi TEXT, type TEXT, subtype TEXT, nucc_code TEXT);
+        CREATE INDEX idx_entities_npi_ccn ON entities (npi, ccn);
+        CREATE INDEX idx_entities_ccn ON entities (ccn);
+    """)
+    conn.executemany("INSERT INTO states (state_id, state_code, state_name) VALUES (?, ?, ?)", [(17, "IL", "Illinois"), (55, "WI", "Wisconsin")])
+    conn.executemany(
+        "INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (1, hospital_name, "140148", "1000000001", "Hospital", "General Acute Care Hospital"),
+            (2, "Prairie Dialysis", "142500", "1000000002", "Clinic", "Dialysis Clinic"),
+            (3, "Madison Hospital", "520001", "1000000003", "Hospital", "Critical Access Hospital"),
+            (4, "Home Health Partners", None, "1000000004", "Agency", "Home Health Agency (All)")
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO addresses (ccn, npi, address, city, state_id, zip_code, address_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("140148", None, "701 N 1st St", "Springfield", 17, "62781", 1),
+            ("140148", None, "800 E Carpenter St", "Springfield", 17, "62769", 2),
+            ("142500", None, "701 N 1st St", "Springfield", 17, "62781", 1),
+            ("520001", None, "1 University Ave", "Madison", 55, "53705", 3),
+            (None, "1000000004", "3001 Ash St", "Springfield", 17, "62703", 4)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    path = str(tmpdir.join("facilities.db"))
+    build_db(path)
+    return path
+
+
+def test_lookups(db_path):
+    queries = FacilityQueries(db_path)
+    hospital = queries.by_ccn("140148")
+    assert [row["address_hash"] for row in hospital] == [1, 2]
+    assert hospital[0]["state_code"] == "IL" and hospital[0]["name"] == "Memorial Hospital"
+    assert [row["address"] for row in queries.by_npi("1000000004")] == ["3001 Ash St"], "NPPES entities link by NPI."
+    assert queries.by_npi("999") == []
+
+    assert {row["entity_id"] for row in queries.by_type("Hospital", state="il")} == {1}
+    assert [row["entity_id"] for row in queries.by_type("Hospital", "Critical Access Hospital", state="WI")] == [3]
+    assert [row["entity_id"] for row in queries.by_type("Clinic", zip_code="62781-1234")] == [2]
+    assert [row["entity_id"] for row in queries.at_address(1)] == [1, 2]
+    assert len(queries.by_type("Hospital", state="IL", limit=1)) == 1
+    with pytest.raises(ValueError):
+        queries.by_type("Hospital")
+    assert [row["entity_id"] for row in queries.search("madison hosp", state="WI")] == [3]
+    assert queries.search("madison hosp", state="IL") == []
+
+
+def test_cache_is_cleared_when_the_database_is_swapped(db_path, tmpdir):
+    queries = FacilityQueries(db_path)
+    first = queries.by_ccn("140148")
+    assert queries.by_ccn("140148") is first
+    assert queries.stats()["cache_hits"] == 1
+
+    replacement = str(tmpdir.join("new.db"))
+    build_db(replacement, hospital_name="Memorial Medical Center")
+    os.replace(replacement, db_path)
+    assert queries.by_ccn("140148")[0]["name"] == "Memorial Medical Center"
+    assert queries.stats()["invalidations"] == 1
+
+
+def test_cache_is_cleared_by_writes_to_the_wal(db_path):
+    writer = sqlite3.connect(db_path)
+    writer.execute("PRAGMA journal_mode=WAL")
+    queries = FacilityQueries(db_path)
+    assert queries.by_ccn("140148")[0]["name"] == "Memorial Hospital"
+
+    size, mtime = os.path.getsize(db_path), os.stat(db_path).st_mtime_ns
+    writer.execute("UPDATE entities SET name = 'Memorial Medical Center' WHERE ccn = '140148'")
+    writer.commit()
+    assert (os.path.getsize(db_path), os.stat(db_path).st_mtime_ns) == (size, mtime), "The write should stay in the WAL."
+    assert queries.by_ccn("140148")[0]["name"] == "Memorial Medical Center"
+    assert queries.stats()["invalidations"] == 1
+    writer.close()
+
+
+def test_pool_is_bounded_and_read_only(db_path):
+    queries = FacilityQueries(db_path, pool_size=2, cache_size=0)
+    errors = []
+
+    def lookups():
+        try:
+            for _ in range(50):
+                assert queries.by_npi("1000000002")[0]["entity_id"] == 2
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert queries.stats()["connections_opened"] <= 2
+
+    with queries.pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM entities")
+    queries.close()
@@ -0,0 +1,125 @@
+import sqlite3
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_search import bounding_box, find_facilities_within, haversine_miles, match_expression, search_facilities
+from address_geocoder import save_results_to_db
+from setup_database import rebuild_search_index
+
+# Springfield, IL
+ORIGIN = (39.7817, -89.6501)
+
+
+@pytest.fixture
+def facilities_db(tmpdir):
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(__file__), "../schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.executemany(
+        "INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (1, "Memorial Hospital", "140148", "1000000001", "Hospital", "General Acute Care Hospital"),
+            (2, "Prairie Dialysis", "142500", "1000000002", "Clinic", "Dialysis Clinic"),
+            (3, "Chicago Hospital", "140001", "1000000003", "Hospital", "General Acute Care Hospital"),
+            (4, "Home Health Partners", "", "1000000004", "Agency", "Home Health Agency (All)")
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO addresses (ccn, npi, address, city, zip_code, address_hash) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ("140148", None, "701 N 1st St", "Springfield", "62781", 1),
+            ("140148", None, "800 E Carpenter St", "Springfield", "62769", 2),
+            ("142500", None, "932 N Rutledge St", "Springfield", "62702", 3),
+            ("140001", None, "251 E Huron St", "Chicago", "60611", 4),
+            (None, "1000000004", "3001 Ash St", "Springfield", "62703", 5)
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (?, ?, ?)",
+        [
+            (1, 39.8092, -89.6536),
+            (2, 39.8080, -89.6460),
+            (3, 39.8110, -89.6560),
+            (4, 41.8950, -87.6220),
+            (5, 39.7590, -89.6120)
+        ]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_bounding_box_contains_the_radius():
+    min_lat, max_lat, min_lon, max_lon = bounding_box(*ORIGIN, 10)
+    assert haversine_miles(*ORIGIN, max_lat, ORIGIN[1]) == pytest.approx(10, rel=0.01)
+    assert haversine_miles(*ORIGIN, ORIGIN[0], max_lon) >= 10
+    assert bounding_box(89.9999999, 0, 10)[2:] == (-180.0, 180.0)
+
+
+def test_radius_query_sorts_dedupes_and_filters(facilities_db):
+    conn = sqlite3.connect(facilities_db)
+    results = find_facilities_within(conn, *ORIGIN, 5)
+
+    assert [result["entity_id"] for result in results] == [1, 2, 4]
+    distances = [result["distance_miles"] for result in results]
+    assert distances == sorted(distances) and distances[-1] <= 5
+    assert results[0]["address_hash"] == 2, "An entity at several addresses should come back at the nearest one."
+
+    # Chicago is about 170 miles away
+    assert 3 in [result["entity_id"] for result in find_facilities_within(conn, *ORIGIN, 200)]
+    assert [result["entity_id"] for result in find_facilities_within(conn, *ORIGIN, 5, subtype="Dialysis Clinic")] == [2]
+    assert [result["entity_id"] for result in find_facilities_within(conn, *ORIGIN, 5, entity_type="Hospital")] == [1]
+    assert len(find_facilities_within(conn, *ORIGIN, 5, limit=1)) == 1
+    conn.close()
+
+
+def test_rtree_follows_geolocation_updates(facilities_db):
+    # Moving the dialysis clinic to Chicago through the geocoder upsert must move it in the R*Tree too
+    save_results_to_db([{'address_hash': 3, 'latitude': 41.89, 'longitude': -87.63}], facilities_db)
+
+    conn = sqlite3.connect(facilities_db)
+    assert 2 not in [result["entity_id"] for result in find_facilities_within(conn, *ORIGIN, 5)]
+    chicago = find_facilities_within(conn, 41.89, -87.63, 1)
+    assert [result["entity_id"] for result in chicago] == [2, 3]
+
+    conn.execute("DELETE FROM address_geolocation WHERE address_hash = 3")
+    assert conn.execute("SELECT COUNT(*) FROM address_geolocation_rtree").fetchone()[0] == 4
+    conn.close()
+
+
+def test_text_search_ranks_prefixes_and_filters(facilities_db):
+    conn = sqlite3.connect(facilities_db)
+    conn.execute("INSERT INTO states (state_id, state_code, state_name) VALUES (17, 'IL', 'Illinois')")
+    # The update trigger re-indexes the addresses with their state
+    conn.execute("UPDATE addresses SET state_id = 17 WHERE city = 'Springfield'")
+
+    results = search_facilities(conn, "mem hosp springf")
+    assert sorted(result["address_hash"] for result in results) == [1, 2]
+    assert {result["entity_id"] for result in results} == {1}
+    assert results[0]["state_code"] == "IL"
+    assert search_facilities(conn, "Rutledge")[0]["name"] == "Prairie Dialysis", "Streets are searchable."
+    assert {result["entity_id"] for result in search_facilities(conn, "hospital", state="IL")} == {1}
+    assert {result["entity_id"] for result in search_facilities(conn, "springfield", subtype="Dialysis Clinic")} == {2}
+    assert search_facilities(conn, " ,.") == [] and match_expression("St. Mary's") == '"st"* "mary"* "s"*'
+    conn.close()
+
+
+def test_text_index_follows_writes_and_rebuilds(facilities_db):
+    conn = sqlite3.connect(facilities_db)
+    conn.execute("UPDATE entities SET name = 'Springfield Memorial Medical Center' WHERE entity_id = 1")
+    conn.execute("DELETE FROM addresses WHERE address_hash = 3")
+    conn.execute("INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (5, 'Lakeshore Rehab', '140002', '1000000005', 'Hospital', 'Rehabilitation Hospital')")
+    conn.execute("INSERT INTO addresses (ccn, address, city, zip_code, address_hash) VALUES ('140002', '251 E Huron St', 'Chicago', '60611', 6)")
+
+    assert {result["entity_id"] for result in search_facilities(conn, "medical center")} == {1}
+    assert search_facilities(conn, "springfield")[0]["entity_id"] == 1, "A name match outranks a city match."
+    assert search_facilities(conn, "prairie") == [], "Deleting its only address drops the entity from the index."
+    assert [result["entity_id"] for result in search_facilities(conn, "lakeshore reh chicago")] == [5]
+
+    indexed = sorted(conn.execute("SELECT rowid, * FROM entity_search").fetchall())
+    rebuild_search_index(conn)
+    assert sorted(conn.execute("SELECT rowid, * FROM entity_search").fetchall()) == indexed, \
+        "The triggers and the bulk rebuild should index the same rows."
+    conn.close()
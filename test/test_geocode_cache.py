@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import geocode_cache
+from address_geocoder import TokenManager, new_stats, process_addresses
+
+
+@pytest.fixture
+def cache(tmpdir):
+    conn = geocode_cache.open_cache(str(tmpdir.join("cache", "geocode_cache.db")))
+    yield conn
+    conn.close()
+
+
+def test_canonical_address_ignores_cosmetic_differences():
+    key_a = geocode_cache.canonical_address("123 Main St.", "Springfield", "IL", "62704-1234")
+    key_b = geocode_cache.canonical_address("123  MAIN ST", "springfield", "il", "62704")
+    assert key_a == key_b, "Case, punctuation and ZIP+4 should not change the cache key."
+
+
+def test_lookup_respects_ttl(cache):
+    key = geocode_cache.canonical_address("123 Main St", "Springfield", "IL", "62704")
+    geocode_cache.store(cache, key, 39.78, -89.65, now=1000)
+
+    assert geocode_cache.lookup(cache, key, now=1001)["latitude"] == 39.78
+    assert geocode_cache.lookup(cache, key, now=1000 + geocode_cache.POSITIVE_TTL_SECONDS + 1) is None
+
+
+def test_negative_answers_expire_sooner(cache):
+    key = geocode_cache.canonical_address("1 Nowhere Rd", "Gotham", "NY", "10001")
+    geocode_cache.store_not_found(cache, key, now=1000)
+
+    assert geocode_cache.lookup(cache, key, now=1001)["status"] == geocode_cache.STATUS_NOT_FOUND
+    assert geocode_cache.lookup(cache, key, now=1000 + geocode_cache.NEGATIVE_TTL_SECONDS + 1) is None
+
+
+def test_cached_addresses_make_no_api_calls(cache):
+    addresses = [
+        {'address_hash': 1, 'address': "123 Main St", 'city': "Springfield", 'state_code': "IL", 'zip_code': "62704"},
+        {'address_hash': 2, 'address': "1 Nowhere Rd", 'city': "Gotham", 'state_code': "NY", 'zip_code': "10001"},
+    ]
+    geocode_cache.store(cache, geocode_cache.canonical_address("123 Main St", "Springfield", "IL", "62704"), 39.78, -89.65)
+    geocode_cache.store_not_found(cache, geocode_cache.canonical_address("1 Nowhere Rd", "Gotham", "NY", "10001"))
+
+    # No session at all: any token or geocode request would fail the run
+    tokens = TokenManager(session=None)
+    stats = new_stats()
+    results = asyncio.run(process_addresses(addresses, tokens, cache, max_workers=4, stats=stats))
+
+    assert results == [{'address_hash': 1, 'latitude': 39.78, 'longitude': -89.65}]
+    assert stats['cached'] == 2
+    assert stats['requests'] == 0, "Cached addresses should not reach the API."
+    assert tokens.refresh_count == 0, "No access token should be requested when everything is cached."
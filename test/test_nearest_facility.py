@@ -0,0 +1,82 @@
+import sqlite3
+import numpy as np
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from nearest_facility import FacilityGrid, build_subtype_grids, load_facility_points, nearest_by_subtype
+from facility_search import haversine_miles
+
+
+def brute_force(entity_ids, latitudes, longitudes, latitude, longitude, k, miles):
+    """Nearest k distinct entities and the distinct count within miles, one point at a time."""
+    distances = haversine_miles(latitude, longitude, latitudes, longitudes)
+    best = {}
+    for index in np.argsort(distances):
+        best.setdefault(entity_ids[index], distances[index])
+    nearest = sorted(best.items(), key=lambda item: item[1])[:k]
+    count = len({entity_ids[index] for index in np.flatnonzero(distances <= miles)})
+    return [entity for entity, _ in nearest], [distance for _, distance in nearest], count
+
+
+@pytest.mark.parametrize("shared_locations", [False, True])
+def test_grid_matches_brute_force(shared_locations):
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(30, 45, 2000)
+    longitudes = rng.uniform(-110, -80, 2000)
+    # With shared locations most entities are listed at two places
+    entity_ids = rng.integers(0, 1000, 2000) if shared_locations else np.arange(2000)
+    grid = FacilityGrid(entity_ids, latitudes, longitudes, cell_degrees=0.5)
+
+    query_latitudes = rng.uniform(25, 50, 300)
+    query_longitudes = rng.uniform(-120, -70, 300)
+    distances, nearest = grid.nearest(query_latitudes, query_longitudes, k=3)
+    counts = grid.count_within(query_latitudes, query_longitudes, 40)
+
+    for i in range(300):
+        expected_ids, expected_distances, expected_count = brute_force(
+            entity_ids, latitudes, longitudes, query_latitudes[i], query_longitudes[i], 3, 40
+        )
+        np.testing.assert_allclose(distances[i], expected_distances)
+        assert list(nearest[i]) == expected_ids
+        assert counts[i] == expected_count
+
+
+def test_missing_points_and_small_grids():
+    grid = FacilityGrid([7, 8], [39.78, 41.88], [-89.65, -87.63])
+    distances, nearest = grid.nearest([np.nan, 39.8], [np.nan, -89.6], k=3)
+
+    assert np.isinf(distances[0]).all() and (nearest[0] == -1).all(), "NaN query points should get no answer."
+    assert list(nearest[1]) == [7, 8, -1], "Fewer entities than k should be padded."
+    assert np.isinf(distances[1, 2])
+    assert list(grid.count_within([np.nan, 39.8], [np.nan, -89.6], 200)) == [0, 2]
+
+
+def test_nearest_by_subtype_from_database(tmpdir):
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(__file__), "../schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.executemany(
+        "INSERT INTO entities (entity_id, name, ccn, npi, subtype) VALUES (?, ?, ?, ?, ?)",
+        [(1, "Memorial", "140148", "1", "Hospital"), (2, "Prairie", "142500", "2", "Dialysis Clinic"), (3, "Home Health", "", "3", "Home Health Agency")]
+    )
+    conn.executemany(
+        "INSERT INTO addresses (ccn, npi, address, city, address_hash) VALUES (?, ?, ?, 'Springfield', ?)",
+        [("140148", None, "701 N 1st St", 1), ("142500", None, "932 N Rutledge St", 2), (None, "3", "3001 Ash St", 3)]
+    )
+    conn.executemany(
+        "INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (?, ?, ?)",
+        [(1, 39.8092, -89.6536), (2, 39.8110, -89.6560), (3, 39.7590, -89.6120)]
+    )
+    conn.commit()
+    conn.close()
+
+    points = load_facility_points(db_path)
+    assert sorted(points["entity_id"]) == [1, 2, 3]
+
+    result = nearest_by_subtype(build_subtype_grids(points), np.array([39.7817]), np.array([-89.6501]), miles=5)
+    result = result.set_index("subtype")
+    assert result.at["Hospital", "entity_id"] == 1
+    assert result.at["Home Health Agency", "entity_id"] == 3
+    assert list(result["count_within"]) == [1, 1, 1]
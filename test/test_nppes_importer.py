@@ -11,7 +11,9 @@ from nppes_importer import (
     compare_and_update,
     process_nppes,
     map_row_to_entity,
-    extract_addresses
+    extract_addresses,
+    remove_repeated_taxonomy_codes,
+    validate_and_remove_second_duplicate_within_row
 )
 
 
@@ -56,6 +58,12 @@ def test_compare_and_update(sample_datasets):
     assert updated_row["npi"] == nppes_row["NPI"], "NPI should be updated in CMS record."
     assert updated_row["Type"] == nppes_row["Entity Type Code"], "Type should be updated in CMS record."
 
+def test_compare_and_update_skips_columns_the_filter_dropped():
+    # filter_nppes_data keeps the legal business name but not "Parent Organization LBN"
+    nppes_row = pd.Series({"NPI": "1234567890", "Provider Organization Name (Legal Business Name)": "Lakeside Hospice"})
+    assert compare_and_update(nppes_row, pd.Series({"name": "LAKESIDE HOSPICE "}))
+    assert not compare_and_update(nppes_row, pd.Series({"name": "Other Hospice"}))
+
 # Test processing NPPES data for updates and new entities
 def test_process_nppes_updates_and_creates(sample_datasets):
     nppes_data, cms_data = sample_datasets
@@ -92,3 +100,16 @@ def test_extract_addresses(sample_datasets):
     assert address["address"] == "123 Main St", "Address should match NPPES data."
     assert address["city"] == "Springfield", "City should match NPPES data."
     assert address["state_id"] is not None, "State ID should be assigned."
+
+def test_remove_repeated_taxonomy_codes_matches_the_row_wise_check():
+    fields = ["Healthcare Provider Taxonomy Code_1", "Healthcare Provider Taxonomy Code_2", "Healthcare Provider Taxonomy Code_3"]
+    data = pd.DataFrame({
+        fields[0]: ["251G00000X", "282N00000X", None, "261QE0700X"],
+        fields[1]: ["251G00000X", "251E00000X", "251E00000X", "282N00000X"],
+        fields[2]: ["251G00000X", "282N00000X", "251E00000X", None],
+    }, dtype="category")
+
+    expected = data.astype(object).apply(lambda row: validate_and_remove_second_duplicate_within_row(row, fields), axis=1)
+    result = remove_repeated_taxonomy_codes(data, fields)
+    assert result.astype(object).fillna("").values.tolist() == expected.fillna("").values.tolist()
+    assert isinstance(result[fields[1]].dtype, pd.CategoricalDtype)
@@ -0,0 +1,59 @@
+import json
+import pstats
+import pytest
+from datetime import datetime
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import pipeline_metrics
+from pipeline_metrics import profiled, record_rows, run_report, span
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    pipeline_metrics.reset()
+    yield
+    pipeline_metrics.reset()
+
+
+def test_spans_nest_and_count_rows():
+    with span("stage", sample_memory=True):
+        with span("read", file="a.csv") as read_span:
+            read_span.rows = 1000
+        with span("transform", rows=10):
+            record_rows(5)
+        record_rows(7)
+
+    stage = pipeline_metrics.finished_spans[0].to_dict()
+    assert stage["name"] == "stage" and stage["rows"] == 7
+    assert stage["peak_rss_mb"] > 0
+    read, transform = stage["spans"]
+    assert read["file"] == "a.csv" and read["rows"] == 1000 and read["rows_per_second"] > 0
+    assert transform["rows"] == 15
+    assert record_rows(3) is None, "Rows recorded outside a span are ignored."
+
+
+def test_failed_span_is_reported():
+    with pytest.raises(ValueError):
+        with span("stage"):
+            raise ValueError("boom")
+    report = run_report(datetime.now(), skipped=["geocoding"])
+    assert report["stages"][0]["status"] == "failed"
+    assert report["skipped"] == ["geocoding"]
+    json.dumps(report)
+
+
+def test_profilers_write_next_to_the_report(tmpdir):
+    stem = str(tmpdir.join("run_1.stage"))
+    with profiled("cprofile", stem):
+        sorted(range(10000), key=lambda value: -value)
+    assert pstats.Stats(f"{stem}.prof").total_calls > 0
+
+    with profiled("tracemalloc", stem):
+        blocks = [bytearray(1024) for _ in range(100)]
+    assert "Traced memory" in open(f"{stem}.tracemalloc.txt").read()
+    assert blocks
+
+    with pytest.raises(ValueError):
+        with profiled("perf", stem):
+            pass
@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from query_service import create_app
+from test_facility_queries import build_db
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    path = str(tmpdir.join("facilities.db"))
+    build_db(path)
+    return path
+
+
+def test_endpoints(db_path):
+    async def run():
+        async with TestClient(TestServer(create_app(db_path, pool_size=2))) as client:
+            answers = {}
+            for path in [
+                "/entities/ccn/140148", "/entities/npi/1000000004", "/entities/npi/999",
+                "/entities?type=Hospital&state=IL", "/entities?type=Clinic&subtype=Dialysis%20Clinic&zip=62781",
+                "/entities?type=Hospital", "/entities?state=IL", "/addresses/1/entities", "/addresses/x/entities",
+                "/search?q=prairie+dial&state=IL", "/search?q=", "/entities/ccn/140148", "/stats"
+            ]:
+                response = await client.get(path)
+                answers[path] = (response.status, await response.json())
+            return answers
+
+    answers = asyncio.run(run())
+    assert answers["/entities/ccn/140148"][1]["count"] == 2
+    assert answers["/entities/npi/1000000004"][1]["results"][0]["address"] == "3001 Ash St"
+    assert answers["/entities/npi/999"][0] == 404
+    assert [row["entity_id"] for row in answers["/entities?type=Hospital&state=IL"][1]["results"]] == ["1", "1"]
+    assert answers["/entities?type=Clinic&subtype=Dialysis%20Clinic&zip=62781"][1]["count"] == 1
+    assert answers["/entities?type=Hospital"][0] == answers["/entities?state=IL"][0] == 400
+    assert answers["/addresses/1/entities"][1]["count"] == 2
+    assert answers["/addresses/x/entities"][0] == 400
+    assert [row["entity_id"] for row in answers["/search?q=prairie+dial&state=IL"][1]["results"]] == ["2"]
+    assert answers["/search?q="][0] == 400
+    assert answers["/stats"][1]["cache_hits"] == 1, "The repeated CCN lookup is served from the cache."
+
+
+def test_keys_past_2_53_survive_json(db_path):
+    entity_id, address_hash = 2**62 + 1, 2**53 + 1
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO entities (entity_id, name, ccn, npi, type, subtype) VALUES (?, 'Big Key Clinic', '149990', NULL, 'Clinic', 'Dialysis Clinic')", (entity_id,))
+    conn.execute("INSERT INTO addresses (ccn, address, city, state_id, zip_code, address_hash) VALUES ('149990', '5 Elm St', 'Springfield', 17, '62701', ?)", (address_hash,))
+    conn.commit()
+    conn.close()
+
+    async def run():
+        async with TestClient(TestServer(create_app(db_path, pool_size=1))) as client:
+            response = await client.get(f"/addresses/{address_hash}/entities")
+            return await response.json()
+
+    row = asyncio.run(run())["results"][0]
+    assert (row["entity_id"], row["address_hash"]) == (str(entity_id), str(address_hash))
+    # A JavaScript client reading a number would get 2**53 back
+    assert float(row["address_hash"]) == 2**53 and int(row["address_hash"]) == address_hash
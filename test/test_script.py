@@ -11,7 +11,10 @@ import hashlib
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
 
 # Import functions from the main script
-from facilities_importer import process_file, generate_numeric_key, extract_addresses, generate_address_id, get_or_create_state_id, save_states_to_csv
+from facilities_importer import process_file, extract_addresses, generate_address_id, save_states_to_csv
+from nppes_importer import generate_numeric_key
+from dimensions import state_id
+from stable_keys import legacy_address_ids, legacy_key
 
 # Sample datasets for each file
 @pytest.fixture
@@ -67,6 +70,15 @@ def test_general_rules(file_name, sample_datasets):
     assert "Subtype" in processed_data.columns, f"Subtype column missing for {file_name}."
     assert "nucc_code" in processed_data.columns, f"nucc_code column missing for {file_name}."
 
+# Test case for the hospice dataset, imported under its file name
+def test_hospice_rows_import(sample_datasets):
+    file_name = "hospice_dataset.csv"
+    processed_data = process_file(file_name, sample_datasets[file_name])
+
+    assert len(processed_data) == 2, "Every hospice row should become an entity."
+    assert set(processed_data["Subtype"]) == {"Community Based Hospice Care Agency"}
+    assert set(processed_data["nucc_code"]) == {"251G00000X"}
+
 # Test case for "ifCnnIsNumber" subrules
 def test_if_cnn_is_number(sample_datasets):
     file_name = "inpatient_rehabilitation_facility_dataset.csv"
@@ -101,8 +113,10 @@ def test_check_by_field_value(sample_datasets):
 
 # Test case for numeric primary key generation
 def test_generate_numeric_key():
-    assert generate_numeric_key("12345") == 12345, "Numeric key generation failed for numeric input."
-    assert isinstance(generate_numeric_key("ABCDE"), int), "Numeric key generation failed for string input."
+    key = generate_numeric_key("1234567890", "Healthcare Provider Taxonomy Code_1")
+    assert key == generate_numeric_key("1234567890", "Healthcare Provider Taxonomy Code_1"), "Keys should be deterministic."
+    assert key != generate_numeric_key("1234567890", "Healthcare Provider Taxonomy Code_2"), "Every taxonomy slot gets its own key."
+    assert isinstance(key, int) and 0 <= key < 2**63, "Keys should fit a signed 64-bit integer."
 
 @pytest.fixture
 def sample_address_data():
@@ -118,8 +132,8 @@ def sample_address_data():
 @pytest.fixture
 def sample_states_data():
     return [
-        {"state_id": 1, "state_code": "IL", "state_name": "Illinois"},
-        {"state_id": 2, "state_code": "CA", "state_name": "California"}
+        {"state_id": 17, "state_code": "IL", "state_name": "Illinois"},
+        {"state_id": 6, "state_code": "CA", "state_name": "California"}
     ]
 
 # Test for extracting addresses and generating unique address IDs
@@ -139,38 +153,29 @@ def test_extract_addresses(sample_address_data, tmpdir):
         assert "address_id" in addresses_df.columns, "Missing 'address_id' column in addresses CSV."
         assert addresses_df["address"].iloc[0] == "123 Main St Apt 101", "Concatenation of 'Address Line 1' and 'Address Line 2' failed."
 
-# Test for state ID creation and uniqueness
-def test_get_or_create_state_id(sample_states_data):
-    # Initialize the state mapping
-    state_mapping = {state["state_code"]: state for state in sample_states_data}
-    
-    # Mock the state_mapping in the function
-    with patch("facilities_importer.state_mapping", state_mapping):
-        # Add a new state
-        new_state_id = get_or_create_state_id("TX")
-        assert new_state_id == 3, "New StateID should be 3 for 'TX'."
-        assert len(state_mapping) == 3, "State mapping should contain 3 entries after adding a new state."
-        
-        # Retrieve an existing state
-        existing_state_id = get_or_create_state_id("IL")
-        assert existing_state_id == 1, "Existing StateID for 'IL' should be 1."
-        assert len(state_mapping) == 3, "State mapping size should not change when retrieving an existing state."
+# Test for state IDs from the states dimension
+def test_state_id(sample_states_data):
+    for state in sample_states_data:
+        assert state_id(state["state_code"]) == state["state_id"], "State IDs should be the FIPS codes."
+    assert state_id("TX") == 48, "StateID should be 48 for 'TX'."
+    assert state_id("ZZ") == state_id("ZZ") >= 1000, "Unknown codes should get a stable ID of their own."
 
 # Test for saving states to CSV
 def test_save_states_to_csv(sample_states_data, tmpdir):
     states_file = tmpdir.join("states.csv")
     
-    # Mock the state mapping and output file
-    with patch("facilities_importer.state_mapping", {state["state_code"]: state for state in sample_states_data}), \
+    # Mock the seen state codes and output file
+    with patch("facilities_importer.seen_state_codes", {state["state_code"] for state in sample_states_data} | {"ZZ"}), \
          patch("facilities_importer.states_file", str(states_file)):
         # Save states
         save_states_to_csv()
         
         # Validate states CSV content
-        states_df = pd.read_csv(states_file)
-        assert len(states_df) == len(sample_states_data), "Number of states does not match input data."
+        states_df = pd.read_csv(states_file).set_index("state_code")
         assert "state_id" in states_df.columns, "Missing 'StateID' column in states CSV."
-        assert states_df["state_code"].iloc[0] == "IL", "First state code should be 'IL'."
+        for state in sample_states_data:
+            assert states_df.loc[state["state_code"], "state_id"] == state["state_id"], "Preloaded states keep their IDs."
+        assert states_df.loc["ZZ", "state_id"] == state_id("ZZ"), "Seen codes outside the dimension should be added."
 
 # Test for generating unique address IDs
 def test_generate_address_id():
@@ -182,14 +187,17 @@ def test_generate_address_id():
 
     # Generate address ID
     address_id = generate_address_id(cnn, address, city, state, zip_code)
-    
-    # Manually compute the expected address hash for verification
+    assert address_id == generate_address_id(cnn, address, city, state, zip_code + "-1234"), "Only the ZIP5 should count."
+    assert address_id != generate_address_id("67890", address, city, state, zip_code), "Every CCN gets its own address ID."
+    assert 0 <= address_id < 2**63, "Address IDs should fit a signed 64-bit integer."
+
+    # The 9-digit ID of earlier builds, which the key migration maps to the new one
     zip_trimmed = zip_code[:5]
     address_str = f"{address}|{city}|{state}|{zip_trimmed}"
     address_hash = hashlib.md5(address_str.encode()).hexdigest()
     expected_id = int(hashlib.md5(f"{cnn}{address_hash}".encode()).hexdigest(), 16) % (10**9)
-    
-    assert address_id == expected_id, "Generated address ID does not match expected value."
+    assert legacy_address_ids([cnn], [address], [city], [state], [zip_code]).iloc[0] == expected_id
+    assert legacy_key(f"{cnn}{address_hash}") == expected_id
 
 # Test for extracting addresses with missing columns
 def test_extract_addresses_with_missing_columns(sample_address_data, tmpdir):
@@ -211,12 +219,5 @@ def test_extract_addresses_with_missing_columns(sample_address_data, tmpdir):
         assert addresses_df["address"].iloc[0] == "123 Main St", "Address should not include 'Address Line 2'."
 
 # Test for duplicate StateID in case of the same state
-def test_duplicate_state_id(sample_states_data):
-    # Mock the state mapping
-    state_mapping = {state["state_code"]: state for state in sample_states_data}
-    
-    with patch("facilities_importer.state_mapping", state_mapping):
-        state_id_1 = get_or_create_state_id("IL")
-        state_id_2 = get_or_create_state_id("IL")
-        
-        assert state_id_1 == state_id_2, "state_id should be the same for duplicate state codes."
\ No newline at end of file
+def test_duplicate_state_id():
+    assert state_id("IL") == state_id(" il "), "state_id should be the same for duplicate state codes."
\ No newline at end of file
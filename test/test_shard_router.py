@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from facility_queries import FacilityQueries
+from setup_database import create_shards
+from shard_router import ShardRouter
+from test_facility_queries import build_db
+
+SCHEMA = os.path.join(os.path.dirname(__file__), "../schema.sql")
+
+
+@pytest.fixture
+def sharded(tmpdir):
+    db_path = str(tmpdir.join("facilities.db"))
+    build_db(db_path)
+    conn = sqlite3.connect(db_path)
+    # An entity without addresses, which lands in the shard without a state
+    conn.execute("INSERT INTO entities (entity_id, name, npi, type) VALUES (5, 'Nowhere Clinic', '1000000005', 'Clinic')")
+    conn.execute("INSERT INTO address_geolocation (address_hash, latitude, longitude) VALUES (3, 43.07, -89.40)")
+    conn.commit()
+    conn.close()
+    shard_folder = str(tmpdir.join("shards"))
+    create_shards(db_path, shard_folder, SCHEMA)
+    return db_path, shard_folder
+
+
+def test_shards_split_the_database_by_state(sharded):
+    db_path, shard_folder = sharded
+    with open(os.path.join(shard_folder, "manifest.json")) as f:
+        shards = json.load(f)["shards"]
+    assert {shard: entry["state_code"] for shard, entry in shards.items()} == {"17": "IL", "55": "WI", "none": None}
+    assert (shards["17"]["entities"], shards["17"]["addresses"], shards["55"]["address_geolocation"]) == (3, 4, 1)
+    assert shards["55"]["zip_codes"] == ["53705"]
+
+    single = FacilityQueries(db_path)
+    router = ShardRouter(shard_folder)
+    for lookup, args, kwargs in [
+        ("by_ccn", ["140148"], {}), ("by_npi", ["1000000004"], {}), ("by_npi", ["1000000005"], {}),
+        ("by_type", ["Hospital"], {"state": "IL"}), ("by_type", ["Hospital"], {"state": "wi"}),
+        ("by_type", ["Clinic"], {"zip_code": "62781"}), ("at_address", [1], {}), ("at_address", [3], {}),
+    ]:
+        assert getattr(router, lookup)(*args, **kwargs) == getattr(single, lookup)(*args, **kwargs), (lookup, args, kwargs)
+    assert [row["entity_id"] for row in router.search("hospital")] and \
+        sorted(row["entity_id"] for row in router.search("hospital")) == sorted(row["entity_id"] for row in single.search("hospital"))
+
+    fanouts = router.stats()["fanouts"]
+    router.by_type("Clinic", state="IL", limit=5)
+    router.by_type("Hospital", zip_code="53705")
+    assert router.stats()["fanouts"] == fanouts, "Lookups in one state or ZIP code go to one shard."
+    router.close()
+
+
+def test_only_changed_shards_are_rebuilt(sharded):
+    db_path, shard_folder = sharded
+    files = {shard: os.stat(os.path.join(shard_folder, f"facilities_{shard}.db")).st_ino for shard in ["17", "55", "none"]}
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE entities SET name = 'Madison General' WHERE entity_id = 3")
+    conn.commit()
+    conn.close()
+
+    create_shards(db_path, shard_folder, SCHEMA)
+    rebuilt = {shard for shard, inode in files.items() if os.stat(os.path.join(shard_folder, f"facilities_{shard}.db")).st_ino != inode}
+    assert rebuilt == {"55"}
+
+    regional = ShardRouter(shard_folder, states=["WI"])
+    assert [row["name"] for row in regional.by_type("Hospital", state="WI")] == ["Madison General"]
+    assert regional.by_type("Hospital", state="IL") == [], "A regional node serves only its states."
+    regional.close()
+
+    # A regional rebuild into a shared folder leaves the other states' shards alone
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE entities SET name = 'Memorial Hospital of Springfield' WHERE entity_id = 1")
+    conn.commit()
+    conn.close()
+    files = {shard: os.stat(os.path.join(shard_folder, f"facilities_{shard}.db")).st_ino for shard in ["17", "55", "none"]}
+    with open(os.path.join(shard_folder, "manifest.json")) as f:
+        wisconsin = json.load(f)["shards"]["55"]
+    create_shards(db_path, shard_folder, SCHEMA, states=["IL"])
+    assert sorted(os.listdir(shard_folder)) == ["facilities_17.db", "facilities_55.db", "facilities_none.db", "manifest.json"]
+    rebuilt = {shard for shard, inode in files.items() if os.stat(os.path.join(shard_folder, f"facilities_{shard}.db")).st_ino != inode}
+    assert rebuilt == {"17"}
+    with open(os.path.join(shard_folder, "manifest.json")) as f:
+        assert json.load(f)["shards"]["55"] == wisconsin
+
+    # Only the shard of a state left without addresses is removed, whatever the states asked for
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM addresses WHERE state_id = 55")
+    conn.commit()
+    conn.close()
+    create_shards(db_path, shard_folder, SCHEMA, states=["IL"])
+    assert sorted(os.listdir(shard_folder)) == ["facilities_17.db", "facilities_none.db", "manifest.json"]
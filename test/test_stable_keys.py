@@ -0,0 +1,60 @@
+import hashlib
+import pandas as pd
+import pytest
+from unittest.mock import patch
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import nppes_importer
+from stable_keys import (KeyCollisionError, KeyLedger, audit_keys, legacy_keys, load_key_migration, source_strings,
+                         stable_key, stable_keys)
+
+
+def test_stable_keys():
+    sources = pd.Series(["1234567890|Healthcare Provider Taxonomy Code_1", "140001_2", "140001_2"], index=[5, 6, 7])
+    keys = stable_keys(sources)
+    assert str(keys.dtype) == "Int64" and keys.index.tolist() == [5, 6, 7]
+    assert keys.tolist() == [stable_key(source) for source in sources]
+    assert keys[6] == keys[7] != keys[5]
+    assert all(0 <= key < 2**63 for key in keys)
+    # Pinned: a different value means every stored key changed
+    assert stable_key("x") == 9210184024921650663
+
+    assert legacy_keys(sources).tolist() == [int(hashlib.md5(source.encode()).hexdigest(), 16) % (10**9) for source in sources]
+    assert source_strings(pd.Series(["140001", None]), 2, separator="_").tolist() == ["140001_2", "None_2"]
+
+
+def test_audit_keys():
+    assert audit_keys("entity_id", [1, 1, 2, None], ["a", "a", "b", "c"]) == 2, "Repeated sources are not collisions."
+    with pytest.raises(KeyCollisionError, match="1 entity_id values shared by different sources"):
+        audit_keys("entity_id", [1, 1, 2], ["a", "b", "c"])
+
+
+def test_ledger_audits_across_files_and_saves_the_migration(tmpdir):
+    ledger = KeyLedger()
+    ledger.add("address_hash", [10, 20], ["A", "B"], [[1, 2], [7, 8]])
+    ledger.add("address_hash", [30], ["C"], [[2]])
+    assert ledger.audit() == {"address_hash": 3}
+
+    path = str(tmpdir.join("key_migration.csv"))
+    ledger.save(path)
+    migration = load_key_migration(path, "address_hash")
+    assert sorted(zip(migration["old_id"], migration["new_id"])) == [(1, 10), (7, 10), (8, 20)], \
+        "Old id 2 led to two new ids and is left out."
+
+    ledger.add("address_hash", [30], ["D"])
+    with pytest.raises(KeyCollisionError):
+        ledger.audit()
+
+
+def test_nppes_entities_colliding_with_cms_ones_stop_the_save(tmpdir):
+    cms_file = tmpdir.join("entities.csv")
+    cms_file.write("entity_id,name,ccn,npi,Type,Subtype,nucc_code\n42,Hospice A,141501,,Agency,Hospice,251G00000X\n")
+    nppes_importer.key_ledger.clear()
+    nppes_importer.key_ledger.add("entity_id", [42], ["1234567890|Healthcare Provider Taxonomy Code_1"])
+
+    with patch("nppes_importer.cms_file", str(cms_file)), patch("nppes_importer.addresses_file", str(tmpdir.join("addresses.csv"))):
+        with pytest.raises(KeyCollisionError):
+            nppes_importer.save_to_cms_file([{"entity_id": 42, "name": "Other Hospice", "npi": "1234567890"}], [])
+    assert pd.read_csv(str(cms_file))["name"].tolist() == ["Hospice A"], "Nothing is written after a collision."
+    nppes_importer.key_ledger.clear()
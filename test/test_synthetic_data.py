@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import facilities_importer
+from facilities_importer import column_mapping, file_rules_mapping, files
+from filter_nppes_data import required_columns as nppes_columns
+from synthetic_data import CMS_DATASETS, NPPES_FILTERED_FILE, NPPES_RAW_FILE, generate_datasets, write_datasets
+
+
+@pytest.fixture(scope="module")
+def datasets():
+    return generate_datasets(scale=0.5, seed=3)
+
+
+def test_files_have_the_columns_the_importers_read(datasets):
+    for file in files:
+        data = datasets[file]
+        for column, alternatives in column_mapping.items():
+            assert any(alt in data.columns for alt in alternatives), f"{file} has no {column} column"
+        ccn_column = CMS_DATASETS[file]["ccn_column"]
+        assert data[ccn_column].is_unique and data[ccn_column].str.len().ge(6).all()
+        assert "Facility Name" in data.columns or "Provider Name" in data.columns
+
+    hospital_types = set(datasets["hospital_general_information_dataset.csv"]["Hospital Type"])
+    assert hospital_types <= set(file_rules_mapping["hospital_general_information_dataset.csv"]["SubRules"])
+    assert set(file_rules_mapping["home_health_agency_dataset.csv"]["SubRules"]) <= set(datasets["home_health_agency_dataset.csv"].columns)
+
+    raw, filtered = datasets[NPPES_RAW_FILE], datasets[NPPES_FILTERED_FILE]
+    assert list(filtered.columns) == nppes_columns and len(raw.columns) > len(nppes_columns)
+    assert set(raw["Entity Type Code"]) == {"1", "2"} and raw["NPI Deactivation Date"].notna().any()
+    assert (filtered["Entity Type Code"] == "2").all() and filtered["NPI Deactivation Date"].isna().all()
+    assert filtered["NPI"].is_unique
+
+
+def test_addresses_and_taxonomies_are_shared_like_the_real_data(datasets):
+    hospitals = datasets["hospital_general_information_dataset.csv"]
+    units = datasets["inpatient_rehabilitation_facility_dataset.csv"]
+    units = units[units["CMS Certification Number (CCN)"].str[2] == "T"]
+    assert not units.empty
+    assert units["Address Line 1"].str.upper().isin(hospitals["Address"].str.split(" BLDG| SUITE| STE| UNIT| FLOOR").str[0]).all(), \
+        "IRF units should sit at a hospital's address."
+
+    filtered = datasets[NPPES_FILTERED_FILE]
+    cms_names = pd.concat([datasets[file].get("Facility Name", datasets[file].get("Provider Name")) for file in files]).str.upper()
+    assert filtered["Provider Organization Name (Legal Business Name)"].isin(cms_names).mean() > 0.1
+
+    codes = filtered.filter(like="Healthcare Provider Taxonomy Code_")
+    counts = codes.notna().sum(axis=1)
+    assert (counts == 1).mean() > 0.5 and counts.max() > 5
+    assert (codes["Healthcare Provider Taxonomy Code_1"] == codes["Healthcare Provider Taxonomy Code_2"]).any()
+
+
+def test_generation_is_deterministic_and_scales(datasets):
+    again = generate_datasets(scale=0.5, seed=3)
+    for path, frame in datasets.items():
+        pd.testing.assert_frame_equal(frame, again[path])
+    bigger = generate_datasets(scale=1, seed=3)
+    assert len(bigger["dialysis_facility_dataset.csv"]) == 2 * len(datasets["dialysis_facility_dataset.csv"])
+    assert len(bigger[NPPES_RAW_FILE]) == 2 * len(datasets[NPPES_RAW_FILE])
+
+
+def test_cms_import_runs_on_the_synthetic_files(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    rows = write_datasets("datasets", scale=0.2, seed=1)
+    assert rows[os.path.join("datasets", NPPES_FILTERED_FILE)] > 0
+    facilities_importer.main()
+
+    entities = pd.read_csv("datasets/output/entities.csv", dtype={"ccn": str})
+    subtypes = set(entities["Subtype"].dropna())
+    assert {"Dialysis Clinic", "Skilled Nursing Facility", "Home Health Agency (All)", "Rehabilitation Hospital Unit"} <= subtypes
+    addresses = pd.read_csv("datasets/output/addresses.csv")
+    assert addresses["address_hash"].duplicated().any(), "Some facilities should share an address."
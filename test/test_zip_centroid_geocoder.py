@@ -0,0 +1,70 @@
+import sqlite3
+import numpy as np
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+from zip_centroid_geocoder import load_zip_centroids, normalize_zip5, prefill_geolocation, ZIP_CENTROIDS_FILE
+from address_geocoder import load_addresses_from_db, save_results_to_db
+
+CENTROIDS_PATH = os.path.join(os.path.dirname(__file__), "..", ZIP_CENTROIDS_FILE)
+
+
+@pytest.fixture(scope="module")
+def centroids():
+    return load_zip_centroids(CENTROIDS_PATH)
+
+
+@pytest.fixture
+def facilities_db(tmpdir):
+    db_path = str(tmpdir.join("facilities.db"))
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(os.path.dirname(__file__), "../schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO states (state_id, state_code, state_name) VALUES (1, 'IL', 'Illinois')")
+    conn.executemany(
+        "INSERT INTO addresses (address, city, state_id, zip_code, address_hash) VALUES (?, 'Springfield', 1, ?, ?)",
+        [("1 Main St", "62704", 1), ("2 Main St", "62704", 1), ("3 Oak St", "62701", 2), ("4 Nowhere Rd", "00000", 3)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_normalize_zip5():
+    normalized = normalize_zip5(["62704-1234", 2134, "02134.0", None]).tolist()
+    assert normalized[:3] == ["62704", "02134", "02134"]
+    assert normalized[3] != normalized[3], "Missing ZIPs should stay missing."
+
+
+def test_lookup_is_vectorized_and_marks_unknown_zips(centroids):
+    latitudes, longitudes = centroids.lookup(["62704", "00000", "10001"])
+
+    assert abs(latitudes[0] - 39.77) < 0.1 and abs(longitudes[0] + 89.69) < 0.1
+    assert np.isnan(latitudes[1]), "Unknown ZIPs should have no coordinates."
+    assert abs(latitudes[2] - 40.75) < 0.1
+
+
+def test_prefill_then_upgrade_to_rooftop(facilities_db, centroids):
+    assert prefill_geolocation(facilities_db, centroids) == 2
+
+    conn = sqlite3.connect(facilities_db)
+    precisions = dict(conn.execute('SELECT address_hash, "precision" FROM address_geolocation').fetchall())
+    conn.close()
+    assert precisions == {1: "zip", 2: "zip"}
+
+    # Addresses without coordinates come first, then ZIP rows shared by the most entities
+    pending = [address['address_hash'] for address in load_addresses_from_db(facilities_db)]
+    assert pending == [3, 1, 2]
+
+    save_results_to_db([{'address_hash': 1, 'latitude': 39.75, 'longitude': -89.65}], facilities_db)
+    conn = sqlite3.connect(facilities_db)
+    row = conn.execute('SELECT latitude, "precision" FROM address_geolocation WHERE address_hash = 1').fetchone()
+    conn.close()
+    assert row == (39.75, "rooftop"), "An API geocode should upgrade the ZIP centroid."
+
+    # A second pre-fill never downgrades rooftop rows
+    prefill_geolocation(facilities_db, centroids)
+    conn = sqlite3.connect(facilities_db)
+    assert conn.execute('SELECT "precision" FROM address_geolocation WHERE address_hash = 1').fetchone() == ("rooftop",)
+    conn.close()
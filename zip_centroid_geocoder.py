@@ -0,0 +1,102 @@
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from address_geocoder import prepare_geolocation_table
+from pipeline_metrics import record_rows
+
+# Bundled ZIP5 centroid table (zip_code, state_code, latitude, longitude)
+ZIP_CENTROIDS_FILE = "./zip5_centroids.csv.gz"
+db_path = "facilities.db"
+
+PRECISION_ZIP = "zip"
+PRECISION_ROOFTOP = "rooftop"
+
+
+def normalize_zip5(zip_codes):
+    """
+    Vectorized ZIP5 normalization: keeps the leading digits, cuts ZIP+4 and restores leading
+    zeros lost when ZIPs were read as numbers. Returns a string Series (NaN when there are no digits).
+    """
+    digits = pd.Series(zip_codes, dtype="object").astype(str).str.extract(r"^\s*(\d+)", expand=False)
+    return digits.str[:5].str.zfill(5)
+
+
+class ZipCentroidIndex:
+    """
+    ZIP5 centroids held in sorted NumPy arrays; lookups are a vectorized binary search.
+    """
+    def __init__(self, zip_codes, latitudes, longitudes):
+        order = np.argsort(zip_codes)
+        self.zip_codes = np.asarray(zip_codes, dtype=np.int32)[order]
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)[order]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def lookup(self, zip_codes):
+        """
+        Returns latitude and longitude arrays for the given ZIP codes (any format accepted by
+        normalize_zip5), with NaN where the ZIP is unknown.
+        """
+        keys = pd.to_numeric(normalize_zip5(zip_codes), errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(keys)
+        keys = np.where(valid, keys, -1).astype(np.int32)
+        positions = np.clip(np.searchsorted(self.zip_codes, keys), 0, len(self.zip_codes) - 1)
+        found = valid & (self.zip_codes[positions] == keys)
+        latitudes = np.where(found, self.latitudes[positions], np.nan)
+        longitudes = np.where(found, self.longitudes[positions], np.nan)
+        return latitudes, longitudes
+
+
+def load_zip_centroids(path=ZIP_CENTROIDS_FILE):
+    """Loads the bundled ZIP5 centroid table into a ZipCentroidIndex."""
+    centroids = pd.read_csv(path, dtype={"zip_code": str})
+    return ZipCentroidIndex(centroids["zip_code"].astype(np.int32).to_numpy(), centroids["latitude"].to_numpy(), centroids["longitude"].to_numpy())
+
+
+def prefill_geolocation(db_path, index=None):
+    """
+    Gives every address without coordinates its ZIP5 centroid, marked with precision 'zip'.
+    Rows that already have coordinates are left alone, so API geocodes are never downgraded.
+    Returns the number of rows inserted.
+    """
+    index = load_zip_centroids() if index is None else index
+    prepare_geolocation_table(db_path)
+    conn = sqlite3.connect(db_path)
+    missing = pd.read_sql_query("""
+        SELECT a.address_hash, MIN(a.zip_code) AS zip_code
+        FROM addresses a
+        LEFT JOIN address_geolocation g ON g.address_hash = a.address_hash
+        WHERE g.address_hash IS NULL
+        GROUP BY a.address_hash
+    """, conn)
+
+    latitudes, longitudes = index.lookup(missing["zip_code"])
+    found = ~np.isnan(latitudes)
+    rows = zip(
+        missing["address_hash"].to_numpy()[found].tolist(),
+        latitudes[found].tolist(),
+        longitudes[found].tolist()
+    )
+    conn.executemany("""
+        INSERT INTO address_geolocation (address_hash, latitude, longitude, "precision")
+        VALUES (?, ?, ?, 'zip')
+        ON CONFLICT (address_hash) DO NOTHING
+    """, rows)
+    conn.commit()
+    conn.close()
+    print(f"ZIP centroids assigned to {int(found.sum())} of {len(missing)} addresses without coordinates.")
+    record_rows(int(found.sum()))
+    return int(found.sum())
+
+
+def main():
+    start_time = time.time()
+    prefill_geolocation(db_path)
+    print(f"ZIP centroid pre-fill finished in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()